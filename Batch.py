@@ -0,0 +1,239 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+"""
+Headless runner of a batch of sweeps, in optic of the EARLYBIRD research project : https://hal.science/hal-04663862v1
+The devices are connected and set up once, then every job of the batch file runs back to back on them,
+each one streamed to its own capture (Emulator.Recorder.Capture reads it back) :
+    python Batch.py jobs.json [--sim] [--out captures/batch] [--ppks all|SERIAL,SERIAL]
+--ppks reads several PPK2 at once, each one by its own process (Emulator.MultiPPK) :
+every setpoint waits for all of them and every point measures all of them, one table per PPK2.
+Batch file : a list of jobs, or {"defaults": {...}, "jobs": [...]}, each job (defaults first) with
+    name      name of its capture directory (job number by default)
+    V_min, V_max, step  voltages of the sweep, in V
+    slopes    ramps between V_min and V_max (2 : up and down)
+    current   current limit of the power supply, in A
+    source    'PPK' (current of the power profiler) or 'PS' (readback of the supply)
+    channel   oscilloscope channel, as OSCI.set_channel (number, name, vertical_scale, ...), or a list of them,
+              the settings left out are the ones of the default channel (name : CH<number>)
+    timeout   longest wait for the current to settle at each point, in s
+    segmented true : one segment of the scope per step, triggered by a GPIO of the DUT on EXT TRIG and pulled
+              by blocks (OSCI.set_segmented_mode), rather than a query per point
+"""
+
+from Emulator import PSemu,PPKemu,OSCIemu
+from Emulator.Store import Store
+from Emulator.Sampler import Sampler
+from Emulator.Settle import Settler,PPKSource,PSSource
+from Emulator.Recorder import Recorder
+from Emulator.MultiPPK import MultiPPK
+from Emulator import Sweep,Join
+import argparse
+import json
+import os
+import sys
+import time
+
+DEFAULTS = {"name":None,"V_min":1.85,"V_max":5.00,"step":0.05,"slopes":2,"current":1,"source":'PPK',"timeout":0.5,"segmented":False,
+            "channel":{"number":'1',"name":"albert","probe_ratio":'1',"vertical_scale":'2',"vertical_unit_name":"V",
+                       "offset":'0',"offset_unit_name":"V","display":"ON"}}
+
+def _number(value) -> bool:
+    return isinstance(value,(int,float)) and not isinstance(value,bool)
+
+def check_job(job:dict) -> str:
+    """ What is wrong with a job completed with the defaults, None if it can run """
+    for key in ('V_min','V_max','step','current','timeout'):
+        if not _number(job[key]):
+            return f"{key} should be a number, not {job[key]!r}"
+    if job['V_min'] < 0 or job['V_min'] >= job['V_max']:
+        return f"V_min {job['V_min']} V should be positive and below V_max {job['V_max']} V"
+    if job['step'] <= 0 or job['step'] > job['V_max']-job['V_min']:
+        return f"step {job['step']} V should be above 0 and at most V_max-V_min"
+    if not isinstance(job['slopes'],int) or isinstance(job['slopes'],bool) or job['slopes'] < 1:
+        return f"slopes should be an integer, at least 1, not {job['slopes']!r}"
+    if job['current'] <= 0 or job['timeout'] <= 0:
+        return "current and timeout should be above 0"
+    if job['source'] not in ('PPK','PS'):
+        return f"source should be 'PPK' or 'PS', not {job['source']!r}"
+    if not isinstance(job['segmented'],bool):
+        return f"segmented should be true or false, not {job['segmented']!r}"
+    return None
+
+def check_channels(channels) -> list:
+    """ Channels of a job as OSCI.set_channel takes them, completed with the default channel, ValueError if wrong """
+    if isinstance(channels,dict):
+        channels = [channels]
+    if not isinstance(channels,list) or not channels:
+        raise ValueError(f"channel should be a channel or a list of them, not {channels!r}")
+    checked = []
+    for channel in channels:
+        if not isinstance(channel,dict) or 'number' not in channel:
+            raise ValueError(f"channel {channel!r} : its number is missing")
+        unknown = set(channel)-set(DEFAULTS['channel'])
+        if unknown:
+            raise ValueError(f"channel {channel['number']} : unknown setting(s) {', '.join(sorted(unknown))}")
+        number = str(channel['number'])
+        if number not in ('1','2','3','4'):
+            raise ValueError(f"channel number should be 1 to 4, not {channel['number']!r}")
+        channel = {**DEFAULTS['channel'],"name":f"CH{number}",**{key:str(value) for key,value in channel.items()}}
+        OSCIemu.OSCI._check_label(channel['name'])
+        checked.append(channel)
+    if len({channel['number'] for channel in checked}) != len(checked):
+        raise ValueError("a channel number is used twice")
+    return checked
+
+def load_jobs(path:str) -> list:
+    """ Jobs of a batch file, completed with the defaults and checked before any device is touched """
+    try:
+        with open(path) as f:
+            batch = json.load(f)
+    except (OSError,ValueError) as e:
+        sys.exit(f"{path} : {e}")
+    if isinstance(batch,list):
+        batch = {"jobs":batch}
+    if not isinstance(batch,dict) or not isinstance(batch.get('jobs'),list) or not isinstance(batch.get('defaults',{}),dict):
+        sys.exit(f"{path} : a list of jobs, or {{\"defaults\": {{...}}, \"jobs\": [...]}} expected")
+    unknown = set(batch.get('defaults',{}))-set(DEFAULTS)
+    if unknown:
+        sys.exit(f"defaults : unknown setting(s) {', '.join(sorted(unknown))}")
+    defaults = dict(DEFAULTS,**batch.get('defaults',{}))
+    jobs = []
+    for number,job in enumerate(batch['jobs']):
+        if not isinstance(job,dict):
+            sys.exit(f"job {number} : a dictionary of settings expected, not {job!r}")
+        unknown = set(job)-set(DEFAULTS)
+        if unknown:
+            sys.exit(f"job {number} : unknown setting(s) {', '.join(sorted(unknown))}")
+        job = dict(defaults,**job)
+        error = check_job(job)
+        if error:
+            sys.exit(f"job {number} : {error}")
+        try:
+            job['channel'] = check_channels(job['channel'])
+        except ValueError as e:
+            sys.exit(f"job {number} : {e}")
+        job['name'] = f"{number:03d}-{job['name'] if job['name'] is not None else 'job'}"
+        jobs.append(job)
+    return jobs
+
+class Batch:
+    """ Devices opened once for the whole batch, run() executes one job on them """
+    def __init__(self,jobs:list,out:str,bench=None,ppks:list=None):
+        """ ppks : serial numbers of several PPK2 read at once ([] for all of them), None for one PPK """
+        self.jobs = jobs
+        self.out = out
+        self.store = Store()
+        self.ps = PSemu.PS(store=self.store)
+        self.osci = OSCIemu.OSCI(store=self.store)
+        self.ppk = None
+        if any(job['source'] == 'PPK' for job in jobs):
+            self.ppk = PPKemu.PPK(store=self.store) if ppks is None else MultiPPK(ppks or None,store=self.store)
+        self.devices = [device for device in (self.ps,self.ppk,self.osci) if device is not None]
+        for device in self.devices:
+            if bench is not None:
+                device.connect_to_simulator(bench)
+            else:
+                device.connect_to_device()
+        # the full rate stream of the PPK runs through the whole batch, in one capture
+        self.recorder = Recorder(out)
+        first = jobs[0]
+        for channel in first['channel']:
+            self.osci.set_channel(int(channel['number']),channel)
+        self.ps.setup(first['V_min'],first['current'])
+        if self.ppk is not None:
+            for ppk in self.profilers():
+                ppk.recorder = self.recorder
+            self.ppk.setup()
+        self.osci.setup()
+        time.sleep(0.5) # to be sure everyone is ready
+
+    def profilers(self) -> list:
+        """ Every PPK2 read """
+        return self.ppk.ppks if isinstance(self.ppk,MultiPPK) else [self.ppk]
+
+    def sources(self):
+        """ Current(s) the Settler waits for after each setpoint """
+        return self.ppk.sources() if isinstance(self.ppk,MultiPPK) else PPKSource(self.ppk)
+
+    def run(self,job:dict) -> dict:
+        """ Sweep of one job, its tables streamed to <out>/<name> while it runs, return its summary """
+        for channel in job['channel']:     # only the settings that changed are sent
+            self.osci.set_channel(int(channel['number']),channel)
+        for table in self.store.tables.values():     # the memory holds one job at a time
+            table.clear()
+        if job['segmented']:
+            # the first point must be a new setpoint for the DUT to signal it, as the 1.8 V of Main.py
+            park = job['V_min']-job['step'] if job['V_min'] >= job['step'] else job['V_min']+job['step']
+            self.ps.setOperatingPoint(park,job['current'])
+            self.osci.set_segmented_mode()
+            self.osci.arm()
+        else:
+            self.osci.set_measure_mode()
+        recorder = Recorder(os.path.join(self.out,job['name']))
+        self.store.recorder = recorder
+        if job['source'] == 'PPK':
+            sampler = Sampler(self.osci,self.ps,self.ppk)
+            settler,source,marks = Settler(window=0.02,timeout=job['timeout']),self.sources(),[self.ppk]
+            currents,scale = [ppk.log for ppk in self.profilers()],1e-6        # uA to A
+        else:
+            sampler = Sampler(self.osci,self.ps)
+            settler,source,marks = Settler(window=0.05,min_samples=3,timeout=job['timeout']),PSSource(self.ps),[]
+            currents,scale = [self.ps.log],1
+        profile = Sweep.back_and_forth(job['V_min'],job['V_max'],job['step'],job['slopes'])
+        sweep = Sweep.Sweep(self.ps,profile,job['current'],measure=sampler.sample,settler=settler,source=source,marks=marks)
+        summary = {"job":job,"points":len(profile),"done":0,"error":None}
+        start = time.monotonic()
+        try:
+            summary['done'] = sweep.run()
+            self.ps.flush()     # last readbacks of the supply in the tables
+            self.osci.collect()
+            # voltage, current and power of each point, as plotted by Main.py ('Power <PPK>' for several PPK2)
+            for current in currents:
+                merged = Join.merge(self.osci.waveforms,job['channel'][0]['name'],current,scale=scale)
+                name = 'Power' if len(currents) == 1 else 'Power '+current.name
+                recorder.write(name,**{column:merged[column] for column in merged.columns})
+        except Exception as e:     # the next jobs still run, the error is in the summary
+            summary['error'] = repr(e)
+        finally:
+            sampler.close()
+            summary['duration'] = time.monotonic()-start
+            self.store.recorder = None
+            recorder.close()
+        with open(os.path.join(recorder.path,'job.json'),'w') as f:
+            json.dump(summary,f,indent=1)
+        return summary
+
+    def release(self):
+        for device in self.devices:
+            device.release()
+        self.recorder.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a batch of sweeps on the devices, opened once")
+    parser.add_argument('jobs',help="batch file (JSON)")
+    parser.add_argument('--sim',action='store_true',help="simulated devices (Emulator.SIMemu)")
+    parser.add_argument('--out',default=time.strftime('captures/batch-%Y%m%d-%H%M%S'),help="capture directory of the batch")
+    parser.add_argument('--ppks',help="several PPK2, each one read by its own process : 'all' or serial numbers, comma separated")
+    args = parser.parse_args(argv)
+    ppks = None if args.ppks is None else [] if args.ppks == 'all' else args.ppks.split(',')
+    jobs = load_jobs(args.jobs)
+    if not jobs:
+        sys.exit("no job in "+args.jobs)
+    bench = None
+    if args.sim:
+        from Emulator.SIMemu import Bench
+        bench = Bench()
+    batch = Batch(jobs,args.out,bench,ppks)
+    failed = 0
+    try:
+        for job in jobs:
+            summary = batch.run(job)
+            failed += summary['error'] is not None
+            print(f"{job['name']} : {summary['done']}/{summary['points']} points in {summary['duration']:.1f} s"
+                  + (f", {summary['error']}" if summary['error'] else ''))
+    finally:
+        batch.release()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,320 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+"""
+Benchmark suite of the instrument I/O and analysis hot paths
+Run it from the repository root :
+    python -m Benchmark.bench                          simulated devices, 1 ms +- 0.2 ms per round trip
+    python -m Benchmark.bench --latency 0.02 --jitter 0.005
+    python -m Benchmark.bench --hardware               the devices connected to this computer
+    python -m Benchmark.bench --output new.json --baseline old.json --threshold 0.2
+With --baseline, the exit code is 1 if a result is worse than the baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import numpy as np
+from Emulator import PSemu,PPKemu,OSCIemu,Analysis
+from Emulator.PPKdecoder import PPKDecoder
+from Emulator.SIMemu import Bench
+from Emulator.Store import Store
+from Benchmark.bench_ppk_decoder import synthetic_dump,reference_api
+
+CASES = []
+
+def case(function):
+    """ Register a benchmark case, it returns a list of results """
+    CASES.append(function)
+    return function
+
+def latency_result(name:str,durations:list) -> dict:
+    durations = np.asarray(durations)
+    return {"name":name,"unit":"s","better":"lower","value":float(durations.mean()),
+            "p50":float(np.percentile(durations,50)),"p99":float(np.percentile(durations,99)),"n":len(durations)}
+
+def throughput_result(name:str,items:int,duration:float,unit:str) -> dict:
+    return {"name":name,"unit":unit,"better":"higher","value":items/duration,"n":items}
+
+def timed(function,repeat:int) -> list:
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter()-start)
+    return durations
+
+class Context:
+    """ Devices under benchmark, connected once for the whole suite """
+    def __init__(self,args):
+        self.args = args
+        self.store = Store()
+        self.bench = None if args.hardware else Bench(latency=args.latency,jitter=args.jitter,seed=0)
+        self.devices = {}
+
+    def connect(self,name:str):
+        """ Connected emulator, None if it is not available """
+        if name in self.devices:
+            return self.devices[name]
+        device = {'PS':PSemu.PS,'PPK':PPKemu.PPK,'OSCI':OSCIemu.OSCI}[name](store=self.store)
+        try:
+            if self.bench is not None:
+                device.connect_to_simulator(self.bench)
+            else:
+                device.connect_to_device()
+            if name == 'PS':
+                device.setup(1.8,0.1)
+            elif name == 'PPK':
+                device.setup()
+            else:
+                device.set_channel_setting('display','ON',1)
+                device.setup()
+        except SystemExit as e:
+            print(f"{name} not available : {e}",file=sys.stderr)
+            device = None
+        self.devices[name] = device
+        return device
+
+    def release(self):
+        for device in self.devices.values():
+            if device is not None:
+                device.release()
+
+@case
+def import_time(ctx):
+    from Benchmark.bench_import import measure
+    result = measure()
+    return [{"name":"import of the emulators","unit":"s","better":"lower","value":result['duration'],
+             "loaded":result['loaded'],"n":1}]
+
+@case
+def ps_round_trip(ctx):
+    ps = ctx.connect('PS')
+    if ps is None:
+        return []
+    voltages = iter(np.tile([1.8,2.5],ctx.args.repeat))
+    def step():
+        ps.setOperatingPoint(next(voltages),0.1)
+        ps.getOperatingPoint()
+    steps = [latency_result("ps.setOperatingPoint+getOperatingPoint",timed(step,ctx.args.repeat))]
+    # in a sweep : the readback runs on the I/O thread of the supply while the other devices are
+    # measured and the point processed (5 ms here), only the time spent by the sweep is counted
+    durations = []
+    for voltage in np.tile([1.8,2.5],ctx.args.repeat)[:ctx.args.repeat]:
+        start = time.perf_counter()
+        ps.setOperatingPoint(voltage,0.1)    # the current limit is only sent once
+        ps.measure()
+        durations.append(time.perf_counter()-start)
+        time.sleep(0.005)
+    ps.flush()
+    steps.append(latency_result("ps.setOperatingPoint+measure (pipelined)",durations))
+    # back to back, nothing to overlap : the next setpoint waits for the readback, 3 round trips a step
+    voltages = iter(np.tile([1.8,2.5],ctx.args.repeat))
+    def back_to_back():
+        ps.setOperatingPoint(next(voltages),0.1)
+        ps.measure()
+    steps.append(latency_result("ps.setOperatingPoint+measure (back to back)",timed(back_to_back,ctx.args.repeat)))
+    ps.flush()
+    return steps
+
+@case
+def osci(ctx):
+    osci = ctx.connect('OSCI')
+    if osci is None:
+        return []
+    results = []
+    channels = sum(ch['display']=='ON' for ch in osci.config.channels)
+    osci.set_measure_mode()
+    durations = timed(osci.measure,ctx.args.repeat)
+    results.append(latency_result("osci.measure per channel (VMAX query)",np.array(durations)/channels))
+    osci.set_waveform_mode('WORD',1000)
+    durations = timed(osci.measure,ctx.args.repeat)
+    results.append(latency_result("osci.measure per channel (WORD waveform, 1000 points)",np.array(durations)/channels))
+    ps = ctx.connect('PS')     # its setpoints trigger the segments
+    if ps is not None:
+        osci.set_segmented_mode(ctx.args.repeat+1,'WORD',1000)
+        osci.arm()
+        durations = []
+        for voltage in np.tile([2.0,2.2],ctx.args.repeat)[:ctx.args.repeat]:    # a new voltage at each step
+            ps.setOperatingPoint(voltage,0.1)
+            start = time.perf_counter()
+            osci.measure()
+            durations.append(time.perf_counter()-start)
+        results.append(latency_result("osci.measure per step (segmented)",durations))
+        results.append(latency_result(f"osci.collect ({ctx.args.repeat} segments, WORD, 1000 points)",timed(osci.collect,1)))
+    osci.set_measure_mode()
+    scales = iter(np.tile(['1','2'],ctx.args.repeat))
+    results.append(latency_result("osci.set_channel_setting (one setting changed)",
+                                  timed(lambda:osci.set_channel_setting('vertical_scale',next(scales),1),ctx.args.repeat)))
+    def reconfigure():
+        osci.config.applied.clear()      # as after a reconnection, every setting is sent
+        osci.setup()
+    results.append(latency_result("osci.setup (whole configuration)",timed(reconfigure,max(1,ctx.args.repeat//10))))
+    return results
+
+@case
+def ppk_decode(ctx):
+    data = synthetic_dump(ctx.args.seconds)
+    chunks = [data[i:i+2000] for i in range(0,len(data),2000)]   # 5 ms of stream per read
+    decoder = PPKDecoder.from_api(reference_api())
+    start = time.perf_counter()
+    samples = sum(len(decoder.decode(chunk)[0]) for chunk in chunks)
+    return [throughput_result("ppk decode (PPKDecoder, 2000 byte chunks)",samples,time.perf_counter()-start,"samples/s")]
+
+@case
+def ppk_stream(ctx):
+    ppk = ctx.connect('PPK')
+    if ppk is None:
+        return []
+    start = ppk.buffer.head
+    time.sleep(1)
+    samples = ppk.buffer.head - start
+    return [{"name":"ppk acquired stream","unit":"samples/s","better":"higher","value":samples,"n":samples}]
+
+@case
+def ppk_pyramid(ctx):
+    from Emulator.RingBuffer import RingBuffer
+    from Emulator.Pyramid import Pyramid
+    samples = int(ctx.args.seconds*100000)
+    current = np.random.default_rng(0).normal(1000,5,samples).astype('float32')
+    t = np.arange(samples)/100000
+    raw = RingBuffer(samples,'float32')
+    pyramid = Pyramid(raw=raw)
+    start = time.perf_counter()
+    for i in range(0,samples,500):    # 5 ms of stream per read
+        raw.push(current[i:i+500],t[i:i+500])
+        pyramid.push(current[i:i+500],t[i:i+500])
+    results = [throughput_result("ppk pyramid push (500 sample chunks)",samples,time.perf_counter()-start,"samples/s")]
+    from Emulator.Energy import Integrator
+    integrator = Integrator()
+    start = time.perf_counter()
+    for i in range(0,samples,500):
+        integrator.push(current[i:i+500],t[i:i+500])
+    results.append(throughput_result("ppk charge integrator push (500 sample chunks)",samples,time.perf_counter()-start,"samples/s"))
+    edges = iter(np.random.default_rng(1).integers(0,samples//2,(ctx.args.repeat,2)))
+    def window():
+        first,length = next(edges)
+        pyramid.stats(first,first+length)
+    results.append(latency_result("ppk pyramid stats of a window",timed(window,ctx.args.repeat)))
+    return results
+
+def sweep_logs(points:int):
+    """ Logs of a 2 slope sweep with `points` points """
+    ramp = np.linspace(1.8,5.0,max(1,points//2))    # finer than the centivolt steps of Sweep profiles
+    voltage = np.concatenate([ramp,ramp[::-1]])
+    slope = np.repeat([0,1],len(ramp)).astype(np.int32)
+    current = 1000 + 200*voltage + np.random.default_rng(0).normal(0,5,len(voltage))
+    return voltage,current,slope
+
+@case
+def analysis(ctx):
+    voltage,current,slope = sweep_logs(ctx.args.points)
+    durations = timed(lambda:Analysis.hysteresis(voltage,current,slope,scale=1e-3),5)
+    aligned = timed(lambda:Analysis.hysteresis(voltage,current,slope,scale=1e-3,setpoint=voltage),5)
+    return [latency_result(f"Analysis.hysteresis ({len(voltage)} points)",durations),
+            latency_result(f"Analysis.hysteresis ({len(voltage)} points, aligned on the setpoints)",aligned)]
+
+@case
+def join(ctx):
+    from Emulator import Join
+    samples = ctx.args.points*10     # full rate PPK stream
+    t = np.arange(samples)/100000
+    current = np.random.default_rng(0).normal(1000,5,samples).astype('float32')
+    readings = np.sort(np.random.default_rng(1).uniform(0,t[-1],5000))    # scope readings
+    results = []
+    for how in Join.JOINS:
+        durations = timed(lambda:Join.join(readings,how,Iout=(t,current)),5)
+        results.append(latency_result(f"Join.{how} of 5000 readings in {samples} samples",durations))
+    return results
+
+@case
+def plotting(ctx):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    voltage,current,slope = sweep_logs(ctx.args.points)
+    h = Analysis.hysteresis(voltage,current,slope,scale=1e-3)
+    def draw():
+        fig,ax1 = plt.subplots()
+        for courant,rising in zip(h.current,h.rising):
+            ax1.plot(h.voltage,courant,ls='-' if rising else ':',color='blue')
+        ax1.plot(h.voltage,h.mean_current,ls='-',color='black')
+        ax1.fill_between(h.voltage,h.current_up,h.current_down,color='cyan',alpha=0.2)
+        fig.canvas.draw()
+        plt.close(fig)
+    return [latency_result(f"plot of the hysteresis ({len(voltage)} points)",timed(draw,3))]
+
+@case
+def plotting_decimated(ctx):
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    from Emulator.Decimate import DecimatedLine
+    samples = ctx.args.points*10     # a full rate PPK stream, 100 s at 100 kS/s by default
+    t = np.arange(samples)/100000
+    current = np.random.default_rng(0).normal(1000,5,samples).astype('float32')
+    def draw():
+        fig,ax = plt.subplots()
+        DecimatedLine(ax,t,current,color='blue')
+        fig.canvas.draw()
+        ax.set_xlim(t[samples//2],t[samples//2]+1)    # zoom on 1 s
+        fig.canvas.draw()
+        plt.close(fig)
+    return [latency_result(f"decimated plot and zoom of a stream ({samples} samples)",timed(draw,3))]
+
+def compare(results:list,baseline:list,threshold:float) -> list:
+    """ Names of the results worse than the baseline by more than threshold (relative) """
+    reference = {result['name']:result for result in baseline}
+    regressions = []
+    for result in results:
+        old = reference.get(result['name'])
+        if old is None or old['value'] == 0:
+            continue
+        change = (result['value']-old['value'])/old['value']
+        result['change'] = change
+        if (result['better'] == 'lower' and change > threshold) or (result['better'] == 'higher' and change < -threshold):
+            regressions.append(result['name'])
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hardware',action='store_true',help="use the connected devices instead of the simulated ones")
+    parser.add_argument('--latency',type=float,default=0.001,help="simulated round trip, in s")
+    parser.add_argument('--jitter',type=float,default=0.0002,help="simulated round trip jitter, in s")
+    parser.add_argument('--repeat',type=int,default=50,help="iterations of the I/O cases")
+    parser.add_argument('--points',type=int,default=1000000,help="points of the analysis and plotting cases")
+    parser.add_argument('--seconds',type=float,default=2,help="seconds of PPK2 stream to decode")
+    parser.add_argument('--only',nargs='*',help="run only these cases")
+    parser.add_argument('--output',help="write the results to this JSON file")
+    parser.add_argument('--baseline',help="JSON results of a previous run to compare with")
+    parser.add_argument('--threshold',type=float,default=0.2,help="relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    ctx = Context(args)
+    results = []
+    try:
+        for function in CASES:
+            if args.only and function.__name__ not in args.only:
+                continue
+            for result in function(ctx):
+                print(f"{result['name']:60} {result['value']:.6g} {result['unit']}")
+                results.append(result)
+    finally:
+        ctx.release()
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results,json.load(f)['results'],args.threshold)
+        for name in regressions:
+            print("REGRESSION :",name,file=sys.stderr)
+    if args.output:
+        with open(args.output,'w') as f:
+            json.dump({"time":time.strftime('%Y-%m-%dT%H:%M:%S'),"python":platform.python_version(),
+                       "hardware":args.hardware,"latency":args.latency,"jitter":args.jitter,
+                       "results":results},f,indent=1)
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+"""
+Import time budget of a headless acquisition
+Each measure imports the emulators in a fresh interpreter, the best of the runs is kept.
+    python -m Benchmark.bench_import                 exit with 1 over the budget, or if a UI module was loaded
+    python -m Benchmark.bench_import --budget 0.3
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# What a headless acquisition imports
+MODULES = ['Emulator.PSemu','Emulator.PPKemu','Emulator.OSCIemu','Emulator.Sweep','Emulator.Sampler',
+           'Emulator.Settle','Emulator.Recorder','Emulator.Analysis','Emulator.Decimate']
+# Loaded on first use only (UI, plotting, drivers opened at connection)
+LAZY = ['tkinter','matplotlib','pyvisa','serial','ppk2_api','usb']
+BUDGET = 0.5     # s, numpy alone is about 0.1 s
+
+PROBE = """
+import sys,time,json
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+duration = time.perf_counter()-start
+print(json.dumps({{"duration":duration,"loaded":[name for name in {lazy!r} if name in sys.modules]}}))
+"""
+
+def measure(modules:list=MODULES,repeat:int=5) -> dict:
+    """ Best import time (s) of the modules in a new interpreter, and the lazy modules they loaded """
+    code = PROBE.format(modules=modules,lazy=LAZY)
+    runs = [json.loads(subprocess.run([sys.executable,'-c',code],capture_output=True,text=True,check=True).stdout)
+            for _ in range(repeat)]
+    return {"duration":min(run['duration'] for run in runs),"loaded":sorted({name for run in runs for name in run['loaded']})}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget',type=float,default=BUDGET,help="maximum import time, in s")
+    parser.add_argument('--repeat',type=int,default=5,help="interpreters started")
+    args = parser.parse_args(argv)
+    result = measure(repeat=args.repeat)
+    print(f"import of the emulators : {result['duration']*1e3:.1f} ms (budget {args.budget*1e3:.0f} ms)")
+    failed = result['duration'] > args.budget
+    if result['loaded']:
+        print("loaded at import :",', '.join(result['loaded']),file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+"""
+Benchmark of the PPK2 frame decoding : PPK2_API.get_samples() against Emulator.PPKdecoder
+Run it from the repository root :
+    python -m Benchmark.bench_ppk_decoder [dump files]
+A dump is the raw bytes returned by get_data(), one chunk after the other (see --record).
+Without dump, synthetic frames are generated.
+The exit code is 1 if the decoders differ by more than --tolerance (relative), or in their number of samples.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from ppk2_api.ppk2_api import PPK2_API
+from Emulator.PPKdecoder import PPKDecoder
+
+def synthetic_dump(duration:float,rate:int=100000,seed:int=0) -> bytes:
+    """ Frames of a load switching between plateaus, with noise and range changes """
+    gen = np.random.default_rng(seed)
+    n = int(duration*rate)
+    lengths = gen.geometric(1/500,size=n//50+1)         # plateau lengths, in samples
+    plateau_range = gen.integers(0,5,size=len(lengths))
+    plateau_adc = gen.integers(2000,14000,size=len(lengths))
+    ranges = np.repeat(plateau_range,lengths)[:n]
+    adc = np.repeat(plateau_adc,lengths)[:n] + gen.normal(0,40,n).astype(np.int64)
+    adc = np.clip(adc,0,0x3FFF)
+    digital = np.repeat(gen.integers(0,256,size=n//1000+1),1000)[:n]
+    frames = (adc | (ranges << 14) | (digital << 24)).astype('<u4')
+    return frames.tobytes()
+
+def load_dump(path:str):
+    """ Bytes of a dump, and its calibration modifiers if they were recorded with it """
+    with open(path,'rb') as f:
+        data = f.read()
+    modifiers = None
+    if os.path.exists(path+'.json'):
+        with open(path+'.json') as f:
+            modifiers = json.load(f)
+    return data,modifiers
+
+def record_dump(path:str,duration:float):
+    """ Save the raw stream of the connected PPK2, and its modifiers next to it """
+    devices = PPK2_API.list_devices()
+    if len(devices) == 0:
+        sys.exit("No power profiler kit detected!")
+    ppk = PPK2_API(devices[-1],timeout=1,write_timeout=1,exclusive=True)
+    ppk.get_modifiers()
+    ppk.set_source_voltage(3300)
+    ppk.use_ampere_meter()
+    ppk.toggle_DUT_power('ON')
+    ppk.start_measuring()
+    end = time.monotonic() + duration
+    with open(path,'wb') as f:
+        while time.monotonic() < end:
+            f.write(ppk.get_data())
+            time.sleep(0.005)
+    ppk.stop_measuring()
+    with open(path+'.json','w') as f:
+        json.dump(ppk.modifiers,f)
+
+def reference_api(modifiers:dict=None):
+    """ PPK2_API object usable without device, only for get_samples() """
+    api = PPK2_API(None)    # a serial port without name is not opened
+    if modifiers is not None:
+        api.modifiers = modifiers
+    api.current_vdd = 3300
+    return api
+
+def chunks(data:bytes,size:int):
+    return [data[i:i+size] for i in range(0,len(data),size)]
+
+def bench(data:bytes,modifiers:dict=None,chunk:int=2000):
+    """ Decode data by chunks of bytes with both decoders, return the result dict """
+    pieces = chunks(data,chunk)
+    api = reference_api(modifiers)
+    start = time.perf_counter()
+    reference = []
+    for piece in pieces:
+        samples,raw = api.get_samples(piece)
+        reference.extend(samples)
+    t_reference = time.perf_counter() - start
+
+    decoder = PPKDecoder.from_api(reference_api(modifiers))
+    start = time.perf_counter()
+    decoded = [decoder.decode(piece)[0] for piece in pieces]
+    t_numpy = time.perf_counter() - start
+    decoded = np.concatenate(decoded)
+
+    reference = np.asarray(reference)
+    n = min(len(reference),len(decoded))
+    error = np.abs(decoded[:n]-reference[:n]) / np.maximum(np.abs(reference[:n]),1e-3)
+    return {"samples":len(decoded),
+            "reference_samples":len(reference),
+            "get_samples_per_s":len(reference)/t_reference,
+            "numpy_per_s":len(decoded)/t_numpy,
+            "speedup":t_reference/t_numpy,
+            "max_relative_error":float(error.max()) if n else 0.0}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dumps',nargs='*',help="raw byte dumps of get_data()")
+    parser.add_argument('--duration',type=float,default=2,help="seconds of synthetic frames (without dump)")
+    parser.add_argument('--chunk',type=int,default=2000,help="bytes per get_data() chunk")
+    parser.add_argument('--record',metavar='FILE',help="record a dump from the connected PPK2 and exit")
+    parser.add_argument('--tolerance',type=float,default=1e-6,help="largest relative difference accepted with get_samples()")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record_dump(args.record,args.duration)
+        return
+    runs = [(path,)+load_dump(path) for path in args.dumps]
+    if not runs:
+        runs = [('synthetic',synthetic_dump(args.duration),None)]
+    failed = 0
+    for name,data,modifiers in runs:
+        result = bench(data,modifiers,args.chunk)
+        print(name,json.dumps(result))
+        if result['max_relative_error'] > args.tolerance or result['samples'] != result['reference_samples']:
+            print(f"{name} : decoded samples differ from get_samples()",file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
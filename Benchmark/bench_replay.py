@@ -0,0 +1,118 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+"""
+Record and replay check of a session : a sweep on the simulated devices, with its raw I/O recorded
+(Emulator.Session), is played again as fast as possible, every table must get back the same rows
+Run it from the repository root :
+    python -m Benchmark.bench_replay [--points 40] [--realtime] [--out captures/replay-check]
+Rows are compared step by step, their count then their values (the times of the replay differ).
+The exit code is 1 if a step differs, or if the replay is not --speedup times faster than the recording.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+from Emulator import PSemu,PPKemu,OSCIemu,Sweep,Trace,Clock
+from Emulator.Store import Store
+from Emulator.Sampler import Sampler
+from Emulator.Settle import Settler,PPKSource
+from Emulator.Session import SessionRecorder,Replay
+from Emulator.SIMemu import Bench
+
+CHANNEL = {"number":'1',"name":"albert","probe_ratio":'1',"vertical_scale":'2',"vertical_unit_name":"V",
+           "offset":'0',"offset_unit_name":"V","display":"ON"}
+
+def sweep(bench,points:int) -> Store:
+    """ Sweep of Main.py on the devices of a Bench or a Replay, return its store """
+    store = Store()
+    ps,ppk,osci = PSemu.PS(store=store),PPKemu.PPK(store=store),OSCIemu.OSCI(store=store)
+    for device in (ps,ppk,osci):
+        device.connect_to_simulator(bench)
+    sampler = None
+    try:
+        osci.set_channel(1,CHANNEL)
+        ps.setup(1.8,1)
+        ppk.setup()
+        osci.setup()
+        sampler = Sampler(osci,ps,ppk)
+        profile = Sweep.back_and_forth(1.85,1.85+(points//2-1)*0.05,0.05,slopes=2)
+        Sweep.Sweep(ps,profile,1,measure=sampler.sample,settler=Settler(window=0.02,timeout=0.5),
+                    source=PPKSource(ppk),marks=[ppk]).run()
+        ps.flush()
+    finally:
+        if sampler is not None:
+            sampler.close()
+        for device in (ps,ppk,osci):
+            device.release()
+    return store
+
+def compare(recorded:Store,replayed:Store) -> list:
+    """ Differences of the tables of two runs, step by step """
+    differences = []
+    for name,table in recorded.tables.items():
+        if 'step' not in table or name == 'Sweep':     # the settle times of a replay are its own
+            continue
+        other = replayed.tables.get(name)
+        if other is None or 'step' not in other:
+            differences.append(f"{name} : not replayed")
+            continue
+        for step in np.unique(table['step']):
+            rows,again = table['step'] == step,other['step'] == step
+            if rows.sum() != again.sum():
+                differences.append(f"{name} step {step} : {rows.sum()} rows recorded, {again.sum()} replayed")
+                continue
+            for column in table.keys():
+                if column in ('t','step','slope') or column not in other or len(table[column]) != len(rows):
+                    continue     # times, tags and columns left empty
+                if not np.allclose(table[column][rows],other[column][again],equal_nan=True):
+                    differences.append(f"{name} step {step} : {column} differs")
+        missing = set(np.unique(other['step']))-set(np.unique(table['step']))
+        if missing:
+            differences.append(f"{name} : steps {sorted(missing)} only in the replay")
+    return differences
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record a simulated sweep and check its replay")
+    parser.add_argument('--points',type=int,default=40,help="points of the sweep")
+    parser.add_argument('--realtime',action='store_true',help="replay at the pace of the recording")
+    parser.add_argument('--out',help="directory of the session, kept (a temporary one by default)")
+    parser.add_argument('--speedup',type=float,default=3,help="replay at least that much faster than the recording (not --realtime)")
+    args = parser.parse_args(argv)
+    path = args.out or tempfile.mkdtemp(prefix='replay-check-')
+    session = os.path.join(path,'session')
+    try:
+        Trace.tracer.session = SessionRecorder(session)
+        start = time.monotonic()
+        try:
+            recorded = sweep(Bench(),args.points)
+        finally:
+            Trace.tracer.session.close()
+            Trace.tracer.session = None
+        duration = time.monotonic()-start
+        start = time.monotonic()
+        Clock.clock.skip = not args.realtime
+        try:
+            replayed = sweep(Replay(session,realtime=args.realtime),args.points)
+        finally:
+            Clock.clock.skip = False
+        replay = time.monotonic()-start
+        print(f"recorded in {duration:.2f} s, replayed in {replay:.2f} s")
+        differences = compare(recorded,replayed)
+        if not args.realtime and replay > duration/args.speedup:
+            differences.append(f"replay {duration/replay:.1f} times faster than the recording, {args.speedup:g} expected")
+    finally:
+        if args.out is None:
+            shutil.rmtree(path,ignore_errors=True)
+    for difference in differences:
+        print(difference,file=sys.stderr)
+    rows = {name:len(table) for name,table in replayed.tables.items()}
+    print("rows replayed :",', '.join(f"{name} {count}" for name,count in rows.items()))
+    print(f"replay differs in {len(differences)} place(s)" if differences else "replay identical to the recording")
+    sys.exit(1 if differences else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+
+def trapezoid(y,x) -> float:
+    """ Integral of y over x by the trapezoidal rule """
+    y = np.asarray(y,dtype=np.float64)
+    x = np.asarray(x,dtype=np.float64)
+    return float(((y[1:]+y[:-1])*np.diff(x)).sum()/2)
+
+class Hysteresis:
+    """ Curves of a sweep, every slope put back in increasing voltage order
+    voltage : (npoints,) setpoints met by every slope (without setpoints, the voltage of the first slope), x axis
+    current, power : (nslopes, npoints), one row per slope
+    rising : (nslopes,) True for the slopes going up
+    current_up, current_down, power_up, power_down : mean of the rising / falling slopes
+    mean_current, mean_power : middle of the up and down curves
+    area_current, area_power : area between the up and down curves
+    charge, energy : (nslopes, npoints) charge (C) and energy (J) of each step, None without charge log
+    slope_charge, slope_energy : (nslopes,) totals of each slope
+    """
+    __slots__ = ('voltage','current','power','rising','current_up','current_down',
+                 'power_up','power_down','mean_current','mean_power','area_current','area_power',
+                 'charge','energy','slope_charge','slope_energy')
+
+    @property
+    def nslopes(self) -> int:
+        return len(self.current)
+
+def _slope_indexes(n:int,slope=None,nslopes:int=2):
+    """ (nslopes, npoints) indexes of each slope in the logs, truncated to the shortest slope """
+    if slope is None or len(slope) < n:
+        length = n//nslopes
+        starts = np.arange(nslopes)*length
+        ends = starts + length
+    else:
+        slope = np.asarray(slope[:n])
+        labels,starts = np.unique(slope,return_index=True)
+        ends = starts + np.bincount(np.searchsorted(labels,slope),minlength=len(labels))
+    npoints = int((ends-starts).min()) if len(starts) else 0
+    return starts,ends,npoints
+
+def _setpoint_indexes(setpoint,starts,ends):
+    """ (nslopes, npoints) indexes of the points of each slope on the setpoints met by every slope, and these setpoints
+    (rounded to 0.1 mV, far under the resolution of a supply, so that equal setpoints compare equal)
+    """
+    setpoint = np.round(np.asarray(setpoint,dtype=np.float64),4)
+    grid = None
+    for start,end in zip(starts,ends):
+        grid = np.unique(setpoint[start:end]) if grid is None else np.intersect1d(grid,setpoint[start:end])
+    index = np.empty((len(starts),len(grid)),dtype=np.intp)
+    for row,(start,end) in enumerate(zip(starts,ends)):
+        points = setpoint[start:end]
+        order = np.argsort(points,kind='stable')
+        found = np.searchsorted(points[order],grid,side='right')-1    # the last point at a setpoint repeated
+        index[row] = start+order[found]
+    return index,grid
+
+def hysteresis(voltage,current,slope=None,nslopes:int=2,scale:float=1.0,charge=None,setpoint=None) -> Hysteresis:
+    """ Split the logs of a sweep into slopes and compute the hysteresis in one pass
+    voltage, current : one value per point (e.g. columns of the store)
+    slope : slope index of each point (column 'slope' of a sweep), else the logs are cut in nslopes equal parts
+    scale : unit conversion of the current (1e-3 for uA to mA)
+    charge : charge (C) of each point (column Q of Join.merge), for the energy of the steps and slopes
+    setpoint : voltage set at each point (Sweep.Profile.setpoints of the column 'step'), the slopes are compared
+    at the setpoints all of them met. Without it, points are paired by rank, from the low voltage end of each slope
+    return None when the logs hold no point (aborted or failed run)
+    """
+    n = min(len(voltage),len(current))
+    voltage = np.asarray(voltage[:n],dtype=np.float64)
+    current = np.asarray(current[:n],dtype=np.float64)*scale
+    starts,ends,npoints = _slope_indexes(n,slope,nslopes)
+    if n == 0 or npoints == 0:
+        return None
+
+    h = Hysteresis()
+    if setpoint is not None and len(setpoint) >= n:
+        setpoint = np.asarray(setpoint[:n],dtype=np.float64)
+        rising = setpoint[ends-1] >= setpoint[starts]
+        index,h.voltage = _setpoint_indexes(setpoint,starts,ends)
+        if index.shape[1] == 0:
+            return None
+    else:
+        rank = np.arange(npoints)
+        rising = voltage[np.maximum(ends-1,starts)] >= voltage[starts]
+        # rising slopes are read from their start, falling ones backward from their end
+        index = np.where(rising[:,None],starts[:,None]+rank,ends[:,None]-1-rank)
+        h.voltage = voltage[index[0]] if len(index) else voltage[:0]
+    h.current = current[index]
+    h.power = voltage[index]*h.current
+    h.rising = rising
+    up = rising if rising.any() else ~rising
+    falling = ~rising if (~rising).any() else up   # a single way sweep has no hysteresis
+    h.current_up = h.current[up].mean(axis=0)
+    h.current_down = h.current[falling].mean(axis=0)
+    h.power_up = h.power[up].mean(axis=0)
+    h.power_down = h.power[falling].mean(axis=0)
+    h.mean_current = (h.current_up+h.current_down)/2
+    h.mean_power = (h.power_up+h.power_down)/2
+    h.area_current = trapezoid(np.abs(h.current_up-h.current_down),h.voltage)
+    h.area_power = trapezoid(np.abs(h.power_up-h.power_down),h.voltage)
+    h.charge = h.energy = h.slope_charge = h.slope_energy = None
+    if charge is not None and len(charge) >= n:
+        charge = np.asarray(charge[:n],dtype=np.float64)
+        h.charge = charge[index]
+        h.energy = voltage[index]*h.charge
+        energy = voltage*charge     # totals of every step of a slope, also the ones off the common setpoints
+        h.slope_charge = np.array([np.nansum(charge[start:end]) for start,end in zip(starts,ends)])
+        h.slope_energy = np.array([np.nansum(energy[start:end]) for start,end in zip(starts,ends)])
+    return h
@@ -0,0 +1,28 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import time
+import threading
+
+class Clock:
+    """ Waits of the sweep, the settling and the PPK reader : real ones, or skipped for a replay
+    skip : a wait only yields to the other threads and moves the time of the clock forward, for the thread
+    waiting only (a reader polling in the background does not bring the timeout of the settling closer) :
+    a replay runs as fast as its I/O goes, its timeouts reached after the polls they allow
+    The timestamps of the logs stay time.monotonic() : a wait skipped shortens the run, not a step.
+    """
+    def __init__(self):
+        self.skip = False
+        self.local = threading.local()     # skipped : s of waits skipped by the thread, added to time.monotonic()
+
+    def monotonic(self) -> float:
+        return time.monotonic()+getattr(self.local,'skipped',0.0)
+
+    def sleep(self,duration:float):
+        if self.skip:
+            self.local.skipped = getattr(self.local,'skipped',0.0)+max(duration,0.0)
+            time.sleep(0)
+        else:
+            time.sleep(duration)
+
+clock = Clock()    # process wide clock used by the emulators, Main.py --replay skips its waits
@@ -0,0 +1,117 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+
+# Plotting of long series : instead of every point, each line draws the min and the max
+# of `points` blocks of the visible x range, so peaks stay visible whatever the zoom.
+# The block min/max are computed once for blocks of 4, 16, 64, ... samples (Envelope),
+# a zoom or a pan only picks the blocks of the new range in the right level.
+
+def _blocks(y,factor:int):
+    """ Indexes of the min and of the max of each block of `factor` values of y (the last one may be shorter) """
+    n = len(y)
+    full = n//factor*factor
+    blocks = np.asarray(y[:full]).reshape(-1,factor)
+    offsets = np.arange(0,full,factor)
+    imin = offsets + blocks.argmin(axis=1)
+    imax = offsets + blocks.argmax(axis=1)
+    if full < n:
+        tail = np.asarray(y[full:])
+        imin = np.append(imin,full+tail.argmin())
+        imax = np.append(imax,full+tail.argmax())
+    return imin,imax
+
+def _merge(y,indexes,factor:int,reduce):
+    """ Index of the min (reduce=np.argmin) or max of each group of `factor` blocks of the level below """
+    nblocks = -(-len(indexes)//factor)
+    padded = np.concatenate([indexes,np.repeat(indexes[-1:],nblocks*factor-len(indexes))]).reshape(nblocks,factor)
+    return padded[np.arange(nblocks),reduce(np.asarray(y[padded]),axis=1)]
+
+class Envelope:
+    """ Multi-resolution min/max of y over increasing x (numpy arrays, store columns or memmaps of a Capture)
+    view(lo, hi) gives at most 2*points (x, y) samples of the range, raw samples when there are few enough
+    """
+    def __init__(self,x,y,points:int=2000,factor:int=4):
+        self.x = x
+        self.y = y
+        self.points = points
+        self.levels = []    # (samples per block, index of the min, index of the max) from the finest
+        n = min(len(x),len(y))
+        self.n = n
+        size = factor
+        if n > 2*points:
+            imin,imax = _blocks(y[:n],factor)
+            self.levels.append((size,imin,imax))
+            while len(imin) > points:
+                imin,imax = _merge(y,imin,factor,np.argmin),_merge(y,imax,factor,np.argmax)
+                size *= factor
+                self.levels.append((size,imin,imax))
+
+    def _range(self,lo:float=None,hi:float=None):
+        """ Indexes of the samples from just before lo to just after hi """
+        start = 0 if lo is None else max(int(np.searchsorted(self.x[:self.n],lo))-1,0)
+        stop = self.n if hi is None else min(int(np.searchsorted(self.x[:self.n],hi,side='right'))+1,self.n)
+        return start,max(stop,start)
+
+    def _level(self,start:int,stop:int):
+        """ Finest level showing [start, stop) in at most `points` blocks, None to show the raw samples """
+        if stop-start <= 2*self.points or not self.levels:
+            return None
+        for size,imin,imax in self.levels:
+            if (stop-start)/size <= self.points:
+                break
+        return size,imin[start//size:-(-stop//size)],imax[start//size:-(-stop//size)]
+
+    def view(self,lo:float=None,hi:float=None):
+        """ (x, y) to draw for the x range [lo, hi], min and max of each block in their order """
+        start,stop = self._range(lo,hi)
+        level = self._level(start,stop)
+        if level is None:
+            return np.asarray(self.x[start:stop]),np.asarray(self.y[start:stop])
+        _,imin,imax = level
+        index = np.sort(np.stack([imin,imax],axis=1),axis=1).ravel()
+        return np.asarray(self.x[index]),np.asarray(self.y[index])
+
+    def band(self,lo:float=None,hi:float=None):
+        """ (x, low, high) of each block of the x range, for fill_between """
+        start,stop = self._range(lo,hi)
+        level = self._level(start,stop)
+        if level is None:
+            y = np.asarray(self.y[start:stop])
+            return np.asarray(self.x[start:stop]),y,y
+        size,imin,imax = level
+        first = (np.arange(len(imin)) + start//size)*size
+        return np.asarray(self.x[first]),np.asarray(self.y[imin]),np.asarray(self.y[imax])
+
+class DecimatedLine:
+    """ ax.plot(x, y, **kwargs) drawing an Envelope, re-decimated when the x limits change """
+    def __init__(self,ax,x,y,points:int=2000,**kwargs):
+        self.ax = ax
+        self.envelope = Envelope(x,y,points)
+        self.line, = ax.plot(*self.envelope.view(),**kwargs)
+        # a lambda : the callback registry would only keep a weak reference to a bound method
+        ax.callbacks.connect('xlim_changed',lambda ax:self.update())
+
+    def update(self):
+        self.line.set_data(*self.envelope.view(*self.ax.get_xlim()))
+
+class DecimatedFill:
+    """ ax.fill_between(x, y1, y2, **kwargs) of two series sharing x, re-decimated when the x limits change """
+    def __init__(self,ax,x,y1,y2,points:int=2000,**kwargs):
+        self.ax = ax
+        self.kwargs = kwargs
+        self.envelopes = (Envelope(x,y1,points),Envelope(x,y2,points))
+        self.collection = None
+        self.update()
+        ax.callbacks.connect('xlim_changed',lambda ax:self.update())
+
+    def update(self):
+        limits = self.ax.get_xlim() if self.collection is not None else (None,None)
+        x,low1,high1 = self.envelopes[0].band(*limits)
+        _,low2,high2 = self.envelopes[1].band(*limits)
+        low,high = np.minimum(low1,low2),np.maximum(high1,high2)
+        if self.collection is None:
+            self.collection = self.ax.fill_between(x,low,high,**self.kwargs)
+        else:   # new polygon in the same collection, a new fill_between would autoscale the axes again
+            self.collection.set_verts([np.column_stack([np.concatenate([x,x[::-1]]),np.concatenate([high,low[::-1]])])])
@@ -0,0 +1,64 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+from collections import deque
+
+# Charge drawn from the full rate stream of a PPK2, integrated while the samples arrive :
+# the running trapezoidal integral is a single total, also kept at the end of the last chunks pushed.
+# PPK.mark() and measure() snapshot it at the head of the raw buffer (always the end of a chunk),
+# the charge of a step is the difference of two snapshots, whatever its length.
+# The segment between two samples belongs to the second one : consecutive windows add up exactly.
+# A sweep holds the voltage during a step, the energy of a step is its charge times the voltage
+# measured during it (Join.merge adds it to the merged table).
+
+class Integrator:
+    """ Running trapezoidal integral of a stream (current in uA -> charge in C with scale=1e-6)
+    period : sample period (s) of a stream at a fixed rate, used instead of the differences of the
+    timestamps, which only come from the time of each read (PPK._read) and jitter with it
+    """
+    def __init__(self,scale:float=1e-6,period:float=None,chunks:int=64):
+        self.scale = scale
+        self.period = period
+        self.chunks = chunks      # ends of chunk kept, a reader is at most a few chunks late
+        self.clear()
+
+    def clear(self,origin:int=0):
+        """ Start again from 0, the next sample pushed being the sample `origin` of the raw buffer """
+        self.total = 0.0      # integral from the first sample to the last one pushed
+        self.last = None      # (value, time) of the last sample pushed
+        self.origin = origin
+        self.ends = deque([(origin,0.0)],maxlen=self.chunks)    # (index after the chunk, total) of the last chunks
+
+    def push(self,values,times):
+        """ Integrate a chunk of samples, to call before the push of the same chunk to the raw buffer """
+        if len(values) == 0:
+            return
+        values = np.asarray(values,dtype=np.float64)*self.scale
+        times = np.asarray(times,dtype=np.float64)
+        previous,start = self.last if self.last is not None else (values[0],times[0])
+        before = np.concatenate([[previous],values[:-1]])
+        steps = np.diff(times,prepend=start) if self.period is None else self.period
+        segments = (values+before)/2*steps
+        self.total += float(segments.sum())
+        self.last = (values[-1],times[-1])
+        self.ends.append((self.ends[-1][0]+len(values),self.total))
+
+    def span(self,values,times) -> float:
+        """ Integral of the segments between consecutive samples of a window (values[0] : the sample before it) """
+        values = np.asarray(values,dtype=np.float64)*self.scale
+        steps = np.diff(times) if self.period is None else self.period
+        return float(((values[1:]+values[:-1])/2*steps).sum())
+
+    def at(self,index:int) -> float:
+        """ Integral of the samples before the sample `index` of the raw buffer, the end of one of the last chunks
+        (its head, once the chunk is pushed there too), NaN for any other sample
+        """
+        if index <= self.origin:
+            return 0.0
+        for end,total in reversed(tuple(self.ends)):     # a copy, the reader pushes meanwhile : usually the last chunk or the one before
+            if end == index:
+                return total
+            if end < index:
+                break
+        return np.nan
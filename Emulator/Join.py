@@ -0,0 +1,140 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+from Emulator.Store import Table
+
+# Alignment of the logs of several devices on their timestamps (time.monotonic(), column 't'),
+# instead of their row index : each device may log at its own rate, miss a step or log twice.
+# Every join looks the readings up in sorted times with np.searchsorted, O(m log n) for m times
+# looked up in n readings : a few thousand scope readings against millions of PPK samples
+# (the columns of a Capture, memmapped, work the same).
+
+TAGS = ('step','slope')    # tags of a sweep, carried to the merged table
+
+def _readings(times,values):
+    """ (times, values) of a log, cut to the rows both columns have """
+    n = min(len(times),len(values))
+    return np.asarray(times[:n],dtype=np.float64),np.asarray(values[:n])
+
+def _bounds(t,n:int,groups):
+    """ First and end row of the readings each t may be joined with : all of them, or those of its group
+    groups : (group of each t, group of each reading), both sorted, e.g. the step tags of a sweep
+    """
+    if groups is None:
+        return np.zeros(len(t),dtype=np.int64),np.full(len(t),n,dtype=np.int64)
+    mine,theirs = np.asarray(groups[0][:len(t)]),np.asarray(groups[1][:n])
+    return np.searchsorted(theirs,mine,side='left'),np.searchsorted(theirs,mine,side='right')
+
+def _pick(t,times,values,index,found,tolerance):
+    """ values[index], NaN where there is no reading or the reading is further than tolerance (s) """
+    if len(times) == 0:
+        return np.full(len(t),np.nan)
+    index = np.clip(index,0,len(times)-1)
+    result = values[index].astype(np.float64)
+    if tolerance is not None:
+        found &= np.abs(times[index]-t) <= tolerance
+    result[~found] = np.nan
+    return result
+
+def asof(t,times,values,tolerance:float=None,forward:bool=False,groups=None) -> np.ndarray:
+    """ For each t, the last reading at or before it (the first at or after it if forward) """
+    t = np.asarray(t,dtype=np.float64)
+    times,values = _readings(times,values)
+    first,end = _bounds(t,len(times),groups)
+    if forward:
+        index = np.maximum(np.searchsorted(times,t,side='left'),first)
+        found = index < end
+    else:
+        index = np.minimum(np.searchsorted(times,t,side='right'),end)-1
+        found = index >= first
+    return _pick(t,times,values,index,found,tolerance)
+
+def _around(t,times,groups,side:str):
+    """ Indexes of the readings before and after each t (within its group), and whether it has readings """
+    first,end = _bounds(t,len(times),groups)
+    found = end > first
+    first = np.minimum(first,len(times)-1)
+    last = np.clip(end-1,first,len(times)-1)
+    after = np.clip(np.searchsorted(times,t,side=side),first,last)
+    return np.clip(after-1,first,last),after,found
+
+def nearest(t,times,values,tolerance:float=None,groups=None) -> np.ndarray:
+    """ For each t, the reading closest in time """
+    t = np.asarray(t,dtype=np.float64)
+    times,values = _readings(times,values)
+    if len(times) == 0:
+        return np.full(len(t),np.nan)
+    before,after,found = _around(t,times,groups,'left')
+    closest = np.where(np.abs(times[before]-t) <= np.abs(times[after]-t),before,after)
+    return _pick(t,times,values,closest,found,tolerance)
+
+def interpolated(t,times,values,tolerance:float=None,groups=None) -> np.ndarray:
+    """ For each t, linear interpolation between the readings around it, NaN outside of the readings
+    With groups, between the readings of its group, the closest one outside of them
+    With a tolerance, NaN also where the closest reading is further than it (a gap in the log)
+    """
+    t = np.asarray(t,dtype=np.float64)
+    times,values = _readings(times,values)
+    if len(times) == 0:
+        return np.full(len(t),np.nan)
+    # only the two readings around each t are read (np.interp would convert all of them)
+    before,after,found = _around(t,times,groups,'right')
+    start,span = times[before],times[after]-times[before]
+    low,high = values[before].astype(np.float64),values[after].astype(np.float64)
+    weight = np.clip(np.divide(t-start,span,out=np.zeros(len(t)),where=span > 0),0,1)
+    result = low + weight*(high-low)
+    if groups is None:
+        result[(t < times[0]) | (t > times[-1])] = np.nan
+    result[~found] = np.nan
+    if tolerance is not None:
+        result[np.isnan(nearest(t,times,times,tolerance,groups))] = np.nan
+    return result
+
+JOINS = {'asof':asof,'nearest':nearest,'interpolated':interpolated}
+
+def join(t,how:str='nearest',tolerance:float=None,groups=None,**sources) -> dict:
+    """ Several logs aligned on the times t
+    sources : name=(times, values), e.g. Iout=(ppk.log['t'],ppk.log['Iout'])
+    groups : (group of each t, group of each reading) to join within a group only, the same for every source
+    return {'t': t, name: aligned values, ...}
+    """
+    if how not in JOINS:
+        raise ValueError(f"unknown join '{how}', use one of {', '.join(JOINS)}")
+    aligned = {'t':np.asarray(t,dtype=np.float64)}
+    for name,(times,values) in sources.items():
+        aligned[name] = JOINS[how](aligned['t'],times,values,tolerance,groups=groups)
+    return aligned
+
+def merge(voltage:Table,vcolumn:str,current:Table,icolumn:str='Iout',how:str='nearest',
+          tolerance:float=None,scale:float=1e-6,name:str='Power') -> Table:
+    """ Voltage, current and power table : each row of the voltage log with the current at its time
+    voltage, current : tables of the store (e.g. osci.waveforms, ppk.log) with a column 't'
+    scale : conversion of the current to A, for the power in W (1e-6 for the uA of a PPK)
+    When both logs are tagged by a sweep, a reading is only joined with the current of its own step :
+    the PPK stamps its averages at the middle of the step, half a step from the readings of the others.
+    Columns t, V, I (unit of the current log), P (W), and the sweep tags of the voltage log.
+    With the charge of each step in the current log (column Q of a PPK), also Q (C) and E (J),
+    the energy of the step at the voltage measured during it.
+    The table is not in the store : nothing is recorded again.
+    """
+    n = min(len(voltage['t']),len(voltage[vcolumn]))
+    t = voltage['t'][:n]
+    step = TAGS[0]
+    groups = None
+    if step in voltage and step in current and len(voltage[step]) >= n and len(current[step]) >= len(current['t']):
+        groups = (voltage[step][:n],current[step])
+    aligned = join(t,how,tolerance,groups,V=(t,voltage[vcolumn]),I=(current['t'],current[icolumn]))
+    table = Table(name)
+    columns = dict(t=aligned['t'],V=aligned['V'],I=aligned['I'],P=aligned['V']*aligned['I']*scale)
+    if 'Q' in current:
+        charge = JOINS[how](t,current['t'],current['Q'],tolerance,groups=groups)
+        columns.update(Q=charge,E=aligned['V']*charge)
+    table.extend(**columns)     # in one go : a column extended on its own would be padded for the others
+    for tag in TAGS:
+        if tag in voltage and len(voltage[tag]) >= n:    # a tag column started late would not line up
+            table.add_column(tag,'int32').extend(voltage[tag][:n])
+    for column,unit in (('t','s'),('V','V'),('I',current.columns[icolumn].unit),('P','W'),('Q','C'),('E','J')):
+        if column in table:
+            table.columns[column].unit = unit
+    return table
@@ -0,0 +1,311 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import sys
+import time
+import queue
+import atexit
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from Emulator.RingBuffer import RingBuffer
+from Emulator.PPKemu import PPK,list_devices
+from Emulator.Settle import PPKSource
+from Emulator.Store import Store
+
+# Several PPK2 at once : each one is read and decoded by its own process (one core per PPK2),
+# which writes the current in a ring buffer in shared memory. The main process reads
+# these buffers exactly as the one of a PPK : mark(), measure(), PPKSource all work the same.
+# Samples are stamped with time.monotonic(), common to all the processes of the computer,
+# so the logs of every PPK2 (tables 'PPK <serial>') line up with the sweep and the other devices.
+# The processes are spawned : the script using them must keep its code under if __name__ == '__main__'.
+
+def _attach(name:str):
+    """ Open a shared memory block created by another process, without taking its ownership """
+    try:
+        return shared_memory.SharedMemory(name=name,track=False)   # python >= 3.13
+    except TypeError:
+        # before 3.13 : registered again in the resource tracker the processes share, a no-op
+        return shared_memory.SharedMemory(name=name)
+
+class SharedRingBuffer(RingBuffer):
+    """ RingBuffer in shared memory : head and reserved live next to the samples,
+    so the writer of a process and the readers of another keep the same lock free protocol
+    name=None creates the block, else the block of that name is opened
+    """
+    def __init__(self,capacity:int,dtype='float32',name:str=None):
+        self.capacity = int(capacity)
+        itemsize = np.dtype(dtype).itemsize
+        times = 16 + -(-itemsize*self.capacity//8)*8     # offset of the times, aligned on 8 bytes
+        size = times + 8*self.capacity
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(create=True,size=size) if self.owner else _attach(name)
+        self.name = self.memory.name
+        self.counters = np.ndarray(2,dtype='int64',buffer=self.memory.buf)       # head, reserved
+        self.values = np.ndarray(self.capacity,dtype=dtype,buffer=self.memory.buf,offset=16)
+        self.times = np.ndarray(self.capacity,dtype='float64',buffer=self.memory.buf,offset=times)
+        if self.owner:
+            self.counters[:] = 0
+
+    @property
+    def head(self) -> int:
+        return int(self.counters[0])
+
+    @head.setter
+    def head(self,value:int):
+        self.counters[0] = value
+
+    @property
+    def reserved(self) -> int:
+        return int(self.counters[1])
+
+    @reserved.setter
+    def reserved(self,value:int):
+        self.counters[1] = value
+
+    def close(self):
+        """ Detach the block, and free it if this process created it """
+        del self.counters,self.values,self.times    # no view may remain on the block
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+def _stream(port:str,opener,memory:str,capacity:int,interval:float,stop,status):
+    """ Body of an acquisition process : read and decode one PPK2 into the shared ring buffer """
+    ppk = PPK(buffer_duration=0)
+    ppk.buffer = SharedRingBuffer(capacity,name=memory)
+    ppk.pyramid = None
+    ppk.integrator = None
+    try:
+        if opener is not None:
+            ppk.com = opener()
+        else:
+            from ppk2_api.ppk2_api import PPK2_API
+            ppk.com = PPK2_API(port,timeout=1,write_timeout=1,exclusive=True)
+        ppk._start()
+    except Exception as e:
+        status.put(('error',str(e)))
+        return
+    status.put(('ready',port))
+    try:
+        while not stop.is_set():
+            ppk._read()
+            time.sleep(interval)
+    except Exception as e:     # for the main process, as the error of the reader thread of a PPK
+        status.put(('error',f"{type(e).__name__}: {e}"))
+        raise
+    finally:
+        ppk.com.stop_measuring()
+        ser = getattr(ppk.com,'ser',None)
+        if ser is not None:
+            ser.close()
+        ppk.buffer.close()
+
+class SimulatedPPK2:
+    """ Opener of a simulated PPK2 for the acquisition process. Its bench lives in that process :
+    the current follows the fixed voltage given, not the supply of the main process
+    """
+    def __init__(self,voltage:float=3.3,latency:float=0.001,rate:int=100000,seed:int=None):
+        self.voltage = voltage
+        self.latency = latency
+        self.rate = rate
+        self.seed = seed
+
+    def __call__(self):
+        from Emulator.SIMemu import Bench
+        bench = Bench(latency=self.latency,rate=self.rate,seed=self.seed)
+        bench.set_voltage(self.voltage)
+        bench.set_output(True)
+        return bench.ppk2()
+
+class PPKProcess(PPK):
+    """ PPK read by its own process, same use as a PPK
+    The port is only opened by the acquisition process, started by setup(), which also creates
+    the shared buffer : release() frees it, or the exit of the script if release() is never reached
+    """
+    def __init__(self,serial:str=None,UI:bool=False,buffer_duration:float=10,store:Store=None):
+        super().__init__(UI=UI,buffer_duration=0,store=store,serial=serial)
+        self.capacity = int(buffer_duration*self.rate)
+        self.buffer = None
+        self.pyramid = None              # the stream is decoded by the acquisition process
+        self.integrator = None
+        self.opener = None               # opens the PPK2 in the acquisition process, None for PPK2_API(port)
+        self.process = None
+        self.stopEvent = None
+        self.status = None
+        self.forwarder = None            # thread copying the stream to the recorder
+        self.failure = None              # why the acquisition process stopped, None while it runs
+        self.reported = False            # failure raised by measure() already, not again by stop()
+
+    def connect_to_device(self):
+        self.port = self.find_port()
+        print("Found PPK2 at {0}".format(self.port))
+
+    def connect_to_simulator(self,bench):
+        """ Simulated PPK2 opened by the acquisition process, see SimulatedPPK2 """
+        self.opener = SimulatedPPK2(latency=bench.ppkLatency.base,rate=bench.rate)
+        self.port = 'SIM-'+self.name
+        print("Found PPK2 at {0}".format(self.port))
+
+    def checkconnected(self):
+        if not self.port:
+            sys.stderr.write ("ERROR: you should first connect to the power profiler")
+            sys.exit(1)
+
+    def start(self):
+        """ Start the acquisition process, wait_ready() waits for its stream """
+        self.checkconnected()
+        self.stop()
+        self.log.add_column('t',unit='s')
+        self.log.add_column('Iout',unit='uA')
+        self.log.add_column('Q',unit='C')
+        self.log.clear()
+        if self.buffer is None:
+            self.buffer = SharedRingBuffer(self.capacity)
+            atexit.register(self.release)     # the block outlives the process otherwise
+        context = multiprocessing.get_context('spawn')    # same behavior on every OS
+        self.stopEvent = context.Event()
+        self.status = context.Queue()
+        self.process = context.Process(target=_stream,name=self.name,daemon=True,
+                                       args=(self.port,self.opener,self.buffer.name,self.capacity,
+                                             self.logInterval,self.stopEvent,self.status))
+        self.process.start()
+
+    def wait_ready(self,timeout:float=30):
+        try:
+            state,message = self.status.get(timeout=timeout)
+        except Exception:
+            state,message = 'error','no answer from the acquisition process'
+        if state != 'ready':
+            self.stop()
+            sys.exit("{0} : {1}".format(self.name,message))
+        self.run = True
+        if self.recorder is not None:
+            self.forwarder = threading.Thread(target=self._forward,daemon=True)
+            self.forwarder.start()
+
+    def setup(self):
+        self.start()
+        self.wait_ready()
+
+    def _forward(self,period:float=0.05):
+        """ Copy the shared stream to the recorder, from the main process """
+        index = self.buffer.head
+        while self.run:
+            time.sleep(period)
+            samples,times,index = self.buffer.window(index)
+            if len(samples):
+                self.recorder.write(self.name+'.stream',t=times,Iout=samples)
+
+    def _check(self):
+        """ Error sent by the acquisition process, or its exit if it died without a word """
+        if self.process is None or self.failure is not None:
+            return self.failure
+        try:
+            state,message = self.status.get_nowait()
+            if state == 'error':
+                self.failure = message
+        except queue.Empty:
+            pass
+        if self.failure is None and not self.process.is_alive():
+            self.failure = f"acquisition process stopped (exit code {self.process.exitcode})"
+        return self.failure
+
+    def _raise(self):
+        """ Raise the error of the acquisition process : measure() would log nothing from a buffer no longer written """
+        super()._raise()
+        if self._check() is not None:
+            self.reported = True
+            raise RuntimeError(f"{self.name} : {self.failure}")
+
+    def stop(self):
+        self.run = False
+        failure = None if self.reported else self._check()
+        if self.forwarder is not None:
+            self.forwarder.join()
+            self.forwarder = None
+        if self.process is not None:
+            self.stopEvent.set()
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        self.failure,self.reported = None,False
+        if failure is not None:
+            raise RuntimeError(f"{self.name} : {failure}")
+
+    def _free(self):
+        """ Free the shared buffer, once the acquisition process is stopped """
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+            atexit.unregister(self.release)
+
+    def release(self):
+        try:
+            self.stop()
+        finally:
+            self._free()
+
+class MultiPPK:
+    """ Several PPK2, each one read by its own process
+    serials : serial numbers of the PPK2 to use, all the plugged ones if None
+    Give ppks to the Sampler and to Sweep(marks=...), and sources() to the Settler,
+    so every setpoint waits for all of them and every sample measures all of them.
+    """
+    def __init__(self,serials:list=None,UI:bool=False,buffer_duration:float=10,store:Store=None):
+        self.serials = serials
+        self.ui = UI
+        self.bufferDuration = buffer_duration
+        self.store = store if store is not None else Store()
+        self.ppks = []
+
+    def connect_to_device(self):
+        serials = self.serials if self.serials is not None else sorted(list_devices())
+        if not serials:
+            sys.exit("No power profiler kit detected!")
+        self.ppks = [PPKProcess(serial,self.ui,self.bufferDuration,self.store) for serial in serials]
+        for ppk in self.ppks:
+            ppk.connect_to_device()
+
+    def connect_to_simulator(self,bench,count:int=2):
+        """ `count` simulated PPK2 (or one per serial number given) """
+        serials = self.serials if self.serials is not None else [f'SIM{n}' for n in range(count)]
+        self.ppks = [PPKProcess(serial,self.ui,self.bufferDuration,self.store) for serial in serials]
+        for ppk in self.ppks:
+            ppk.connect_to_simulator(bench)
+
+    def set_log_interval(self,duration):
+        for ppk in self.ppks:
+            ppk.set_log_interval(duration)
+
+    def setup(self):
+        for ppk in self.ppks:    # the processes start together
+            ppk.start()
+        for ppk in self.ppks:
+            ppk.wait_ready()
+
+    def sources(self) -> list:
+        return [PPKSource(ppk) for ppk in self.ppks]
+
+    def mark(self):
+        for ppk in self.ppks:
+            ppk.mark()
+
+    def measure(self):
+        for ppk in self.ppks:
+            ppk.measure()
+
+    def release(self):
+        """ Stop and free every PPK2, then raise the first error of their processes """
+        errors = []
+        for ppk in self.ppks:
+            try:
+                ppk.stop()
+            except Exception as e:
+                errors.append(e)
+        for ppk in self.ppks:
+            ppk.release()
+        if errors:
+            raise errors[0]
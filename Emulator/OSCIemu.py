@@ -1,16 +1,14 @@
 #! /.venv/bin/python3
 # -*- coding: UTF-8 -*-
 
-import serial
-import pyvisa
-import usb
 import sys
 import threading
-import os
 import time
-import csv
-from tkinter import messagebox
+import numpy as np
 from decimal import Decimal
+from Emulator.Store import Store
+from Emulator import Trace
+from Emulator.Registry import registry
 
 class Scale:
     """Act as a scale referance, for differant unit"""
@@ -28,8 +26,11 @@ class Config:
             {"number":'4',"name":"CH4","probe_ratio":'1',"vertical_scale":'500',"vertical_unit_name":"mV","offset":'0',"offset_unit_name":"V","display":"OFF"}
             ]
         self.trigger = {"source":"CHANnel","source_number":'1',"slope":'1',"slope_unit":"V","threshold":'1'}
+        # segmented mode : a segment per step, from a GPIO of the DUT raised at each new setpoint on EXT TRIG
+        self.step_trigger = {"source":"EXTernal","source_number":'',"slope":"POSitive","slope_unit":'',"threshold":'1.5'}
         self.timescale = (200,'US')
         self.frequency = (1,'KHz')
+        self.applied = {}     # header -> value last sent to the device, only the changes are sent again
         
 class OSCI:
     """class to emulate an oscilloscope
@@ -37,16 +38,30 @@ class OSCI:
     Go check OSCI_on_ACMX for that
     """
     
-    def __init__(self,UI:bool=False):
+    def __init__(self,UI:bool=False,store:Store=None):
         self.com = None
+        self.tracer = Trace.tracer      # latency of every command sent
+        self.registry = registry        # sessions kept from one run to the next
+        self.resource = 'USB0::10893::918::CN62117164::0::INSTR'   # You might have to change with the number corresponding to your device
         self.config = Config()
         self.scale = Scale()
-        self.waveforms = {}
+        self.store = store if store is not None else Store()
+        self.waveforms = self.store.table('OSCI')   # t (s, monotonic) and one column per channel name, in V
         self.mainThread = None
         self.dataLock = threading.Lock()
         self.logInterval = 0.001
         self.run = False
         self.ui = UI
+        self.acquisition = 'MEASure'    # 'MEASure' one VMAX query per channel, 'WAVeform' whole records, 'SEGMented' see set_segmented_mode
+        self.waveformFormat = 'WORD'
+        self.waveformPoints = 1000
+        self.digitize = False           # trigger a new acquisition before each waveform measure
+        self.preambles = {}             # scaling of the records, by channel number
+        self.traces = {}                # last record of each channel, in V
+        self.stats = self.store.table('OSCI stats')   # '<name> min', '<name> max', '<name> mean' of each record
+        self.pending = []               # settings changed, waiting for _apply()
+        self.segments = 50              # segments of a segmented acquisition, one per step
+        self.steps = []                 # (time, tags) of the steps measured, waiting for their segment
         
     def float_to_nr3(self,number:float) -> str:
         """Convert float to scientific notation (NR3 format)."""
@@ -58,11 +73,11 @@ class OSCI:
         return self.float_to_nr3(number)
     
     def connect_to_device(self):
-        rm = pyvisa.ResourceManager()
-        ports = serial.tools.list_ports.comports()
+        self.config.applied.clear()     # state of the device unknown
+        if self.ui:
+            from tkinter import messagebox    # loaded with the UI only, headless runs have no display
         try:
-            self.com = rm.open_resource('USB0::10893::918::CN62117164::0::INSTR')
-            # You might have to change with the number corresponding to your device
+            self.com = self.tracer.wrap(self.registry.open_resource(self.resource),'OSCI')
             if self.ui:
                 messagebox.showinfo(title='Successfully connected',message="Found oscilloscope : "+self._get())
             else:
@@ -74,6 +89,12 @@ class OSCI:
             else:
                 sys.exit(e)
     
+    def connect_to_simulator(self,bench):
+        """Use the simulated oscilloscope of a SIMemu.Bench instead of the device"""
+        self.config.applied.clear()
+        self.com = self.tracer.wrap(bench.dsox,'OSCI')
+        print("Found oscilloscope :",self._get())
+
     def setup(self):
         """Set up the device with provided configuration."""
         try:
@@ -81,9 +102,21 @@ class OSCI:
             self._setup_time_base()
             self._setup_channels()
             self._setup_trigger()
+            if self.acquisition != 'MEASure':
+                self._setup_waveform()
+            if self.acquisition == 'SEGMented':
+                self._setup_segmented()
+            self._apply()
+            self.waveforms.add_column('t',unit='s')
+            self.stats.add_column('t',unit='s')
             for ch in self.config.channels:
-                self.waveforms[ch['name']] = []
-            self.waveforms['time'] = []
+                self.waveforms.add_column(ch['name'],unit='V')
+                for stat in ('min','max','mean'):
+                    self.stats.add_column(f"{ch['name']} {stat}",unit='V')
+            self.waveforms.clear()
+            self.stats.clear()
+            if self.acquisition == 'SEGMented':
+                self.arm()
         except KeyboardInterrupt:
             self.release()
     
@@ -100,6 +133,7 @@ class OSCI:
         """
         self.com.write("*RST")
         self.com.write("*CLS")
+        self.config.applied.clear()   # back to the default settings
         self.com.write(":STOP")
         self.com.write(":MEASure:CLEar")
         self.display_text()
@@ -118,6 +152,50 @@ class OSCI:
         except Exception as e:
             print("Error while writting instruction : %s",e)
             
+    def _set(self,header:str,value:str):
+        """Queue a setting for _apply(), if it differs from the value last sent"""
+        if self.config.applied.get(header) != value:
+            self.config.applied[header] = value
+            self.pending.append(f"{header} {value}")
+
+    def _apply(self,max_length:int=500):
+        """
+        Send the queued settings, joined in ';'-separated messages of at most max_length characters,
+        the last one ends with *OPC? and :SYSTem:ERRor? : one round trip to apply and check them all.
+        The error queue is cleared first (*CLS), and read until it is empty when the batch failed.
+        """
+        if not self.pending:
+            return
+        if self.com == None:
+            sys.exit("You need to connect to oscilloscope first !")
+        messages = ['*CLS']     # errors reported next belong to this batch
+        for command in self.pending:
+            if len(messages[-1])+len(command)+1 > max_length:
+                messages.append(command)
+            else:
+                messages[-1] += ';'+command
+        self.pending = []
+        self.preambles.clear()   # scaling of the records may have changed
+        for message in messages[:-1]:
+            self._write(message)
+        answer = self._get(messages[-1]+';*OPC?;:SYSTem:ERRor?')
+        error = answer.strip().split(';')[-1] if answer else 'no answer'
+        errors = []
+        while self._error_code(error) != 0 and len(errors) < 32:     # the queue holds a few dozen entries at most
+            errors.append(error)
+            if self._error_code(error) is None:
+                break
+            error = (self._get(':SYSTem:ERRor?') or 'no answer').strip()
+        if errors:
+            print("Error while applying settings :"," | ".join(errors))
+            self.config.applied.clear()   # sent again by the next setup
+
+    @staticmethod
+    def _error_code(error:str):
+        """ Code of an entry of the error queue ('+0,"No error"' -> 0), None if it is not one """
+        code = error.split(',')[0].strip()
+        return int(code) if code.lstrip('+-').isdigit() else None
+
     def _get(self,ques:str='*IDN?'):
         """
         query method for instrument
@@ -126,6 +204,15 @@ class OSCI:
             return self.com.query(ques)
         except:
             print("Error while query :",ques)
+
+    def _get_binary(self,ques:str,datatype:str='H'):
+        """
+        query method for binary blocks (IEEE 488.2 definite length), as numpy array
+        """
+        try:
+            return self.com.query_binary_values(ques,datatype=datatype,is_big_endian=False,container=np.array)
+        except Exception as e:
+            print("Error while binary query :",ques,e)
     
     def _setup_time_base(self):
         """
@@ -133,52 +220,77 @@ class OSCI:
         Note: Device has 10 horizontal divisions
         """
         scale = self.time_to_nr3(self.config.timescale[0],self.config.timescale[1])
-        self._write(f":TIMebase:SCALe {scale}")
-        self._write(":TIMebase:REFerence LEFT")
-        self._write(":TIMebase:POSition 0")
+        self._set(":TIMebase:SCALe",scale)
+        self._set(":TIMebase:REFerence","LEFT")
+        self._set(":TIMebase:POSition","0")
 
     def _setup_acquisition(self,mode:str="NORMal"):
         """Set up acquisition mode"""
-        self._write(":ACQuire:TYPE "+mode)
+        self._set(":ACQuire:TYPE",mode)
+        self._set(":ACQuire:MODE","SEGMented" if self.acquisition == 'SEGMented' else "RTIMe")
+
+    def _setup_segmented(self):
+        """Set up the segmented memory : one segment per trigger, all of them in one :WAVeform:DATA?"""
+        self._set(":ACQuire:SEGMented:COUNt",str(self.segments))
+        self._set(":WAVeform:SEGMented:ALL","ON")
+
+    def _setup_waveform(self):
+        """Set up the waveform transfer : format, number of points, unsigned little endian words"""
+        self._set(":WAVeform:FORMat",self.waveformFormat)
+        self._set(":WAVeform:POINts:MODE","NORMal")
+        self._set(":WAVeform:POINts",str(self.waveformPoints))
+        self._set(":WAVeform:UNSigned","ON")
+        self._set(":WAVeform:BYTeorder","LSBFirst")
 
     def _setup_channels(self):
-        """Set up channels parameters"""
+        """Set up channels parameters, _apply() send the ones that changed"""
         for ch in self.config.channels:
-            self._write(f":CHANnel{ch['number']}:COUPling DC")
-            self._write(f":CHANnel{ch['number']}:UNITs VOLT")
+            self._set(f":CHANnel{ch['number']}:COUPling","DC")
+            self._set(f":CHANnel{ch['number']}:UNITs","VOLT")
 
             probe_ratio = self.float_to_nr3(ch["probe_ratio"])
-            self._write(f":CHANnel{ch['number']}:PROBe {probe_ratio}")
+            self._set(f":CHANnel{ch['number']}:PROBe",probe_ratio)
 
             scale_str = self.float_to_nr3(ch["vertical_scale"])
-            self._write(f":CHANnel{ch['number']}:SCALe {scale_str}{ch['vertical_unit_name']}")
+            self._set(f":CHANnel{ch['number']}:SCALe",f"{scale_str}{ch['vertical_unit_name']}")
 
             offset_str = self.float_to_nr3(ch["offset"])
-            self._write(f":CHANnel{ch['number']}:OFFSet {offset_str}{ch['offset_unit_name']}")
+            self._set(f":CHANnel{ch['number']}:OFFSet",f"{offset_str}{ch['offset_unit_name']}")
 
-            self._write(f":CHANnel{ch['number']}:DISPlay {ch['display']}")
-            self._write(f":CHANnel{ch['number']}:LABel '{ch['name']}'")
+            self._set(f":CHANnel{ch['number']}:DISPlay",ch['display'])
+            self._set(f":CHANnel{ch['number']}:LABel",f"'{ch['name']}'")
 
-        self._write(":DISPlay:LABel ON")
+        self._set(":DISPlay:LABel","ON")
     
     def _setup_trigger(self):
         """Set up trigger parameters"""
         trig = self.config.trigger
-        self._write(":TRIGger:MODE EDGE")
-        self._write(f":TRIGger:EDGE:SOURce {trig['source']}{trig['source_number']}")
-        self._write(f":TRIGger:EDGE:SLOPe {trig['slope']}{trig['slope_unit']}")
-        self._write(f":TRIGger:EDGE:LEVel {self.float_to_nr3(trig['threshold'])}")
+        self._set(":TRIGger:MODE","EDGE")
+        self._set(":TRIGger:EDGE:SOURce",f"{trig['source']}{trig['source_number']}")
+        self._set(":TRIGger:EDGE:SLOPe",f"{trig['slope']}{trig['slope_unit']}")
+        self._set(":TRIGger:EDGE:LEVel",self.float_to_nr3(trig['threshold']))
             
+    @staticmethod
+    def _check_label(name:str):
+        """ A label is sent quoted, in a ';'-separated batch : it may not end either """
+        if any(char in name for char in ";'\"\n"):
+            raise ValueError(f"channel label {name!r} : ';', quotes and new lines are not allowed")
+
     def set_channel_setting(self,setname,setvalue,number:int=1):
         """
         Change a channel setting to desired value
         """
+        if setname == 'name':
+            self._check_label(setvalue)
         self.config.channels[number-1][setname] = setvalue
         self._setup_channels()  # to apply changes
+        self._apply()
     
     def set_channel(self,number:int,param:dict):
+        self._check_label(param['name'])
         self.config.channels[number-1] = param
         self._setup_channels()
+        self._apply()
     
     def set_log_interval(self,n):
         self.logInterval = n
@@ -189,10 +301,12 @@ class OSCI:
         """
         self.config.trigger[setname] = setvalue
         self._setup_trigger()
+        self._apply()
     
     def set_trigger(self,param:dict):
         self.config.trigger = param
         self._setup_trigger()
+        self._apply()
         
     def set_time_to(self,num:float,unit:str):
         """
@@ -200,14 +314,182 @@ class OSCI:
         """
         self.config.timescale = (num,unit)
         self._setup_time_base()
+        self._apply()
     
+    def set_waveform_mode(self,fmt:str='WORD',points:int=1000,digitize:bool=False):
+        """
+        measure() will pull whole records (BYTE or WORD) instead of querying VMAX,
+        min/max/mean are then computed from the record
+        """
+        self.acquisition = 'WAVeform'
+        self.waveformFormat = fmt
+        self.waveformPoints = points
+        self.digitize = digitize
+        if self.com is not None:
+            self._setup_acquisition()
+            self._setup_waveform()
+            self._apply()
+
+    def set_measure_mode(self):
+        """measure() go back to one :MEASure:VMAX? query per channel, with the trigger used before the segmented mode"""
+        if self.acquisition == 'SEGMented':
+            self.config.trigger = self.measureTrigger
+        self.acquisition = 'MEASure'
+        if self.com is not None:
+            self._setup_trigger()
+            self._setup_acquisition()
+            self._apply()
+
+    def set_segmented_mode(self,segments:int=50,fmt:str='WORD',points:int=1000,trigger:dict=None):
+        """
+        The scope is armed once for `segments` triggers, one per step of the sweep, and records each one in its
+        segmented memory. The trigger must fire once per step : a fixed level on the supply only fires where a
+        staircase crosses it. By default config.step_trigger, the rising edge of a DUT GPIO on the EXT TRIG input,
+        or any trigger of set_trigger() (e.g. a channel wired to the GPIO).
+        measure() only notes the time and the tags of the step : no I/O. Once `segments` steps are noted,
+        or at collect(), every segment of a channel comes back in one binary transfer and is logged
+        with its step (the max of the record, as the VMAX query would, and min/max/mean in the stats).
+        """
+        if self.acquisition != 'SEGMented':
+            self.measureTrigger = self.config.trigger
+        self.acquisition = 'SEGMented'
+        self.segments = segments
+        self.waveformFormat = fmt
+        self.waveformPoints = points
+        self.config.trigger = dict(trigger if trigger is not None else self.config.step_trigger)
+        if self.com is not None:
+            self._setup_trigger()
+            self._setup_acquisition()
+            self._setup_waveform()
+            self._setup_segmented()
+            self._apply()
+
+    def arm(self):
+        """
+        Start a segmented acquisition, return once the scope waits for its triggers
+        :SINGle rather than :DIGitize, which would hold the parser until every segment is filled
+        (forever if the sweep stops early)
+        """
+        self.steps = []
+        self._get(":SINGle;*OPC?")
+
+    def collect(self):
+        """
+        Stop the segmented acquisition, pull all the segments of each channel and log one row per step noted
+        Segments and steps are paired in order : with a trigger missed or spurious, no segment is known to
+        belong to a step, every step of the acquisition is logged with NaN values
+        """
+        steps,self.steps = self.steps,[]
+        if not steps:
+            return
+        answer = self._get(":STOP;:WAVeform:SEGMented:COUNt?")
+        acquired = int(float(answer.strip().split(';')[-1])) if answer else 0
+        if acquired != len(steps):
+            print(f"OSCI : {acquired} segments acquired for {len(steps)} steps, logged without values (check the trigger)")
+        names = [ch['name'] for ch in self.config.channels if ch['display'] == 'ON']
+        rows = [{name:np.nan for name in names} for _ in steps]
+        stats = [{f"{name} {stat}":np.nan for name in names for stat in ('min','max','mean')} for _ in steps]
+        for ch in self.config.channels:
+            if ch['display'] != 'ON' or acquired != len(steps):
+                continue
+            record = self.fetch_waveform(ch['number'])
+            if record is None:
+                continue
+            t,voltage = record
+            size = len(voltage)//acquired
+            segments = voltage[:size*acquired].reshape(acquired,size)
+            self.traces[ch['name']] = (t[:size],segments[-1])
+            for row,stat,segment in zip(rows,stats,segments):
+                stat[f"{ch['name']} min"] = segment.min()
+                stat[f"{ch['name']} max"] = segment.max()
+                stat[f"{ch['name']} mean"] = segment.mean()
+                row[ch['name']] = segment.max()
+        for (t,tags),row,stat in zip(steps,rows,stats):
+            self.waveforms.append(tags,t=t,**row)
+            self.stats.append(tags,t=t,**stat)
+
+    def get_preamble(self,number):
+        """
+        Scaling of the records of a channel : (xincrement, xorigin, xreference, yincrement, yorigin, yreference)
+        Queried once, until the time base or the channels change
+        """
+        number = str(number)
+        if number not in self.preambles:
+            preamble = self._get(f":WAVeform:SOURce CHANnel{number};:WAVeform:PREamble?")
+            values = [float(el) for el in preamble.split(',')]
+            self.preambles[number] = tuple(values[4:10])
+        return self.preambles[number]
+
+    def fetch_waveform(self,number):
+        """
+        Pull the record of a channel, in one binary transfer
+        return (time in s, voltage in V) as numpy arrays, None if the transfer failed
+        """
+        xinc,xorig,xref,yinc,yorig,yref = self.get_preamble(number)
+        datatype = 'H' if self.waveformFormat == 'WORD' else 'B'
+        raw = self._get_binary(f":WAVeform:SOURce CHANnel{number};:WAVeform:DATA?",datatype)
+        if raw is None:
+            return None
+        voltage = (raw - yref) * yinc + yorig
+        t = (np.arange(len(raw)) - xref) * xinc + xorig
+        return t,voltage
+
     def measure(self):
+        if self.acquisition == 'WAVeform':
+            self._measure_waveforms()
+            return
+        if self.acquisition == 'SEGMented':
+            self.steps.append((time.monotonic(),dict(self.store.tags)))
+            if len(self.steps) >= self.segments:   # memory full, pulled before the next step
+                self.collect()
+                self.arm()
+            return
+        start = time.monotonic()
+        row = {}
         for ch in self.config.channels:
             if ch['display']=='ON':
-                self.waveforms[ch['name']].append(float(self._get(f":MEASure:VMAX? CHANnel{ch['number']}")))
+                row[ch['name']] = self._float(self._get(f":MEASure:VMAX? CHANnel{ch['number']}"))
+        self.waveforms.append(t=(start+time.monotonic())/2,**row)   # stamped at the middle of the queries
+
+    @staticmethod
+    def _float(answer) -> float:
+        """ Value of a query, NaN when it failed (None) or the scope has none (9.9E+37) """
+        try:
+            value = float(answer)
+        except (TypeError,ValueError):
+            return np.nan
+        return value if abs(value) < 9.9e37 else np.nan
+
+    def _measure_waveforms(self):
+        """Waveform mode of measure(), the max of each record is logged as the VMAX query would"""
+        start = time.monotonic()
+        displayed = [ch for ch in self.config.channels if ch['display']=='ON']
+        if self.digitize:
+            self._write(":DIGitize "+",".join(f"CHANnel{ch['number']}" for ch in displayed))
+        row = {}
+        stats = {}
+        for ch in displayed:
+            record = self.fetch_waveform(ch['number'])
+            if record is None:     # the row is logged anyway, as collect() does
+                row[ch['name']] = np.nan
+                for stat in ('min','max','mean'):
+                    stats[f"{ch['name']} {stat}"] = np.nan
+                continue
+            t,voltage = record
+            self.traces[ch['name']] = record
+            stats[f"{ch['name']} min"] = voltage.min()
+            stats[f"{ch['name']} max"] = voltage.max()
+            stats[f"{ch['name']} mean"] = voltage.mean()
+            row[ch['name']] = voltage.max()
+        t = (start+time.monotonic())/2
+        self.waveforms.append(t=t,**row)
+        self.stats.append(t=t,**stats)
         
     def release(self):
-        self.com.close()
+        if self.acquisition == 'SEGMented' and self.com is not None:
+            self.collect()
+        print(self.tracer.report('OSCI'))
+        self.com = None     # the session stays open in the registry for the next run
         
 if __name__ == '__main__':  # For debug purpose, wont execute if imported as a library
     oscitest = OSCI()
@@ -0,0 +1,144 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+
+class PPKDecoder:
+    """ Vectorized decoder for the PPK2 sample frames
+    Give the same numbers as PPK2_API.get_samples() (calibration modifiers and spike filter),
+    but decode a whole chunk of bytes from get_data() in one numpy pass.
+    Each frame is a little endian uint32 : ADC value on bits 0-13, range on bits 14-16,
+    digital channels on bits 24-31
+    """
+    block = 256    # block length for the rolling averages of the spike filter
+
+    def __init__(self,modifiers:dict,vdd:float,spike_filter_alpha:float=0.18,spike_filter_alpha5:float=0.06,spike_filter_samples:int=3):
+        self.adc_mult = 1.8 / 163840
+        self.vdd = vdd     # source voltage in mV, as PPK2_API.current_vdd
+        # one calibration value per measurement range, indexed by the range bits
+        self.modifiers = {key:np.array([float(modifiers[key][str(r)]) for r in range(5)])
+                          for key in ('O','R','UG','GS','GI','S','I')}
+        self.alpha = spike_filter_alpha
+        self.alpha5 = spike_filter_alpha5
+        self.spike_samples = spike_filter_samples
+        self.reset()
+
+    @classmethod
+    def from_api(cls,api):
+        """ Decoder using the calibration and the settings of a PPK2_API object """
+        return cls(api.modifiers,api.current_vdd,api.spike_filter_alpha,api.spike_filter_alpha5,api.spike_filter_samples)
+
+    def reset(self):
+        """ Forget the stream state (partial frame and spike filter) """
+        self.remainder = b''
+        self.rolling_avg = None
+        self.rolling_avg4 = None
+        self.prev_range = None
+        self.consecutive_range_samples = 0
+        self.after_spike = 0
+
+    def decode(self,buf:bytes):
+        """ Decode the bytes read from the PPK2
+        return (current in uA as float32 array, raw digital channels as uint8 array)
+        An incomplete frame at the end of buf is kept for the next call.
+        """
+        data = self.remainder + buf
+        n = len(data)//4
+        self.remainder = data[4*n:]
+        if n == 0:
+            return np.zeros(0,dtype=np.float32),np.zeros(0,dtype=np.uint8)
+        frames = np.frombuffer(data,dtype='<u4',count=n)
+        ranges = np.minimum((frames >> 14) & 0x7,4).astype(np.intp)
+        adc = ((frames & 0x3FFF) * 4).astype(np.float64)
+        digital = (frames >> 24).astype(np.uint8)
+
+        m = self.modifiers
+        result_without_gain = (adc - m['O'][ranges]) * (self.adc_mult / m['R'][ranges])
+        value = m['UG'][ranges] * (result_without_gain * (m['GS'][ranges] * result_without_gain + m['GI'][ranges])
+                                   + (m['S'][ranges] * (self.vdd / 1000) + m['I'][ranges]))
+        value = self._spike_filter(value,ranges)
+        return (value * 10**6).astype(np.float32),digital
+
+    def _spike_filter(self,value,ranges):
+        """ After a range change, replace the next samples by the rolling averages """
+        n = len(value)
+        prev = ranges[0] if self.prev_range is None else self.prev_range
+        previous = np.empty(n,dtype=np.intp)
+        previous[0] = prev
+        previous[1:] = ranges[:-1]
+        changes = np.flatnonzero(ranges != previous)
+        self.prev_range = int(ranges[-1])
+
+        # samples inside a spike window, and their rank since the range change
+        window = np.zeros(n,dtype=bool)
+        rank = np.zeros(n,dtype=np.intp)
+        pos = 0
+        after = self.after_spike
+        consecutive = self.consecutive_range_samples
+        for change in list(changes)+[n]:
+            k = min(after,change-pos)
+            if k > 0:
+                window[pos:pos+k] = True
+                rank[pos:pos+k] = consecutive + 1 + np.arange(k)
+                consecutive += k
+                after -= k
+            if change == n:
+                break
+            window[change] = True
+            rank[change] = 0
+            consecutive = 0
+            after = self.spike_samples - 1
+            pos = change + 1
+        self.after_spike = after
+        self.consecutive_range_samples = consecutive
+
+        # in the highest range, the first samples after a change do not feed the averages
+        frozen = np.flatnonzero(window & (ranges == 4) & (rank < 2))
+        avg = self._rolling(value,self.alpha,self.rolling_avg,frozen)
+        avg4 = self._rolling(value,self.alpha5,self.rolling_avg4,frozen)
+        self.rolling_avg = float(avg[-1])
+        self.rolling_avg4 = float(avg4[-1])
+        if not window.any():
+            return value
+        value = value.copy()
+        high = window & (ranges == 4)
+        value[high] = avg4[high]
+        low = window & (ranges != 4)
+        value[low] = avg[low]
+        return value
+
+    def _rolling(self,x,alpha,start,frozen):
+        """ Exponential rolling average y[i] = alpha*x[i] + (1-alpha)*y[i-1],
+        y staying at y[i-1] for the frozen indexes
+        """
+        y = np.empty(len(x))
+        if start is None:
+            start = x[0]
+        pos = 0
+        for index in list(frozen)+[len(x)]:
+            if index > pos:
+                y[pos:index] = self._ema(x[pos:index],alpha,start)
+                start = y[index-1]
+            if index == len(x):
+                break
+            y[index] = start
+            pos = index + 1
+        return y
+
+    def _ema(self,x,alpha,start):
+        """ Rolling average of x from the state start, computed by blocks
+        Inside a block y[i] = c^(i+1)*start + alpha*c^i*sum(x[j]*c^-j), c = 1-alpha
+        """
+        c = 1 - alpha
+        n = len(x)
+        nblock = -(-n//self.block)
+        blocks = np.zeros(nblock*self.block)
+        blocks[:n] = x
+        blocks = blocks.reshape(nblock,self.block)
+        j = np.arange(self.block)
+        zero_state = alpha * c**j * np.cumsum(blocks * c**-j,axis=1)
+        decay = c**(j+1)
+        for b in range(nblock):
+            zero_state[b] += decay*start
+            start = zero_state[b,-1]
+        return zero_state.reshape(-1)[:n]
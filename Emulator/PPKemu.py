@@ -4,23 +4,60 @@
 import time
 import sys
 import threading
-from ppk2_api.ppk2_api import PPK2_API,PPK2_MP
-from tkinter import *
-from tkinter import messagebox
+import numpy as np
+from Emulator.RingBuffer import RingBuffer
+from Emulator.Pyramid import Pyramid
+from Emulator.Energy import Integrator
+from Emulator.Analysis import trapezoid
+from Emulator.PPKdecoder import PPKDecoder
+from Emulator.Store import Store
+from Emulator import Trace,Clock
+from Emulator.Registry import registry
+
+def list_devices() -> dict:
+    """ Port of each PPK2 plugged, by serial number (a PPK2 shows two ports, the stream is on the second) """
+    import os
+    import serial.tools.list_ports
+    ports = {}
+    for port in sorted(serial.tools.list_ports.comports(),key=lambda port:port.device):
+        if os.name == 'nt':
+            found = port.description.startswith("nRF Connect USB CDC ACM")
+        else:
+            found = port.product == 'PPK2'
+        if found:
+            ports.setdefault(port.serial_number,[]).append(port.device)
+    return {serial:devices[-1] for serial,devices in ports.items()}
 
 class PPK:
     """ class to emulate a PPK device
     intended for the nordic ppk2
     """
-    def __init__(self,UI:bool=False):
+    def __init__(self,UI:bool=False,buffer_duration:float=10,store:Store=None,serial:str=None):
         self.ps = None                   # handler to the serial port
-        self.logInterval = 0.005         # duration between logs, in s
-        self.log = {}                    
+        self.serial = serial             # serial number of the PPK2 to use, when several are plugged
+        self.name = 'PPK' if serial is None else 'PPK '+serial   # of its table, stream and trace
+        self.logInterval = 0.005         # duration between two reads of the stream, in s
+        self.store = store if store is not None else Store()
+        self.log = self.store.table(self.name)   # columns t (s, monotonic), Iout, Imin, Imax, Istd (uA), Q (C), one row per measure
         self.run = False
+        self.mainThread = None
+        self.error = None                # exception that stopped the background reader, raised by measure() and stop()
+        self.dataLock = threading.Lock()
+        self.rate = 100000               # samples per second streamed by the PPK2
+        self.buffer = RingBuffer(buffer_duration*self.rate,'float32')   # current (uA), with timestamps
+        self.pyramid = Pyramid(self.rate,raw=self.buffer)   # 1 ms, 100 ms and 1 s aggregates of the stream
+        self.integrator = Integrator(period=1/self.rate)   # running charge (C) of the stream
+        self.decoder = None
+        self.recorder = None             # Recorder of the full rate stream, if set
+        self.markIndex = 0               # start of the window averaged by measure()
+        self.markCharge = 0.0            # charge of the stream up to markIndex
         self.port= ''
         self.duration=0
         self.ui = UI
         self.com = None
+        self.simulator = None            # SIMemu.Bench used instead of the device, if set
+        self.tracer = Trace.tracer       # latency of every read of the stream
+        self.registry = registry         # ports and sessions kept from one run to the next
         
     def set_log_interval(self,duration):
         """ define the duration between 2 logs
@@ -29,46 +66,69 @@ class PPK:
         with self.dataLock:
             self.logInterval = duration
             
-    def connect_to_device(self):
-        self.ps = None
-        try:
-            import serial
-            import serial.tools.list_ports
-        except ImportError:
-            print("The 'serial' python package is not installed");
-            print("Please install first the package (Linux, Mac, Win, …)")
-            print("here: https://pythonhosted.org/pyserial/index.html")
-            sys.exit(1)
-        #find ports...
-        ports = serial.tools.list_ports.comports()
-        plugged_devices = PPK2_API.list_devices()
+    def find_port(self) -> str:
+        """ Port of the PPK2 to use : the one plugged, or the one of the serial number given """
+        if self.ui:
+            from tkinter import messagebox    # loaded with the UI only, headless runs have no display
+        from ppk2_api.ppk2_api import PPK2_API
+        #find ports... (once, the registry keeps them while they are plugged)
+        if self.serial is not None:
+            plugged_devices = self.registry.ports(self.name,lambda:[port for serial,port in list_devices().items() if serial == self.serial])
+            if not plugged_devices:
+                if self.ui:
+                    messagebox.showerror(title='ERROR',message="PPK2 {0} not detected!".format(self.serial))
+                    return self.find_port()
+                else:
+                    sys.exit("PPK2 {0} not detected!".format(self.serial))
+            return plugged_devices[0]
+        plugged_devices = self.registry.ports('PPK',PPK2_API.list_devices)
         if len(plugged_devices) != 2:
             if len(plugged_devices) > 2:
                 if self.ui:
                     messagebox.showerror(title='ERROR',message="Multiple power profiler kit connected!")
                     self.connectToDevice()
                 else:
-                    sys.exit("Multiple power profiler kit connected!")
+                    sys.exit("Multiple power profiler kit connected! Select one by its serial number : "+', '.join(list_devices()))
             else:
                 if self.ui:
                     messagebox.showerror(title='ERROR',message="No power profiler kit detected!")
                     self.connectToDevice()
                 else:
                     sys.exit("No power profiler kit detected!")
-        #... and connect to it.
+        return plugged_devices[1]
+
+    def connect_to_device(self):
+        self.ps = None
         try:
-            self.ps = serial.Serial(port=plugged_devices[1], baudrate=115200, timeout=1)
-            time.sleep(0.2)
-            self.ps.reset_input_buffer()
-            self.port = plugged_devices[1]
+            import serial
+        except ImportError:
+            print("The 'serial' python package is not installed");
+            print("Please install first the package (Linux, Mac, Win, …)")
+            print("here: https://pythonhosted.org/pyserial/index.html")
+            sys.exit(1)
+        port = self.find_port()
+        #... and connect to it, the port is only opened by PPK2_API
+        try:
+            self.ps = self.registry.ppk2(port).ser
+            self.port = port
             if self.ui:
-                messagebox.showinfo(title='Successfully connected',message="Found PPK2 at {0}".format(plugged_devices[1]))
+                from tkinter import messagebox
+                messagebox.showinfo(title='Successfully connected',message="Found PPK2 at {0}".format(port))
             else:
-                print("Found PPK2 at {0}".format(plugged_devices[1]))
+                print("Found PPK2 at {0}".format(port))
         except serial.serialutil.SerialException:
-            print('Serial line {0} not found'.format(plugged_devices[1]))  
+            self.registry.forget(self.name)
+            print('Serial line {0} not found'.format(port))  
             sys.exit(1)
     
+    def connect_to_simulator(self,bench):
+        """ Use the simulated PPK2 of a SIMemu.Bench instead of the device """
+        from Emulator.SIMemu import SimSerial
+        self.simulator = bench
+        self.ps = SimSerial('SIM-PPK2')
+        self.port = self.ps.name
+        print("Found PPK2 at {0}".format(self.port))
+
     def checkconnected(self):
         if not self.ps:
             sys.stderr.write ("ERROR: you should first connect to the power supply")
@@ -79,8 +139,31 @@ class PPK:
     
     def setup(self):
         self.checkconnected()
-        self.log['Iout'] = []
-        self.com = PPK2_MP(self.port, timeout=1, write_timeout=1, exclusive=True)
+        self.error = None
+        self.stop()     # a new run on a PPK already streaming
+        self.log.add_column('t',unit='s')
+        self.log.add_column('Iout',unit='uA')
+        for name in ('Imin','Imax','Istd'):
+            self.log.add_column(name,unit='uA')
+        self.log.add_column('Q',unit='C')
+        self.log.clear()
+        if self.pyramid is not None:
+            self.pyramid.clear(self.buffer.head)
+        if self.integrator is not None:
+            self.integrator.clear(self.buffer.head)
+        self.markCharge = 0.0
+        if self.simulator is not None:
+            self.com = self.simulator.ppk2()
+        else:
+            self.com = self.registry.ppk2(self.port)
+        self._start()
+        self.run = True
+        self.mainThread = threading.Thread(target=self._acquire,daemon=True)
+        self.mainThread.start()
+
+    def _start(self):
+        """ Configure the opened PPK2 (self.com) and start its stream """
+        self.com = self.tracer.wrap(self.com,self.name)
         try:
             self.com.get_modifiers()
         except Exception as e:
@@ -89,27 +172,122 @@ class PPK:
         self.com.set_source_voltage(3300)
         self.com.use_ampere_meter()  # set ampere meter mode
         self.com.toggle_DUT_power('ON')
+        self.decoder = PPKDecoder.from_api(self.com)   # once modifiers and voltage are known
         self.com.start_measuring()
-        
+
+    def _read(self):
+        """ Move what the PPK2 streamed since the last call to the ring buffer """
+        read_data = self.com.get_data()
+        now = time.monotonic()
+        if read_data != b'':
+            samples, raw_digital = self.decoder.decode(read_data)
+            # the chunk ends with the sample just read, going back one period per sample
+            times = now - np.arange(len(samples)-1,-1,-1)/self.rate
+            # aggregated first : what a reader finds under the head of the buffer is in them too
+            if self.pyramid is not None:
+                self.pyramid.push(samples,times)
+            if self.integrator is not None:
+                self.integrator.push(samples,times)
+            self.buffer.push(samples,times)
+            if self.recorder is not None:
+                self.recorder.write(self.name+'.stream',t=times,Iout=samples,digital=raw_digital)
+
+    def _acquire(self):
+        """ Background reader, drain the PPK2 stream nonstop into the ring buffer """
+        while self.run:
+            try:
+                self._read()
+            except Exception as e:     # serial or decode error : the buffer would go stale silently
+                self.error = e
+                self.run = False
+                return
+            with self.dataLock:
+                interval = self.logInterval
+            Clock.clock.sleep(interval)     # a replay reads as fast as its stream is released
+
+    def mark(self):
+        """ Start a new measurement window, to call right after a new setpoint """
+        self.markIndex = self._event('mark',lambda:self.buffer.head)
+        if self.integrator is not None:
+            self.markCharge = self.integrator.at(self.markIndex)
+
+    def settle(self,index:int):
+        """ Start the window of the next measure at the sample `index`, once the current is stable """
+        self.markIndex = index
+        if self.integrator is not None:
+            self.markCharge = self._charge(self.markIndex)
+
+    def _charge(self,index:int) -> float:
+        """ Charge of the stream up to the sample `index` : the snapshots are at the end of a chunk,
+        the charge of the samples since the index is taken off
+        """
+        values,times,head = self.buffer.window(index-1)
+        return self.integrator.at(head)-self.integrator.span(values,times)
+
+    def _event(self,operation:str,position):
+        """ Step boundary ('mark' or 'measure') of the recorded session, the indexes given by position() are returned :
+        a replay fills the buffer up to the recorded boundary, and gives back the recorded window of a measure
+        """
+        if self.com is None:     # another process reads the PPK2
+            return position()
+        return self.com.event(operation,position)
+
+    def _raise(self):
+        """ Raise the error of the background reader, once """
+        error,self.error = self.error,None
+        if error is not None:
+            raise error
+
     def measure(self):
-        read_data1 = self.com.get_data()
-        read_data2 = self.com.get_data()
-        if read_data1 != b'':
-            samples, raw_digital = self.com.get_samples(read_data1)
-            samples2,raw = self.com.get_samples(read_data2)
-            self.log['Iout'].append((sum(samples)+sum(samples2))/(len(samples)+len(samples2)))
+        """ Log the average current since the last setpoint (or the last measure) """
+        self._raise()
+        start,stop = self._event('measure',lambda:(self.markIndex,self.buffer.head))
+        if start != self.markIndex:      # replayed : the window of the recording
+            self.markIndex = start
+            if self.integrator is not None:
+                self.markCharge = self._charge(start)
+        if self.pyramid is None:
+            samples, times, self.markIndex = self.buffer.window(self.markIndex,stop)
+            if len(samples) != 0:
+                # stamped at the middle of the averaged window
+                self.log.append(t=(times[0]+times[-1])/2,Iout=samples.mean(dtype=np.float64),Q=trapezoid(samples,times)*1e-6)
+            return
+        # from the pyramid : a few blocks per level and the raw samples at the edges, even for long steps
+        _, times, _ = self.buffer.window(stop-1,stop)
+        if stop <= start or len(times) == 0:
+            return
+        stats = self.pyramid.stats(start,stop)
+        charge = np.nan
+        if self.integrator is not None:
+            total = self.integrator.at(stop)
+            charge,self.markCharge = total-self.markCharge,total
+        self.markIndex = stop
+        self.log.append(t=times[-1]-(stop-start-1)/self.rate/2,Iout=stats.mean,Imin=stats.min,Imax=stats.max,Istd=stats.std,Q=charge)
             
+    def stop(self):
+        """ Stop the stream, setup() starts it again """
+        self.run = False
+        if self.mainThread is not None:
+            self.mainThread.join()
+            self.mainThread = None
+        if self.com is not None:
+            self.com.stop_measuring()
+        self._raise()
+
     def release(self):
-        self.com.stop_measuring()
-        self.ps.close()
-        self.com = None
+        try:
+            self.stop()
+        finally:
+            print(self.tracer.report(self.name))
+            self.com = None     # the port stays open in the registry for the next run
         
 if __name__ == '__main__':  # For debug purpose, wont execute if imported as a library
     ppktest = PPK()
     ppktest.connect_to_device()
     ppktest.setup()
     for i in range(100):
+        ppktest.mark()
         time.sleep(0.1)
         ppktest.measure()
-    print(ppktest.log)
+    print(ppktest.log['Iout'])
     ppktest.release()
\ No newline at end of file
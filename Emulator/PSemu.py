@@ -3,10 +3,10 @@
 
 import time
 import sys
-import threading
-import pyvisa
-from tkinter import *
-from tkinter import messagebox
+from concurrent.futures import ThreadPoolExecutor
+from Emulator.Store import Store
+from Emulator import Trace
+from Emulator.Registry import registry,serial_ports
 
 # Arranged version of code from https://github.com/mbriday/PVEmu/tree/main
 # with tkinter UI integration, and pyvisa commands
@@ -17,30 +17,29 @@ class PS:
     based on the TENMA programmable power supply
     """
 
-    def __init__(self,UI:bool = False):
-        self.ps = None                   # handler to the serial port
+    def __init__(self,UI:bool = False,store:Store = None):
+        self.ps = None                   # serial port of the supply
         self.logInterval = 0.005         # duration between logs, in s
-        self.log = {}                    # tuple (date(s), voltage ,current, actualVoltage, actualCurrent)
+        self.store = store if store is not None else Store()
+        self.log = self.store.table('PS')   # columns t (s, monotonic), Vout (V), Iout (A)
         self.voltageSetpoint = 0.0       # V
         self.currentSetpoint = 0.0       # I
         self.com = None
+        self.tracer = Trace.tracer       # latency of every command sent
+        self.registry = registry         # ports and sessions kept from one run to the next
         self.ui=UI
+        self.io = None                   # thread doing every exchange with the supply, in order
+        self.sent = {}                   # last setpoint written ('VSET1', 'ISET1') -> value
+        self.readbacks = []              # readbacks of measure() not logged yet
+        self.lastReadback = None         # Future of the last one, its result is (V, A)
         
     def connect_to_device(self):
         self.ps = None
-        rm = pyvisa.ResourceManager()
-        try:
-            import serial
-            import serial.tools.list_ports
-            import serial.serialutil
-        except ImportError:
-            print("The 'serial' python package is not installed");
-            print("Please install first the package (Linux, Mac, Win, …)")
-            print("here: https://pythonhosted.org/pyserial/index.html")
-            sys.exit(1)
-        #find ports...
-        ports = serial.tools.list_ports.comports()
-        devicesPS = [port.device for port in ports if port.product == 'USB Virtual COM']
+        if self.ui:
+            from tkinter import messagebox    # loaded with the UI only, headless runs have no display
+        import pyvisa
+        #find ports... (once, the registry keeps them while they are plugged)
+        devicesPS = self.registry.ports('PS',lambda:serial_ports(lambda port:port.product == 'USB Virtual COM'))
         if len(devicesPS) != 1:
             if len(devicesPS) > 1:
                 if self.ui:
@@ -54,58 +53,93 @@ class PS:
                     self.connectToSupply()
                 else:
                     sys.exit("No power supply detected!")
-        #... and connect to it.
+        #... and connect to it, the port is only opened by VISA, which flushes its input buffer
         try:
-            self.ps = serial.Serial(port=devicesPS[0], baudrate=115200, timeout=1)
-            #we flush the input buffer.
-            # https://stackoverflow.com/questions/7266558/pyserial-buffer-wont-flush
-            time.sleep(0.2)
-            self.ps.reset_input_buffer()
+            self.com = self.tracer.wrap(self.registry.open_resource('ASRL'+devicesPS[0]+'::INSTR'),'PS')
+            self.ps = devicesPS[0]
+            self.sent = {}   # setpoints unknown, the supply may have been used meanwhile
             #no output for now
-            self.com = rm.open_resource('ASRL'+devicesPS[0]+'::INSTR')
             self.setOutput(False)
             if self.ui:
                 messagebox.showinfo(title='Successfully connected',message="Found power supply : {0}".format(self.identification()))
             else:
                 print("Found power supply : {0}".format(self.identification()))
-        except serial.serialutil.SerialException: 
+        except pyvisa.errors.VisaIOError: 
+            self.registry.forget('PS')
             sys.exit('Serial line {0} not found'.format(devicesPS[0]))
 
+    def connect_to_simulator(self,bench):
+        """ Use the simulated supply of a SIMemu.Bench instead of the device """
+        self.ps = 'SIM-TENMA'
+        self.com = self.tracer.wrap(bench.tenma,'PS')
+        self.sent = {}
+        self.setOutput(False)
+        print("Found power supply : {0}".format(self.identification()))
+
     def checkconnected(self):
-        if not self.ps:
+        if not self.ps or self.com is None:
             sys.stderr.write ("ERROR: you should first connect to the power supply")
             sys.exit(1)
-        elif not self.ps.isOpen():
-            sys.stderr.write ("ERROR: try to work on closed port "+self.ps.name()+"\n")
-            sys.exit(1)
 
-    def setOperatingPoint(self,voltage, amp):
+    def _submit(self,function,*args):
+        """ Queue an exchange with the supply on the I/O thread, return its Future """
+        if self.io is None:
+            self.io = ThreadPoolExecutor(max_workers=1,thread_name_prefix='PS-io')
+        return self.io.submit(function,*args)
+
+    def _call(self,function,*args):
+        """ Exchange with the supply, once the queued ones are done """
+        return self._submit(function,*args).result()
+
+    def setOperatingPoint(self,voltage, amp, wait:bool=True):
+        """ Write the setpoints that changed (the current limit is usually sent once)
+        wait=False returns at once, with the Future of the writes
+        The writes are queued after the readbacks of measure() not done yet : a readback belongs to the
+        setpoint it was queued at, only the time spent on the other devices meanwhile is saved
+        """
         self.checkconnected()
         self.voltageSetpoint = voltage
         self.currentSetpoint = amp
-        self.com.write('VSET1:'+str(voltage)+'\n')
-        self.com.write('ISET1:'+str(amp)+'\n')
+        future = self._submit(self._write_setpoints,str(voltage),str(amp))
+        if wait:
+            future.result()
+        return future
+
+    def _write_setpoints(self,voltage:str,amp:str):
+        for header,value in (('VSET1',voltage),('ISET1',amp)):
+            if self.sent.get(header) != value:
+                self.com.write(header+':'+value+'\n')
+                self.sent[header] = value
 
     def getOperatingPoint(self):
         self.checkconnected()
+        return self._call(self._read_operating_point)
+
+    def getCurrent(self):
+        """ Current readback alone, one query """
+        self.checkconnected()
+        return self._call(lambda:float(self.com.query('IOUT1?\n')))
+
+    def _read_operating_point(self):
         V = float(self.com.query('VOUT1?\n'))
         I = float(self.com.query('IOUT1?\n'))
         return (V,I)
 
     def reset(self):
         self.checkconnected()
+        self._call(self._reset)
+
+    def _reset(self):
         self.com.write(b'*RST\n')
+        self.sent = {}      # setpoints of the supply back to their default
 
     def identification(self):
         self.checkconnected()
-        return self.com.query('*IDN?')
+        return self._call(self.com.query,'*IDN?')
 
     def setOutput(self,state):
         self.checkconnected()
-        if state:
-            self.com.write('OUT1\n')
-        else:
-            self.com.write('OUT0\n')
+        self._call(self.com.write,'OUT1\n' if state else 'OUT0\n')
 
     def set_log_interval(self,duration):
         """ define the duration between 2 logs
@@ -117,18 +151,49 @@ class PS:
         self.checkconnected()
         self.setOperatingPoint(Vinit,Iinit)
         self.setOutput(True)
-        self.log['Vout'] = []
-        self.log['Iout'] = []
+        self.log.add_column('t',unit='s')
+        self.log.add_column('Vout',unit='V')
+        self.log.add_column('Iout',unit='A')
+        self.log.clear()
 
     def measure(self):
-        #measure
-        (Vcur,Icur) = self.getOperatingPoint()
-        self.log['Vout'].append(Vcur)
-        self.log['Iout'].append(Icur)
-    
+        """ Queue the readback and return : it is logged once the supply answered, with the tags
+        of the current step, while the caller goes on (next setpoint, other devices...)
+        flush() waits for the readbacks queued, or add_done_callback() on the Future returned
+        """
+        self.checkconnected()
+        self._reap()
+        self.lastReadback = self._submit(self._measure,dict(self.store.tags))
+        self.readbacks.append(self.lastReadback)
+        return self.lastReadback
+
+    def _measure(self,tags):
+        #measure, stamped at the middle of the readback
+        start = time.monotonic()
+        (Vcur,Icur) = self._read_operating_point()
+        self.log.append(tags,t=(start+time.monotonic())/2,Vout=Vcur,Iout=Icur)
+        return Vcur,Icur
+
+    def _reap(self):
+        """ Forget the readbacks done, raise the error of a failed one """
+        done,pending = [],[]
+        for future in self.readbacks:     # done() looked at once : a readback finishing meanwhile is in one list
+            (done if future.done() else pending).append(future)
+        self.readbacks = pending
+        for future in done:
+            future.result()
+
+    def flush(self):
+        """ Wait for the readbacks queued by measure() """
+        readbacks,self.readbacks = self.readbacks,[]
+        for future in readbacks:
+            future.result()
+
     def release(self):
-        self.com = None
-        self.ps.close()
+        if self.com is not None:
+            self.flush()
+        print(self.tracer.report('PS'))
+        self.com = None     # the session stays open in the registry for the next run
         
 if __name__ == '__main__':  # For debug purpose, wont execute if imported as a library
     pstest = PS()
@@ -137,4 +202,5 @@ if __name__ == '__main__':  # For debug purpose, wont execute if imported as a l
     start = time.time()
     for i in range(5):
         pstest.measure()
+    pstest.flush()
     print(pstest.log,time.time()-start)
\ No newline at end of file
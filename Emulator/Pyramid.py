@@ -0,0 +1,273 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+from Emulator.Store import Column
+
+# Multi-resolution aggregates of a stream (the current of a PPK2) kept while the samples arrive.
+# Level 0 sums up blocks of factors[0] samples, level 1 blocks of factors[1] blocks of level 0, ...
+# by default 1 ms, 100 ms and 1 s at 100 kS/s. Each block keeps the time of its first sample,
+# its count, sum, sum of squares, min and max : blocks merge exactly, so a window of any length
+# costs a few blocks per level, and the raw samples are only read at its edges.
+# Every sample is reduced once per level, in chunks : O(1) per sample.
+# Only the coarsest level keeps the whole stream (40 bytes per second at 1 s), the finer ones keep
+# the last minute (1 ms) and hour (100 ms) in rings : older windows are rounded to the blocks left.
+
+FIELDS = ('t','n','sum','sumsq','min','max')
+DTYPES = {'t':'float64','n':'int64','sum':'float64','sumsq':'float64','min':'float32','max':'float32'}
+
+def _group(blocks:dict,factor:int):
+    """ Merge each group of `factor` consecutive blocks, return the merged blocks and the incomplete last group """
+    full = len(blocks['t'])//factor*factor
+    rest = {name:values[full:] for name,values in blocks.items()}
+    if full == 0:
+        return None,rest
+    shape = (-1,factor)
+    merged = {'t':blocks['t'][:full:factor],
+              'n':blocks['n'][:full].reshape(shape).sum(axis=1),
+              'sum':blocks['sum'][:full].reshape(shape).sum(axis=1),
+              'sumsq':blocks['sumsq'][:full].reshape(shape).sum(axis=1),
+              'min':blocks['min'][:full].reshape(shape).min(axis=1),
+              'max':blocks['max'][:full].reshape(shape).max(axis=1)}
+    return merged,rest
+
+def _samples(values,times) -> dict:
+    """ Each sample as a block of one """
+    values = np.asarray(values)
+    wide = values.astype(np.float64)
+    return {'t':np.asarray(times,dtype=np.float64),'n':np.ones(len(values),dtype=np.int64),
+            'sum':wide,'sumsq':wide*wide,'min':values,'max':values}
+
+class Stats:
+    """ Count, mean, min, max and standard deviation of a window """
+    __slots__ = ('n','mean','min','max','std')
+
+    def __init__(self,n=0,total=0.0,squares=0.0,low=np.nan,high=np.nan):
+        self.n = int(n)
+        self.mean = total/n if n else np.nan
+        self.min = float(low)
+        self.max = float(high)
+        self.std = float(np.sqrt(max(squares/n-self.mean**2,0.0))) if n else np.nan
+
+    def __repr__(self):
+        return f"Stats(n={self.n}, mean={self.mean:.6g}, min={self.min:.6g}, max={self.max:.6g}, std={self.std:.6g})"
+
+class Level:
+    """ Blocks of `size` samples, in growing columns, or in rings of the last `capacity` blocks
+    count is published once every column holds the new blocks : readers never see half a block
+    """
+    def __init__(self,size:int,factor:int,capacity:int=None):
+        self.size = size           # samples per block
+        self.factor = factor       # blocks of the level below per block
+        self.capacity = capacity   # blocks kept, all of them if None
+        if capacity is None:
+            self.columns = {name:Column(name,DTYPES[name]) for name in FIELDS}
+        else:
+            self.columns = {name:np.zeros(capacity,dtype=DTYPES[name]) for name in FIELDS}
+        self.pending = {name:np.zeros(0,dtype=DTYPES[name]) for name in FIELDS}   # incomplete block
+        self.count = 0
+
+    @property
+    def oldest(self) -> int:
+        """ Index of the oldest block kept """
+        return 0 if self.capacity is None else max(self.count-self.capacity,0)
+
+    def push(self,blocks:dict):
+        """ Add blocks of the level below, return the blocks completed here """
+        blocks = {name:np.concatenate([self.pending[name],blocks[name]]) for name in FIELDS}
+        merged,self.pending = _group(blocks,self.factor)
+        if merged is not None:
+            if self.capacity is None:
+                for name in FIELDS:
+                    self.columns[name].extend(merged[name])
+            else:
+                # only the last `capacity` blocks are written, in at most two slices of the rings
+                new = len(merged['t'])
+                keep = min(new,self.capacity)
+                first = (self.count+new-keep)%self.capacity
+                split = min(keep,self.capacity-first)
+                for name in FIELDS:
+                    values = merged[name][new-keep:]
+                    self.columns[name][first:first+split] = values[:split]
+                    self.columns[name][:keep-split] = values[split:]
+            self.count += len(merged['t'])
+        return merged
+
+    def field(self,name:str,start:int=0,stop:int=None) -> np.ndarray:
+        """ Field for the blocks [start, stop) still kept, a zero-copy view unless it wraps around the ring """
+        count = self.count
+        stop = count if stop is None else min(stop,count)
+        if self.capacity is None:
+            return self.columns[name].data[start:stop]
+        start = max(start,self.oldest)
+        if stop <= start:
+            return self.columns[name][:0]
+        first = start%self.capacity
+        last = first+stop-start
+        if last <= self.capacity:
+            return self.columns[name][first:last]
+        return np.concatenate([self.columns[name][first:],self.columns[name][:last-self.capacity]])
+
+    def find(self,t:float) -> int:
+        """ Number of blocks starting at or before the time t (counting the ones not kept) """
+        oldest = self.oldest
+        if self.capacity is None or self.count <= self.capacity:
+            return oldest+int(np.searchsorted(self.field('t'),t,side='right'))
+        first = oldest%self.capacity
+        older,newer = self.columns['t'][first:],self.columns['t'][:first]
+        if len(newer) and t >= newer[0]:
+            return oldest+len(older)+int(np.searchsorted(newer,t,side='right'))
+        return oldest+int(np.searchsorted(older,t,side='right'))
+
+    def merge(self,start:int,stop:int):
+        """ (n, sum, sumsq, min, max) of the blocks [start, stop) """
+        return (int(self.field('n',start,stop).sum()),float(self.field('sum',start,stop).sum()),
+                float(self.field('sumsq',start,stop).sum()),
+                float(self.field('min',start,stop).min()),float(self.field('max',start,stop).max()))
+
+    def clear(self):
+        self.count = 0
+        if self.capacity is None:     # the rings are simply written over
+            for column in self.columns.values():
+                column.clear()
+        self.pending = {name:values[:0] for name,values in self.pending.items()}
+
+class Pyramid:
+    """ Aggregates of a stream at several resolutions, fed by push() with the chunks of a RingBuffer
+    raw : the RingBuffer receiving the same samples, read for the edges of the windows.
+    Without it, or once the samples are overwritten, the edges are rounded to the blocks of level 0.
+    """
+    def __init__(self,rate:float=100000,factors=(100,100,10),raw=None,keep=(60,3600,None)):
+        """ keep : duration kept by each level in s, the whole stream if None (always for the coarsest one) """
+        self.rate = rate
+        self.raw = raw
+        self.levels = []
+        size = 1
+        for index,factor in enumerate(factors):
+            size *= factor
+            capacity = None
+            if index < len(factors)-1 and keep[index] is not None:
+                # at least a block of the level above, which is completed from these ones
+                capacity = max(int(keep[index]*rate/size),factors[index+1])
+            self.levels.append(Level(size,factor,capacity))
+        self.samples = 0     # samples pushed
+        self.origin = 0      # index in the raw buffer of the first sample pushed
+
+    @property
+    def durations(self) -> list:
+        """ Nominal duration of the blocks of each level, in s """
+        return [level.size/self.rate for level in self.levels]
+
+    def push(self,values,times):
+        """ Aggregate a chunk of samples, the chunks pushed to the raw buffer """
+        if len(values) == 0:
+            return
+        blocks = _samples(values,times)
+        for level in self.levels:
+            blocks = level.push(blocks)
+            if blocks is None:
+                break
+        self.samples += len(values)
+
+    def clear(self,origin:int=0):
+        """ Start again, the next sample pushed being the sample `origin` of the raw buffer """
+        for level in self.levels:
+            level.clear()
+        self.samples = 0
+        self.origin = origin
+
+    def _raw(self,start:int,stop:int):
+        """ (n, sum, sumsq, min, max) of the samples [start, stop), exact while they are in the raw buffer """
+        if self.raw is not None and start+self.origin >= self.raw.oldest():
+            values,_,_ = self.raw.window(start+self.origin,stop+self.origin)
+            if len(values) == stop-start:
+                wide = values.astype(np.float64)
+                return len(values),float(wide.sum()),float(np.dot(wide,wide)),float(values.min()),float(values.max())
+        level = self.levels[0]
+        if start >= level.count*level.size:      # not in a block yet
+            pending = level.pending
+            first = level.count*level.size
+            n = pending['n'][start-first:stop-first]
+            if len(n) == 0:
+                return None
+            window = slice(start-first,start-first+len(n))
+            return (len(n),float(pending['sum'][window].sum()),float(pending['sumsq'][window].sum()),
+                    float(pending['min'][window].min()),float(pending['max'][window].max()))
+        return level.merge(start//level.size,-(-stop//level.size))
+
+    def _collect(self,index:int,start:int,stop:int,parts:list):
+        """ Cover the samples [start, stop) with the blocks of level `index` and finer, -1 being the raw samples """
+        if start >= stop:
+            return
+        if index < 0:
+            part = self._raw(start,stop)
+            if part is not None:
+                parts.append(part)
+            return
+        level = self.levels[index]
+        if index+1 < len(self.levels) and start < level.oldest*level.size:
+            # the finer blocks are overwritten : rounded to the blocks of the level above
+            above = self.levels[index+1]
+            first,last = start//above.size,min(-(-stop//above.size),above.count)
+            if first < last:
+                parts.append(above.merge(first,last))
+            return
+        first = -(-start//level.size)
+        last = min(stop//level.size,level.count)
+        if first >= last:
+            self._collect(index-1,start,stop,parts)
+            return
+        parts.append(level.merge(first,last))
+        self._collect(index-1,start,first*level.size,parts)
+        self._collect(index-1,last*level.size,stop,parts)
+
+    def stats(self,start:int,stop:int=None) -> Stats:
+        """ Stats of the samples with index in [start, stop) (indexes of the raw buffer) """
+        if stop is None:
+            stop = self.raw.head if self.raw is not None else self.samples+self.origin
+        parts = []
+        self._collect(len(self.levels)-1,max(start-self.origin,0),stop-self.origin,parts)
+        if not parts:
+            return Stats()
+        n,total,squares,low,high = zip(*parts)
+        return Stats(sum(n),sum(total),sum(squares),min(low),max(high))
+
+    def index(self,t:float) -> int:
+        """ Index (in the raw buffer) of the first sample at or after the time t """
+        return self.origin+self._index(t)
+
+    def _index(self,t:float) -> int:
+        for level in self.levels:     # the finest level still holding the time t
+            block = level.find(t)-1
+            if block >= level.oldest or level is self.levels[-1]:
+                break
+        if block < 0:
+            return 0
+        if level is self.levels[0] and block == level.count-1:    # after the last block, in the samples not aggregated yet
+            times = level.pending['t']
+            if len(times) and t > times[0]:
+                return level.count*level.size + int(np.searchsorted(times,t))
+        offset = int(np.ceil((t-level.field('t',block,block+1)[0])*self.rate-1e-6))    # samples are 1/rate apart inside a block
+        return block*level.size + min(max(offset,0),level.size)
+
+    def window(self,t0:float,t1:float) -> Stats:
+        """ Stats of the samples between the times t0 and t1 """
+        return self.stats(self.index(t0),self.index(t1))
+
+    def view(self,t0:float=None,t1:float=None,points:int=2000) -> dict:
+        """ Blocks of the finest level showing [t0, t1] in at most `points` blocks
+        dict of arrays t (first sample), n, mean, min, max, std, to plot a zoomable stream
+        """
+        for level in self.levels:
+            first = 0 if t0 is None else max(level.find(t0)-1,0)
+            last = level.count if t1 is None else level.find(t1)
+            kept = first >= level.oldest      # else the start of the view is overwritten at this level
+            first = max(first,level.oldest)
+            if kept and last-first <= points or level is self.levels[-1]:
+                break
+        n = level.field('n',first,last)
+        total = level.field('sum',first,last)
+        mean = total/np.maximum(n,1)
+        std = np.sqrt(np.maximum(level.field('sumsq',first,last)/np.maximum(n,1)-mean*mean,0))
+        return {'t':level.field('t',first,last).copy(),'n':n.copy(),'mean':mean,
+                'min':level.field('min',first,last).copy(),'max':level.field('max',first,last).copy(),'std':std}
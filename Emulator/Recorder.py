@@ -0,0 +1,161 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import os
+import json
+import time
+import threading
+import numpy as np
+
+# Layout of a capture directory :
+#   index.jsonl              one line per flushed chunk {"stream":..., "columns":{name:[dtype, rows]}}
+#   <stream>/<column>.bin    raw little endian values of a column, appended chunk after chunk
+# A line of the index is only written once its chunk is on disk, so after a crash
+# the reader keeps every indexed chunk and ignores a partly written one.
+# A stream is also flushed when its last chunk is older than flush_interval : the few rows
+# of a sweep (one per step) reach the disk during the run, not at close().
+# Opening a capture again cuts the files back to the indexed chunks before appending.
+
+def _dtype(values) -> str:
+    return np.dtype(values.dtype).newbyteorder('<').str
+
+class Recorder:
+    """ Streaming writer of an append-only capture
+    write() buffers the values of a stream, they go to disk by chunks of chunk_rows
+    or once flush_interval seconds passed since the last chunk of the stream
+    Can be fed from several threads (e.g. the PPK reader and the main loop)
+    """
+    def __init__(self,path:str,chunk_rows:int=100000,fsync:bool=False,flush_interval:float=1.0):
+        self.path = path
+        self.chunkRows = chunk_rows
+        self.fsync = fsync               # force each chunk to the disk, slower but safer
+        self.flushInterval = flush_interval
+        self.lock = threading.Lock()
+        self.buffers = {}                # stream -> {column: [arrays]}
+        self.buffered = {}               # stream -> rows waiting
+        self.flushed = {}                # stream -> time.monotonic() of its last chunk
+        self.files = {}                  # (stream, column) -> open file
+        os.makedirs(path,exist_ok=True)
+        self._recover()
+        self.index = open(os.path.join(path,'index.jsonl'),'a')
+
+    def _recover(self):
+        """ Cut a capture written before (e.g. by a crashed run) back to its indexed chunks """
+        name = os.path.join(self.path,'index.jsonl')
+        if not os.path.exists(name):
+            return
+        sizes = {}                       # (stream, column) -> bytes indexed
+        valid = 0                        # bytes of the complete lines of the index
+        with open(name,'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                valid += len(line)
+                for column,(dtype,rows) in entry['columns'].items():
+                    key = (entry['stream'],column)
+                    sizes[key] = sizes.get(key,0) + rows*np.dtype(dtype).itemsize
+        os.truncate(name,valid)
+        for stream in os.listdir(self.path):     # <stream>/<column>.bin only, not a capture nested in it
+            directory = os.path.join(self.path,stream)
+            if not os.path.isdir(directory) or os.path.exists(os.path.join(directory,'index.jsonl')):
+                continue
+            for column in os.listdir(directory):
+                name = os.path.join(directory,column)
+                if column.endswith('.bin') and os.path.getsize(name) > sizes.get((stream,column[:-4]),0):
+                    os.truncate(name,sizes.get((stream,column[:-4]),0))
+
+    def write(self,stream:str,**columns):
+        """ Append values (scalars or arrays, one per column) to a stream """
+        with self.lock:
+            buffer = self.buffers.setdefault(stream,{})
+            rows = 0
+            for name,values in columns.items():
+                values = np.atleast_1d(values)
+                buffer.setdefault(name,[]).append(values)
+                rows = max(rows,len(values))
+            self.buffered[stream] = self.buffered.get(stream,0) + rows
+            now = time.monotonic()
+            if self.buffered[stream] >= self.chunkRows or now-self.flushed.setdefault(stream,now) >= self.flushInterval:
+                self._flush(stream)
+
+    def flush(self,stream:str=None):
+        """ Write the buffered values of a stream (or of all of them) """
+        with self.lock:
+            for name in ([stream] if stream is not None else list(self.buffers)):
+                self._flush(name)
+
+    def _flush(self,stream:str):
+        buffer = self.buffers.get(stream)
+        if not buffer:
+            return
+        entry = {}
+        for name,chunks in buffer.items():
+            values = np.concatenate(chunks)
+            values = values.astype(values.dtype.newbyteorder('<'),copy=False)
+            f = self._file(stream,name)
+            f.write(values.tobytes())
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            entry[name] = [_dtype(values),len(values)]
+        self.index.write(json.dumps({"stream":stream,"columns":entry})+'\n')
+        self.index.flush()
+        if self.fsync:
+            os.fsync(self.index.fileno())
+        self.buffers[stream] = {}
+        self.buffered[stream] = 0
+        self.flushed[stream] = time.monotonic()
+
+    def _file(self,stream:str,column:str):
+        if (stream,column) not in self.files:
+            directory = os.path.join(self.path,stream)
+            os.makedirs(directory,exist_ok=True)
+            self.files[(stream,column)] = open(os.path.join(directory,column+'.bin'),'ab')
+        return self.files[(stream,column)]
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+            self.index.close()
+
+class Capture:
+    """ Reader of a capture, every column is a np.memmap of the file (no copy, no load in RAM)
+    capture['PPK.stream']['Iout'] give the whole column
+    """
+    def __init__(self,path:str):
+        self.path = path
+        self.columns = {}                # stream -> {column: [dtype, rows]}
+        with open(os.path.join(path,'index.jsonl')) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:       # last line cut by a crash
+                    break
+                stream = self.columns.setdefault(entry['stream'],{})
+                for name,(dtype,rows) in entry['columns'].items():
+                    if name in stream:
+                        stream[name][1] += rows
+                    else:
+                        stream[name] = [dtype,rows]
+
+    def streams(self) -> list:
+        return list(self.columns)
+
+    def column(self,stream:str,name:str) -> np.ndarray:
+        dtype,rows = self.columns[stream][name]
+        if rows == 0:
+            return np.zeros(0,dtype=dtype)
+        return np.memmap(os.path.join(self.path,stream,name+'.bin'),dtype=dtype,mode='r',shape=(rows,))
+
+    def __getitem__(self,stream:str) -> dict:
+        return {name:self.column(stream,name) for name in self.columns[stream]}
+
+    def __contains__(self,stream:str):
+        return stream in self.columns
@@ -0,0 +1,109 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import os
+import sys
+import atexit
+import threading
+
+# Devices of the bench, shared by every emulator of the process :
+#  - a single VISA ResourceManager, created at its first use
+#  - the ports found for each kind of device, enumerated again only when one of them is gone
+#  - the open sessions (VISA resources, PPK2_API), kept from one run to the next and closed at exit
+
+def _present(port:str) -> bool:
+    """ Fast check of a cached port : its device file still exists (nothing to check for the COMx of Windows) """
+    return os.name == 'nt' or os.path.exists(port)
+
+def serial_ports(match) -> list:
+    """ Names of the serial ports whose pyserial ListPortInfo satisfies match(port) """
+    try:
+        import serial.tools.list_ports
+    except ImportError:
+        print("The 'serial' python package is not installed");
+        print("Please install first the package (Linux, Mac, Win, …)")
+        print("here: https://pythonhosted.org/pyserial/index.html")
+        sys.exit(1)
+    return [port.device for port in serial.tools.list_ports.comports() if match(port)]
+
+def _alive(session) -> bool:
+    """ True while a VISA session is open """
+    try:
+        session.session    # raise InvalidSession once closed
+        return True
+    except Exception:
+        return False
+
+class Registry:
+    """ Discovery and sessions of the devices, see registry below """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.rm = None
+        self.found = {}          # kind ('PS', 'PPK', ...) -> ports of the last discovery
+        self.sessions = {}       # resource name or port -> open session
+        self.discoveries = 0     # enumerations of the ports done
+
+    def resource_manager(self):
+        with self.lock:
+            if self.rm is None:
+                import pyvisa
+                self.rm = pyvisa.ResourceManager()
+            return self.rm
+
+    def ports(self,kind:str,discover,refresh:bool=False) -> list:
+        """ Ports of a kind of device, discover() is only called again when a cached port is gone """
+        with self.lock:
+            cached = self.found.get(kind)
+            if refresh or not cached or not all(_present(port) for port in cached):
+                self.found[kind] = list(discover())
+                self.discoveries += 1
+            return list(self.found[kind])
+
+    def forget(self,kind:str):
+        """ Drop the cached ports of a kind, after a failed connection """
+        with self.lock:
+            self.found.pop(kind,None)
+
+    def open_resource(self,name:str,**kwargs):
+        """ VISA session of a resource, opened at the first call only """
+        with self.lock:
+            session = self.sessions.get(name)
+            if session is not None and _alive(session):
+                return session
+            session = self.resource_manager().open_resource(name,**kwargs)
+            if name.startswith('ASRL'):
+                from pyvisa.constants import BufferOperation
+                session.flush(BufferOperation.discard_read_buffer)   # what the device sent before
+            self.sessions[name] = session
+            return session
+
+    def ppk2(self,port:str):
+        """ PPK2_API of a port, opened at the first call only """
+        with self.lock:
+            api = self.sessions.get(port)
+            if api is not None and api.ser.is_open:
+                api.ser.reset_input_buffer()    # frames streamed after the previous run
+                return api
+            from ppk2_api.ppk2_api import PPK2_API
+            api = PPK2_API(port,timeout=1,write_timeout=1,exclusive=True)
+            self.sessions[port] = api
+            return api
+
+    def close(self):
+        """ Close every session and the ResourceManager """
+        with self.lock:
+            for session in self.sessions.values():
+                try:
+                    if hasattr(session,'ser'):   # PPK2_API
+                        session.ser.close()
+                    else:
+                        session.close()
+                except Exception:
+                    pass
+            self.sessions = {}
+            if self.rm is not None:
+                self.rm.close()
+                self.rm = None
+
+registry = Registry()    # process wide registry used by the emulators
+atexit.register(registry.close)
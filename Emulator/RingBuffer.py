@@ -0,0 +1,70 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+
+class RingBuffer:
+    """ Preallocated circular buffer of timestamped samples
+    Made for one writer (an acquisition thread) and any number of readers, without lock :
+    the writer fills the arrays first, then publishes the new head.
+    Readers only trust what is under the head they read, and drop what the writer
+    may have overwritten while they were copying.
+    """
+    def __init__(self,capacity:int,dtype='float64'):
+        self.capacity = int(capacity)
+        self.values = np.zeros(self.capacity,dtype=dtype)
+        self.times = np.zeros(self.capacity,dtype='float64')   # time.monotonic() of each sample, in s
+        self.head = 0    # absolute index of the next sample to write, never wraps
+        self.reserved = 0   # end of the chunk being written, published before the data
+
+    def push(self,values,times):
+        """ Append a chunk of samples (and their timestamps) """
+        n = len(values)
+        if n == 0:
+            return
+        head = self.head
+        if n > self.capacity:  # only the end of the chunk can be kept
+            values = values[-self.capacity:]
+            times = times[-self.capacity:]
+            head += n - self.capacity
+            n = self.capacity
+        self.reserved = head + n
+        start = head % self.capacity
+        first = min(n,self.capacity-start)
+        self.values[start:start+first] = values[:first]
+        self.times[start:start+first] = times[:first]
+        if first < n:   # wrap around
+            self.values[:n-first] = values[first:]
+            self.times[:n-first] = times[first:]
+        self.head = head + n   # publish once the data is in place
+
+    def oldest(self) -> int:
+        """ Absolute index of the oldest sample still available """
+        return max(0,self.head-self.capacity)
+
+    def window(self,start:int,stop:int=None):
+        """ Copy of the samples with absolute index in [start,stop)
+        return (values, times, stop), stop being where the next window should start
+        """
+        head = self.head
+        if stop is None or stop > head:
+            stop = head
+        start = max(start,head-self.capacity,0)
+        if start >= stop:
+            return self.values[:0].copy(),self.times[:0].copy(),stop
+        idx = np.arange(start,stop) % self.capacity
+        values = self.values[idx]
+        times = self.times[idx]
+        # the writer may have lapped us during the copy : drop the overwritten part
+        lost = self.reserved - self.capacity - start
+        if lost > 0:
+            values = values[lost:]
+            times = times[lost:]
+        return values,times,stop
+
+    def mean(self,start:int,stop:int=None):
+        """ Average of the samples in [start,stop), None if there is none """
+        values,_,_ = self.window(start,stop)
+        if len(values) == 0:
+            return None
+        return float(values.mean(dtype=np.float64))
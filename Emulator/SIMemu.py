@@ -0,0 +1,364 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import re
+import time
+import threading
+import numpy as np
+
+# Simulated instruments, to run and benchmark the emulators without the bench :
+# they answer the same commands as the TENMA supply, the DSOX1204G and the PPK2,
+# with a configurable latency, and read a common model of the control card.
+# Use them with the connect_to_simulator(bench) method of PS, PPK and OSCI.
+
+class Latency:
+    """ Round trip time of a simulated transport : base +- jitter (gaussian), in s """
+    def __init__(self,base:float=0.0,jitter:float=0.0,seed:int=None):
+        self.base = base
+        self.jitter = jitter
+        self.random = np.random.default_rng(seed)
+
+    def wait(self):
+        delay = self.base
+        if self.jitter:
+            delay += self.random.normal(0,self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+class Load:
+    """ Control card model : I = idle + V/resistance, reached with a time constant tau
+    after each change of the supply, plus gaussian noise. Currents in A.
+    """
+    def __init__(self,idle:float=0.002,resistance:float=1000,tau:float=0.01,noise:float=2e-5,seed:int=None):
+        self.idle = idle
+        self.resistance = resistance
+        self.tau = tau
+        self.noise = noise
+        self.random = np.random.default_rng(seed)
+
+    def static(self,voltage:float) -> float:
+        if voltage <= 0:
+            return 0.0
+        return self.idle + voltage/self.resistance
+
+class Bench:
+    """ Power supply -> control card -> PPK2 and oscilloscope, shared by the simulated instruments """
+    def __init__(self,latency:float=0.001,jitter:float=0.0,rate:int=100000,load:Load=None,seed:int=None):
+        self.load = load if load is not None else Load(seed=seed)
+        self.lock = threading.Lock()
+        self.voltageSetpoint = 0.0
+        self.currentLimit = 1.0
+        self.output = False
+        # changes of the load current : time, current before, current targeted
+        self.changes = [(time.monotonic(),0.0,0.0)]
+        self.random = np.random.default_rng(seed)
+        self.tenma = SimTENMA(self,Latency(latency,jitter,seed))
+        self.dsox = SimDSOX(self,Latency(latency,jitter,seed))
+        self.rate = rate
+        self.ppkLatency = Latency(latency,jitter,seed)
+
+    def ppk2(self):
+        """ A new simulated PPK2 (as a new PPK2_API object would be) """
+        return SimPPK2(self,self.rate,self.ppkLatency)
+
+    def voltage(self) -> float:
+        return self.voltageSetpoint if self.output else 0.0
+
+    def _update(self):
+        """ The supply changed, the load current moves to its new value from where it is now """
+        now = time.monotonic()
+        target = min(self.load.static(self.voltage()),self.currentLimit)
+        self.changes.append((now,float(self.current(np.array([now]),noise=False)[0]),target))
+        del self.changes[:-64]
+
+    def set_voltage(self,voltage:float):
+        with self.lock:
+            previous = self.voltage()
+            self.voltageSetpoint = voltage
+            self._update()
+        self.dsox.trigger(previous,step=True)      # an edge of the supply, and the DUT signals a new step
+
+    def set_current_limit(self,current:float):
+        with self.lock:
+            self.currentLimit = current
+            self._update()
+
+    def set_output(self,state:bool):
+        with self.lock:
+            previous = self.voltage()
+            self.output = state
+            self._update()
+        self.dsox.trigger(previous)
+
+    def current(self,times,noise:bool=True) -> np.ndarray:
+        """ Load current (A) at the given time.monotonic() instants """
+        changes = np.array(self.changes)
+        index = np.maximum(np.searchsorted(changes[:,0],times,side='right')-1,0)
+        t0,start,target = changes[index].T
+        current = target + (start-target)*np.exp(-np.maximum(times-t0,0)/self.load.tau)
+        if noise and self.load.noise:
+            current = current + self.load.random.normal(0,self.load.noise,len(current))
+        return current
+
+class SimSerial:
+    """ Stand-in for the pyserial port the emulators keep open """
+    def __init__(self,name:str='SIM'):
+        self.name = name
+        self.open = True
+
+    def isOpen(self):
+        return self.open
+
+    def reset_input_buffer(self):
+        pass
+
+    def close(self):
+        self.open = False
+
+class SimSCPI:
+    """ Base of the simulated VISA resources : write/query/query_binary_values/close,
+    compound messages (':A 1;:B?') are split and answered in one round trip
+    """
+    def __init__(self,bench:Bench,latency:Latency):
+        self.bench = bench
+        self.latency = latency
+        self.settings = {}      # last value written for each header
+        self.closed = False
+
+    def _commands(self,message):
+        if isinstance(message,bytes):
+            message = message.decode()
+        for part in message.strip().split(';'):
+            part = part.strip()
+            if part:
+                header,_,argument = part.partition(' ')
+                yield header.upper(),argument.strip()
+
+    def _handle(self,header:str,argument:str):
+        """ Apply a command, return the answer of a query (None for a command)
+        Generic settings : a command keeps its argument, the query of its header returns it ('0' if never set)
+        """
+        if header.endswith('?'):
+            return self.settings.get(header[:-1],'0')
+        self.settings[header] = argument
+        return None
+
+    def write(self,message):
+        self.latency.wait()
+        for header,argument in self._commands(message):
+            self._handle(header,argument)
+        return len(message)
+
+    def query(self,message):
+        self.latency.wait()
+        answers = [self._handle(header,argument) for header,argument in self._commands(message)]
+        return ';'.join(str(answer) for answer in answers if answer is not None)+'\n'
+
+    def read(self):
+        return ''
+
+    def close(self):
+        self.closed = True
+
+class SimTENMA(SimSCPI):
+    """ TENMA 72-27xx programmable supply """
+    def _handle(self,header,argument):
+        if header.startswith('VSET1:'):
+            self.bench.set_voltage(float(header[6:]))
+        elif header.startswith('ISET1:'):
+            self.bench.set_current_limit(float(header[6:]))
+        elif header == 'OUT1':
+            self.bench.set_output(True)
+        elif header == 'OUT0':
+            self.bench.set_output(False)
+        elif header == 'VOUT1?':
+            return f"{self.bench.voltage():.2f}"
+        elif header == 'IOUT1?':
+            current = self.bench.current(np.array([time.monotonic()]))[0]
+            return f"{max(current,0):.3f}"    # resolution of the supply, 1 mA
+        elif header == '*IDN?':
+            return "TENMA 72-2705 SIMULATED"
+        elif header == '*RST':
+            self.bench.set_output(False)
+        return None
+
+def _value(argument:str) -> float:
+    """ Float of an NR3 argument followed by an optional unit (2.0E+00V, 500mV, ...) """
+    match = re.match(r'\s*([-+0-9.eE]+)\s*(m?)',argument)
+    if not match:
+        return 0.0
+    return float(match.group(1)) * (1e-3 if match.group(2) else 1)
+
+class SimDSOX(SimSCPI):
+    """ Keysight DSOX1204G : channels read the supply output, records of 10 divisions
+    In segmented mode, :SINGle arms it and each trigger fills a segment : the edge trigger of a channel
+    fires when the supply crosses its level, on EXTernal when the DUT raises its GPIO (at each new setpoint)
+    """
+    def __init__(self,bench,latency):
+        super().__init__(bench,latency)
+        self.noise = 0.005       # V
+        self.armed = False
+        self.captured = []       # voltage of the supply at the trigger of each segment
+        self.lock = threading.Lock()
+
+    def _segmented(self) -> bool:
+        return self.settings.get(':ACQUIRE:MODE','RTIMe').upper().startswith('SEGM')
+
+    def _fires(self,previous:float,voltage:float,step:bool) -> bool:
+        """ Whether the edge trigger fires when the supply goes from previous to voltage """
+        source = self.settings.get(':TRIGGER:EDGE:SOURCE','CHANnel1').upper()
+        if source.startswith('EXT'):      # a pulse of the GPIO : both edges
+            return step
+        level = _value(self.settings.get(':TRIGGER:EDGE:LEVEL','0'))
+        rising,falling = previous < level <= voltage,previous > level >= voltage
+        slope = self.settings.get(':TRIGGER:EDGE:SLOPE','POSitive').upper()
+        if slope.startswith('POS'):
+            return rising
+        if slope.startswith('NEG'):
+            return falling
+        return rising or falling
+
+    def trigger(self,previous:float,step:bool=False):
+        """ The supply moved from previous (step : to a new setpoint), a segment if the trigger fires """
+        with self.lock:
+            if not self.armed or not self._fires(previous,self.bench.voltage(),step):
+                return
+            self.captured.append(self.bench.voltage())
+            if len(self.captured) >= int(_value(self.settings.get(':ACQUIRE:SEGMENTED:COUNT','2'))):
+                self.armed = False
+
+    def _scale(self,number:str) -> float:
+        return _value(self.settings.get(f':CHANNEL{number}:SCALE','500mV'))
+
+    def _source(self) -> str:
+        return re.sub(r'\D','',self.settings.get(':WAVEFORM:SOURCE','CHANnel1')) or '1'
+
+    def _preamble(self):
+        points = int(_value(self.settings.get(':WAVEFORM:POINTS','1000')))
+        word = self.settings.get(':WAVEFORM:FORMAT','BYTE').upper().startswith('WORD')
+        levels = 65536 if word else 256
+        scale = self._scale(self._source())
+        timescale = _value(self.settings.get(':TIMEBASE:SCALE','2.0E-04'))
+        offset = _value(self.settings.get(f':CHANNEL{self._source()}:OFFSET','0'))
+        return [1 if word else 0,0,points,1,timescale*10/points,0.0,0,scale*8/levels,offset,levels//2]
+
+    def _record(self,level:float=None):
+        fmt,_,points,_,_,_,_,yinc,yorig,yref = self._preamble()
+        level = self.bench.voltage() if level is None else level
+        voltage = level + self.bench.random.normal(0,self.noise,points)
+        codes = np.clip(np.round((voltage-yorig)/yinc + yref),0,2*yref-1)
+        return codes.astype(np.uint16 if fmt else np.uint8)
+
+    def _handle(self,header,argument):
+        if header.endswith('?'):
+            if header == '*IDN?':
+                return "KEYSIGHT TECHNOLOGIES,DSOX1204G,SIMULATED,0.0"
+            if header == '*OPC?':
+                return '1'
+            if header in (':SYSTEM:ERROR?',':SYST:ERR?'):
+                return '+0,"No error"'
+            if header.startswith(':MEASURE:'):
+                return f"{self.bench.voltage() + abs(self.bench.random.normal(0,self.noise)):.6E}"
+            if header in (':WAVEFORM:PREAMBLE?',':WAV:PRE?'):
+                return ','.join(str(value) for value in self._preamble())
+            if header in (':WAVEFORM:SEGMENTED:COUNT?',':WAV:SEGM:COUN?'):
+                return str(len(self.captured))
+            return super()._handle(header,argument)
+        if header in (':SINGLE',':SING',':DIGITIZE',':DIG') and self._segmented():
+            with self.lock:
+                self.captured = []
+                self.armed = True
+        elif header == ':STOP':
+            self.armed = False
+        return super()._handle(header,argument)
+
+    def query_binary_values(self,message,datatype='B',is_big_endian=False,container=list,**kwargs):
+        self.latency.wait()
+        for header,argument in self._commands(message):
+            if header in (':WAVEFORM:DATA?',':WAV:DATA?'):
+                if self._segmented() and self.settings.get(':WAVEFORM:SEGMENTED:ALL','OFF').upper() == 'ON':
+                    return container(np.concatenate([self._record(level) for level in self.captured] or [self._record()]))
+                return container(self._record())
+            self._handle(header,argument)
+        return container([])
+
+class SimPPK2:
+    """ PPK2_API stand-in, get_data() returns the frames the PPK2 would have streamed
+    since the previous call, encoded from the load current with the default calibration
+    """
+    def __init__(self,bench:Bench,rate:int=100000,latency:Latency=None):
+        self.bench = bench
+        self.rate = rate
+        self.latency = latency if latency is not None else Latency()
+        self.modifiers = {
+            "Calibrated": None,
+            "R": {"0": 1031.64, "1": 101.65, "2": 10.15, "3": 0.94, "4": 0.043},
+            "GS": {"0": 1, "1": 1, "2": 1, "3": 1, "4": 1},
+            "GI": {"0": 1, "1": 1, "2": 1, "3": 1, "4": 1},
+            "O": {"0": 0, "1": 0, "2": 0, "3": 0, "4": 0},
+            "S": {"0": 0, "1": 0, "2": 0, "3": 0, "4": 0},
+            "I": {"0": 0, "1": 0, "2": 0, "3": 0, "4": 0},
+            "UG": {"0": 1, "1": 1, "2": 1, "3": 1, "4": 1},
+            "HW": None,
+            "IA": None
+        }
+        self.current_vdd = None
+        self.spike_filter_alpha = 0.18
+        self.spike_filter_alpha5 = 0.06
+        self.spike_filter_samples = 3
+        self.adc_mult = 1.8 / 163840
+        self.measuring = False
+        self.last = None          # time of the last frame streamed
+        self.digital = 0
+
+    def get_modifiers(self):
+        return True
+
+    def set_source_voltage(self,mV):
+        self.current_vdd = mV
+
+    def use_ampere_meter(self):
+        pass
+
+    def use_source_meter(self):
+        pass
+
+    def toggle_DUT_power(self,state):
+        pass
+
+    def start_measuring(self):
+        self.measuring = True
+        self.last = time.monotonic()
+
+    def stop_measuring(self):
+        self.measuring = False
+
+    def encode(self,current) -> bytes:
+        """ Frames of the given currents (A), in the smallest range that holds them """
+        m = self.modifiers
+        R = np.array([m['R'][str(r)] for r in range(5)])
+        full_scale = 0.9 * 0x3FFF * 4 * self.adc_mult / R
+        ranges = np.minimum(np.searchsorted(full_scale,np.abs(current)),4)
+        GS = np.array([m['GS'][str(r)] for r in range(5)],dtype=float)[ranges]
+        GI = np.array([m['GI'][str(r)] for r in range(5)],dtype=float)[ranges]
+        UG = np.array([m['UG'][str(r)] for r in range(5)],dtype=float)[ranges]
+        constant = np.array([m['S'][str(r)]*(self.current_vdd or 0)/1000 + m['I'][str(r)] for r in range(5)])[ranges]
+        # invert UG*(x*(GS*x+GI) + constant) = current for x, the result without gain
+        c = current/UG - constant
+        x = np.where(GS != 0,(-GI + np.sqrt(np.maximum(GI**2 + 4*GS*c,0)))/(2*np.where(GS != 0,GS,1)),c/GI)
+        O = np.array([m['O'][str(r)] for r in range(5)],dtype=float)[ranges]
+        adc = np.clip(np.round((x*R[ranges]/self.adc_mult + O)/4),0,0x3FFF).astype(np.uint32)
+        frames = adc | (ranges.astype(np.uint32) << 14) | (np.uint32(self.digital) << 24)
+        return frames.astype('<u4').tobytes()
+
+    def get_data(self):
+        self.latency.wait()
+        if not self.measuring:
+            return b''
+        now = time.monotonic()
+        n = int((now-self.last)*self.rate)
+        if n <= 0:
+            return b''
+        times = self.last + np.arange(1,n+1)/self.rate
+        self.last = times[-1]
+        return self.encode(self.bench.current(times))
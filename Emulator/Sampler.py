@@ -0,0 +1,27 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+class Sampler:
+    """ Coordinate the measures of several devices
+    Each device measure() runs on its own thread, so a sample costs the slowest
+    round trip instead of the sum of all of them. Every device stamps its
+    readings with time.monotonic() (column 't' of its log) to align them afterwards.
+    """
+    def __init__(self,*devices):
+        self.devices = [device for device in devices if device is not None]
+        self.pool = ThreadPoolExecutor(max_workers=max(1,len(self.devices)),thread_name_prefix='sampler')
+        self.lastDuration = 0.0    # wall time of the last sample, in s
+
+    def sample(self):
+        """ Measure every device at the same time, return once all of them are done """
+        start = time.monotonic()
+        futures = [self.pool.submit(device.measure) for device in self.devices]
+        for future in futures:
+            future.result()    # raise here the error of a device, if any
+        self.lastDuration = time.monotonic() - start
+
+    def close(self):
+        self.pool.shutdown()
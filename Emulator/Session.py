@@ -0,0 +1,337 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import os
+import json
+import time
+import threading
+import numpy as np
+from Emulator.Recorder import Recorder,Capture
+from Emulator.PPKdecoder import PPKDecoder
+
+# Raw I/O of the devices, recorded and played back : the traced transports of the emulators
+# (see Trace.TracedResource) give every request and answer to the SessionRecorder set on the tracer,
+#   Trace.tracer.session = SessionRecorder('captures/.../session')
+# Layout, a capture of Recorder.py :
+#   session.<device>          one row per call : t (time.monotonic()), operation, request and answer lengths,
+#                             code (dtype of the values of query_binary_values), and per PPK mark()/measure()
+#                             (its request : the head of the buffer, samples of the stream before it, after the
+#                             start of the averaged window for a measure)
+#   session.<device>.bytes    data : the request then the answer of each call, one after the other
+#   session.json              settings of each PPK2_API at its first get_data(), read by the decoder
+# Replay stands for a SIMemu.Bench : the unmodified PS, PPK and OSCI connect to it with
+# connect_to_simulator(replay) and get the recorded answers, at the recorded pace or as fast as asked.
+# Session.stream() decodes a recorded PPK2 stream again, without the emulators, in large blocks.
+
+OPERATIONS = ['write','query','query_binary_values','read','get_data','mark','measure']
+BOUNDARIES = ('mark','measure')      # steps of a PPK stream, no I/O
+STATE = ('modifiers','current_vdd','spike_filter_alpha','spike_filter_alpha5','spike_filter_samples')   # read by PPKDecoder.from_api
+
+def _bytes(value) -> bytes:
+    """ Bytes of a request or an answer : str, bytes or array of values """
+    if value is None:
+        return b''
+    if isinstance(value,str):
+        return value.encode()
+    if isinstance(value,(bytes,bytearray,memoryview)):
+        return bytes(value)
+    return np.ascontiguousarray(value).tobytes()
+
+class SessionRecorder:
+    """ Writer of a session, fed by the traced transports of the tracer it is set on """
+    def __init__(self,path:str,chunk_rows:int=100000):
+        self.path = path
+        self.recorder = Recorder(path,chunk_rows)
+        self.states = {}                 # device -> settings of its PPK2_API
+        self.lock = threading.Lock()     # the rows of a call and its bytes go together
+
+    def record(self,device:str,operation:str,message,result,com=None):
+        now = time.monotonic()
+        if operation == 'get_data':
+            if not result:
+                return                   # nothing streamed, nothing to play back
+            if device not in self.states:
+                self._state(device,com)
+        request = _bytes(message)
+        answer = b'' if operation == 'write' else _bytes(result)
+        code = ord(np.asarray(result).dtype.char) if operation == 'query_binary_values' else 0
+        with self.lock:
+            self.recorder.write('session.'+device,t=now,operation=np.uint8(OPERATIONS.index(operation)),
+                                request=np.int32(len(request)),answer=np.int32(len(answer)),code=np.uint8(code))
+            self.recorder.write('session.'+device+'.bytes',data=np.frombuffer(request+answer,dtype=np.uint8))
+
+    def _state(self,device:str,com):
+        self.states[device] = {name:getattr(com,name) for name in STATE if hasattr(com,name)}
+        with open(os.path.join(self.path,'session.json'),'w') as f:
+            json.dump({"states":self.states},f,default=float)
+
+    def close(self):
+        self.recorder.close()
+
+class Session:
+    """ Reader of a recorded session """
+    def __init__(self,path:str):
+        self.path = path
+        self.capture = Capture(path)
+        self.states = {}
+        if os.path.exists(os.path.join(path,'session.json')):
+            with open(os.path.join(path,'session.json')) as f:
+                self.states = json.load(f)['states']
+
+    def devices(self) -> list:
+        return [stream[len('session.'):] for stream in self.capture.streams()
+                if stream.startswith('session.') and not stream.endswith('.bytes')]
+
+    def events(self,device:str) -> dict:
+        """ Columns of the calls of a device, with 'offset' of their bytes in 'data'
+        Calls whose bytes were not written (end of a crashed session) are dropped
+        """
+        events = self.capture['session.'+device]
+        data = self.capture.column('session.'+device+'.bytes','data')
+        sizes = events['request'].astype(np.int64)+events['answer']
+        ends = np.cumsum(sizes)
+        n = int(np.searchsorted(ends,len(data),side='right'))
+        events = {name:values[:n] for name,values in events.items()}
+        events['offset'] = ends[:n]-sizes[:n]
+        events['data'] = data
+        return events
+
+    def decoder(self,device:str='PPK') -> PPKDecoder:
+        state = self.states[device]
+        return PPKDecoder(state['modifiers'],state['current_vdd'],state['spike_filter_alpha'],
+                          state['spike_filter_alpha5'],state['spike_filter_samples'])
+
+    def stream(self,device:str='PPK',rate:float=100000,block:int=1<<24):
+        """ Decode the recorded stream of a PPK2 again, yield (times, current uA, digital) by blocks of about `block` bytes
+        Samples are stamped as PPK._read() does : the chunk ends with the sample read, one period per sample before
+        """
+        events = self.events(device)
+        chunks = np.flatnonzero(events['operation'] == OPERATIONS.index('get_data'))
+        decoder = self.decoder(device)
+        data = events['data']
+        sizes = events['answer'][chunks].astype(np.int64)
+        starts = events['offset'][chunks]+events['request'][chunks]
+        cumulative = np.cumsum(sizes)
+        frames = 0        # frames decoded so far, the decoder keeps a partial frame between two blocks
+        first = 0
+        while first < len(chunks):
+            done = cumulative[first-1] if first else 0
+            last = max(first+1,int(np.searchsorted(cumulative,done+block)))
+            if starts[last-1]+sizes[last-1]-starts[first] == sizes[first:last].sum():    # contiguous, no copy
+                buf = data[starts[first]:starts[last-1]+sizes[last-1]].tobytes()
+            else:
+                buf = b''.join(data[start:start+size].tobytes() for start,size in zip(starts[first:last],sizes[first:last]))
+            current,digital = decoder.decode(buf)
+            # frames completed by each chunk, the sample times go back from the time of its get_data()
+            ends = (cumulative[first:last])//4-frames
+            counts = np.diff(ends,prepend=0)
+            chunk = np.repeat(np.arange(first,last),counts)
+            rank = np.repeat(ends,counts)-1-np.arange(len(current))
+            times = events['t'][chunks[chunk]]-rank/rate
+            frames += len(current)
+            first = last
+            yield times,current,digital
+
+    def decode(self,recorder:Recorder,device:str='PPK',rate:float=100000):
+        """ Write the decoded stream to a capture, as the stream '<device>.stream' of a run """
+        samples = 0
+        for times,current,digital in self.stream(device,rate):
+            recorder.write(device+'.stream',t=times,Iout=current,digital=digital)
+            samples += len(current)
+        recorder.flush()
+        return samples
+
+class ReplayError(Exception):
+    """ The emulators asked something the recording does not hold """
+
+class ReplayResource:
+    """ Transport answering with the recording of one device : VISA resource (write, query, ...)
+    or PPK2_API (get_data, with the recorded settings, its other calls do nothing)
+    """
+    def __init__(self,replay,device:str):
+        self.replay = replay
+        self.device = device
+        self.events = replay.session.events(device)
+        self.cursor = 0                  # next recorded call
+        self.streaming = device in replay.session.states
+        codes = [OPERATIONS.index(operation) for operation in BOUNDARIES]
+        self.boundaries = np.flatnonzero(np.isin(self.events['operation'],codes))    # recorded mark()/measure()
+        self.boundary = 0                # next one to play
+        self.reads = 0                   # get_data() calls
+        self.released = 0                # bytes of the stream given by get_data()
+        self.partial = 0                 # bytes of the chunk at the cursor already given
+        self.condition = threading.Condition()    # get_data() in the reader thread, event() in the script
+        for name,value in replay.session.states.get(device,{}).items():
+            setattr(self,name,value)
+
+    def __getattr__(self,name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args,**kwargs:None    # settings of the PPK2_API, already in the recorded stream
+
+    def pending(self) -> float:
+        """ Recorded time of the next call, inf once they are all played """
+        return float(self.events['t'][self.cursor]) if self.cursor < len(self.events['t']) else np.inf
+
+    def _bytes(self,index:int,answer:bool=True) -> bytes:
+        start = int(self.events['offset'][index])
+        request = int(self.events['request'][index])
+        if not answer:
+            return self.events['data'][start:start+request].tobytes()
+        return self.events['data'][start+request:start+request+int(self.events['answer'][index])].tobytes()
+
+    def _play(self,operation:str,message) -> int:
+        """ Index of the recorded call matching this one, looked for in the next few calls """
+        code = OPERATIONS.index(operation)
+        request = _bytes(message)
+        stop = min(self.cursor+self.replay.lookahead,len(self.events['t']))
+        for index in range(self.cursor,stop):
+            if self.events['operation'][index] == code and self._bytes(index,answer=False) == request:
+                self.cursor = index+1
+                self.replay.wait(float(self.events['t'][index]))
+                return index
+        return None
+
+    def write(self,message,*args,**kwargs):
+        self._play('write',message)      # a write the recording does not hold changes nothing
+
+    def _answer(self,operation:str,message) -> int:
+        index = self._play(operation,message)
+        if index is None:
+            raise ReplayError(f"{self.device} : no recorded answer to {message!r} after call {self.cursor}")
+        return index
+
+    def query(self,message,*args,**kwargs):
+        return self._bytes(self._answer('query',message)).decode()
+
+    def query_binary_values(self,message,datatype='B',is_big_endian=False,container=list,**kwargs):
+        index = self._answer('query_binary_values',message)
+        values = np.frombuffer(self._bytes(index),dtype=chr(self.events['code'][index])).copy()
+        return values if container is np.array else container(values)
+
+    def read(self,*args,**kwargs):
+        return self._bytes(self._answer('read',b'')).decode()
+
+    def _position(self,index:int):
+        """ Samples recorded with the boundary `index` (the head of the buffer last), None in a session recorded without them """
+        position = tuple(int(value) for value in self._bytes(index,answer=False).split())
+        return position if position else None
+
+    def _limit(self,index:int) -> float:
+        """ Bytes of the stream in the buffer at the recorded boundary `index` (4 per sample), inf if unknown """
+        position = self._position(index)
+        return position[-1]*4 if position is not None else np.inf
+
+    def get_data(self):
+        """ Chunks recorded up to the horizon of the replay, in one piece, cut at the next mark()/measure() :
+        the buffer then holds the samples it held when the PPK recorded it
+        """
+        code = OPERATIONS.index('get_data')
+        with self.condition:
+            self.reads += 1
+            self.condition.notify_all()
+            stop = int(np.searchsorted(self.events['t'],self.replay.horizon(self),side='right'))
+            limit = np.inf
+            if self.boundary < len(self.boundaries):     # the Settler sees what it saw, the PPK averages what it averaged
+                index = int(self.boundaries[self.boundary])
+                stop,limit = min(stop,index),self._limit(index)
+            parts = []
+            while self.cursor < stop and self.released < limit:
+                if self.events['operation'][self.cursor] == code:
+                    chunk = self._bytes(self.cursor)[self.partial:]
+                    size = int(min(len(chunk),limit-self.released))
+                    parts.append(chunk[:size])
+                    self.released += size
+                    if size < len(chunk):     # the rest after the boundary
+                        self.partial += size
+                        break
+                self.cursor += 1
+                self.partial = 0
+        return b''.join(parts)
+
+    def event(self,operation:str,timeout:float=1.0):
+        """ PPK mark() or measure() : return once the stream recorded before it is in the buffer
+        (released, then one more read : the reader pushed it), the stream goes on up to the next one.
+        A measure gets back its recorded window (start, stop) : where the Settler of the replay finds
+        the stable part of a step depends on the times of the samples, stamped when they are read again
+        """
+        code = OPERATIONS.index(operation)
+        with self.condition:
+            while self.boundary < len(self.boundaries) and self.events['operation'][self.boundaries[self.boundary]] != code:
+                self.boundary += 1       # a boundary the script does not play again
+            if self.boundary >= len(self.boundaries):
+                return None
+            index = int(self.boundaries[self.boundary])
+            limit = self._limit(index)
+            released = lambda:self.released >= limit if limit != np.inf else self.cursor >= index
+            if self.condition.wait_for(released,timeout):
+                reads = self.reads
+                self.condition.wait_for(lambda:self.reads > reads,timeout)
+            self.boundary += 1
+            position = self._position(index)
+        if operation == 'measure' and position is not None and len(position) == 2:
+            return position
+        return None      # the head of the buffer, now the recorded one
+
+    def close(self):
+        pass
+
+class Replay:
+    """ Recorded session played back, in place of a SIMemu.Bench : connect_to_simulator(replay)
+    realtime : answers at the pace of the recording (speed times faster), else as soon as asked.
+    The stream of a PPK2 is released up to its next recorded mark() or measure() and no further
+    until the PPK plays it : each step gets the samples it had, whatever the speed of the replay.
+    (A session without them is released up to the next call the other devices have to play.)
+    lookahead : recorded calls skipped at most to find the one matching a request
+    """
+    def __init__(self,path:str,realtime:bool=False,speed:float=1.0,lookahead:int=8):
+        self.session = Session(path)
+        self.realtime = realtime
+        self.speed = speed
+        self.lookahead = lookahead
+        self.rate = 100000
+        self.resources = {}
+        starts = [self.session.events(device)['t'][:1] for device in self.session.devices()]
+        self.first = float(min(np.concatenate(starts),default=0.0))    # recorded time of the first call
+        self.origin = None               # time.monotonic() when the replay started
+
+    def resource(self,device:str) -> ReplayResource:
+        if device not in self.resources:
+            self.resources[device] = ReplayResource(self,device)
+        return self.resources[device]
+
+    @property
+    def tenma(self):
+        return self.resource('PS')
+
+    @property
+    def dsox(self):
+        return self.resource('OSCI')
+
+    def ppk2(self,device:str='PPK'):
+        return self.resource(device)
+
+    def now(self) -> float:
+        """ Recorded time reached by a real time replay """
+        if self.origin is None:
+            self.origin = time.monotonic()
+        return self.first + (time.monotonic()-self.origin)*self.speed
+
+    def wait(self,t:float):
+        """ In real time, wait for the recorded time t """
+        if self.realtime:
+            delay = (t-self.now())/self.speed
+            if delay > 0:
+                time.sleep(delay)
+
+    def horizon(self,stream:ReplayResource) -> float:
+        """ Recorded time up to which a PPK2 stream is released """
+        if self.realtime:
+            return self.now()
+        if stream.boundary < len(stream.boundaries):     # up to the next mark()/measure(), see get_data()
+            return np.inf
+        pending = [resource.pending() for resource in self.resources.values() if not resource.streaming]
+        horizon = min(pending,default=np.inf)
+        if horizon == np.inf:       # nothing else to play : one second of stream per read
+            horizon = stream.pending()+1.0
+        return horizon
@@ -0,0 +1,123 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import time
+import numpy as np
+from Emulator import Clock
+
+class PPKSource:
+    """ Current stream of a PPK (uA), read from its ring buffer since the wait started """
+    floor = 5.0         # drift (uA) always taken as stable, around 0 the relative bound never passes
+
+    def __init__(self,ppk):
+        self.ppk = ppk
+        self.index = 0
+
+    def start(self):
+        self.index = self.ppk.buffer.head
+
+    def read(self):
+        values,times,_ = self.ppk.buffer.window(self.index)
+        return times,values
+
+    def settled(self,since:float):
+        """ The next PPK measure will only average the stable part of the step """
+        times,_ = self.read()
+        self.ppk.settle(self.index + int(np.searchsorted(times,since)))
+
+class PSSource:
+    """ Current readback of the power supply (A), one IOUT1? query per read """
+    floor = 0.001       # resolution of the readback, in A
+
+    def __init__(self,ps):
+        self.ps = ps
+        self.times = []
+        self.values = []
+
+    def start(self):
+        self.times = []
+        self.values = []
+
+    def read(self):
+        I = self.ps.getCurrent()
+        self.times.append(time.monotonic())
+        self.values.append(I)
+        return np.array(self.times),np.array(self.values)
+
+    def settled(self,since:float):
+        pass
+
+class Settler:
+    """ Wait until a current stream is stable after a new setpoint, instead of a fixed sleep
+    The last `window` seconds of the stream are fitted by a line :
+    it is settled when the drift over the window is under `relative` times the mean or under `floor`
+    (in the unit of the source, its own floor if None : a current around 0 has no relative bound),
+    or the slope under `slope`, in unit/s, if given, and, if `std` is given,
+    when the standard deviation is under it. `timeout` caps the wait.
+    """
+    def __init__(self,window:float=0.02,relative:float=0.01,slope:float=None,std:float=None,
+                 timeout:float=0.5,min_dwell:float=0.0,poll:float=0.005,min_samples:int=5,floor:float=None):
+        self.window = window
+        self.relative = relative
+        self.floor = floor
+        self.slope = slope
+        self.std = std
+        self.timeout = timeout
+        self.minDwell = min_dwell    # never move on before that, in s
+        self.poll = poll
+        self.minSamples = min_samples
+        self.lastElapsed = 0.0       # duration of the last wait, in s
+        self.timeouts = 0            # number of waits stopped by the timeout
+
+    def stable(self,t,values,floor:float=0.0) -> bool:
+        """ Stability criterion on the samples of the window """
+        if len(values) < self.minSamples or t[-1]-t[0] <= 0:
+            return False
+        t = t - t[-1]
+        values = np.asarray(values,dtype=np.float64)
+        mean = values.mean()
+        tmean = t.mean()
+        slope = ((t-tmean)*(values-mean)).sum() / ((t-tmean)**2).sum()
+        if self.slope is not None:
+            if abs(slope) > self.slope:
+                return False
+        elif abs(slope)*self.window > max(self.relative*abs(mean),floor):
+            return False
+        if self.std is not None and values.std() > self.std:
+            return False
+        return True
+
+    def wait(self,source) -> bool:
+        """ Block until the source (or every source of a list) is settled or the timeout is reached
+        return True if it settled
+        """
+        sources = list(source) if isinstance(source,(list,tuple)) else [source]
+        clock = Clock.clock      # its waits are skipped in a replay
+        start = clock.monotonic()
+        for source in sources:
+            source.start()
+        while True:
+            now = clock.monotonic()
+            elapsed = now - start
+            if elapsed >= self.timeout:
+                self.timeouts += 1
+                self.lastElapsed = elapsed
+                return False
+            if elapsed >= self.minDwell:
+                settled = []
+                for source in sources:
+                    t,values = source.read()
+                    if not len(t) or t[-1]-t[0] < self.window:
+                        break
+                    since = t[-1] - self.window
+                    keep = t >= since
+                    floor = self.floor if self.floor is not None else getattr(source,'floor',0.0)
+                    if not self.stable(t[keep],values[keep],floor):
+                        break
+                    settled.append(since)
+                if len(settled) == len(sources):
+                    for source,since in zip(sources,settled):
+                        source.settled(since)
+                    self.lastElapsed = clock.monotonic() - start
+                    return True
+            clock.sleep(self.poll)
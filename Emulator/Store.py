@@ -0,0 +1,166 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import numpy as np
+
+class Column:
+    """ Typed numpy column, preallocated and growing by doubling its capacity
+    view() give the filled part without copy. A view taken before a growth
+    keeps pointing to the old array, so take a new one after appending.
+    """
+    __slots__ = ('name','unit','device','data','size')
+
+    def __init__(self,name:str,dtype='float64',unit:str='',device:str='',capacity:int=1024):
+        self.name = name
+        self.unit = unit
+        self.device = device
+        self.data = np.zeros(capacity,dtype=dtype)
+        self.size = 0
+
+    def _reserve(self,n:int):
+        if self.size + n > len(self.data):
+            capacity = max(2*len(self.data),self.size+n)
+            data = np.zeros(capacity,dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+
+    def append(self,value):
+        self._reserve(1)
+        self.data[self.size] = value
+        self.size += 1
+
+    def extend(self,values):
+        values = np.asarray(values)
+        self._reserve(len(values))
+        self.data[self.size:self.size+len(values)] = values
+        self.size += len(values)
+
+    def view(self) -> np.ndarray:
+        return self.data[:self.size]
+
+    def clear(self):
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f"Column({self.device}.{self.name}, {self.size} x {self.data.dtype}, '{self.unit}')"
+
+class Table:
+    """ Columns of one device, filled one row (one measure) at a time
+    table['Vout'] give the zero-copy view of a column
+    """
+    __slots__ = ('name','columns','store')
+
+    def __init__(self,name:str,store=None):
+        self.name = name
+        self.columns = {}
+        self.store = store
+
+    def add_column(self,name:str,dtype='float64',unit:str=''):
+        """ Declare a column, nothing happens if it exists already """
+        if name not in self.columns:
+            self.columns[name] = Column(name,dtype,unit,self.name)
+        return self.columns[name]
+
+    def _tags(self,tags:dict=None):
+        """ Tags of the store (e.g. step and slope of a sweep), added to every row """
+        if tags is None:
+            tags = self.store.tags if self.store is not None else {}
+        for name in tags:
+            self.add_column(name,'int32')
+        return tags
+
+    @staticmethod
+    def _blank(column:Column):
+        """ Value of a row missing in a column : NaN, -1 for the tags """
+        return np.nan if column.data.dtype.kind == 'f' else -1
+
+    def _rows(self,tags:dict,values:dict,n:int=None) -> dict:
+        """ Every column of the new row(s) (one if n is None), the columns left out are padded with blanks
+        so that the columns stay aligned, a column created after the first rows is padded for them
+        """
+        size = len(self)
+        for name in values:
+            self.add_column(name)
+        for column in self.columns.values():
+            if len(column) < size:
+                padding = np.full(size-len(column),self._blank(column),dtype=column.data.dtype)
+                column.extend(padding)
+                self._record({column.name:padding})
+        rows = {**tags,**values}
+        for name,column in self.columns.items():
+            if name not in rows:
+                rows[name] = self._blank(column) if n is None else np.full(n,self._blank(column),dtype=column.data.dtype)
+        return rows
+
+    def append(self,tags:dict=None,**values):
+        """ Add one row, columns not declared yet are created as float64, the ones left out get NaN
+        tags : tags of the row, when it is logged after the store moved on (e.g. a readback in the background)
+        """
+        rows = self._rows(self._tags(tags),values)
+        for name,value in rows.items():
+            self.columns[name].append(value)
+        self._record(rows)
+
+    def extend(self,**values):
+        """ Add several rows at once, one array per column """
+        n = len(next(iter(values.values()),()))
+        tags = {name:np.full(n,value,dtype='int32') for name,value in self._tags().items()}
+        rows = self._rows(tags,values,n)
+        for name,value in rows.items():
+            self.columns[name].extend(value)
+        self._record(rows)
+
+    def _record(self,rows:dict):
+        """ Stream the new rows to the recorder of the store, if any """
+        if self.store is not None and self.store.recorder is not None:
+            rows = {name:np.asarray(value,dtype=self.columns[name].data.dtype) for name,value in rows.items()}
+            self.store.recorder.write(self.name,**rows)
+
+    def clear(self):
+        for column in self.columns.values():
+            column.clear()
+
+    def keys(self):
+        return self.columns.keys()
+
+    def __getitem__(self,name:str) -> np.ndarray:
+        return self.columns[name].view()
+
+    def __contains__(self,name:str):
+        return name in self.columns
+
+    def __len__(self):
+        return max((len(column) for column in self.columns.values()),default=0)
+
+    def __repr__(self):
+        return f"Table({self.name}, {list(self.columns)})"
+
+class Store:
+    """ Measurement store shared by the emulators, one table per device """
+    def __init__(self):
+        self.tables = {}
+        self.tags = {}    # name -> int, copied in each row appended while set
+        self.recorder = None   # Recorder receiving every row appended, if set
+
+    def tag(self,**tags):
+        """ Set the tags of the next rows, tag() without argument remove them """
+        self.tags = tags
+
+    def table(self,name:str) -> Table:
+        """ Table of a device, created on first use """
+        if name not in self.tables:
+            self.tables[name] = Table(name,self)
+        return self.tables[name]
+
+    def nbytes(self) -> int:
+        """ Memory used by the filled part of every column """
+        return sum(column.view().nbytes for table in self.tables.values() for column in table.columns.values())
+
+    def __getitem__(self,name:str) -> Table:
+        return self.tables[name]
+
+    def __contains__(self,name:str):
+        return name in self.tables
@@ -0,0 +1,138 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import time
+import numpy as np
+from Emulator.Store import Store
+from Emulator import Clock
+
+# Voltages are handled in integer centivolts (precision of the power supply), to avoid
+# the float approximations when incrementing (1.8 + 0.05 + ...)
+def _cv(voltage:float) -> int:
+    return int(round(voltage*100))
+
+def _ramp(start:int,stop:int,step:int) -> list:
+    """ centivolts from start to stop included, going up or down """
+    step = abs(step) if stop >= start else -abs(step)
+    values = list(range(start,stop,step))
+    if not values or values[-1] != stop:
+        values.append(stop)
+    return values
+
+class Profile:
+    """ Voltage points of a sweep, each one belonging to a slope (0, 1, ...)
+    lead : voltage set before the first point, neither measured nor logged (None : no lead-in)
+    """
+    def __init__(self,voltages:list,slopes:list=None,lead:float=None):
+        self.voltages = [float(v) for v in voltages]
+        self.slopes = list(slopes) if slopes is not None else [0]*len(self.voltages)
+        self.lead = lead
+
+    def setpoints(self,steps) -> np.ndarray:
+        """ Voltage of each step index (e.g. column 'step' of the logs), what Analysis.hysteresis aligns the slopes on """
+        return np.asarray(self.voltages)[np.asarray(steps,dtype=np.intp)]
+
+    @property
+    def nslopes(self) -> int:
+        return max(self.slopes)+1 if self.slopes else 0
+
+    def __len__(self):
+        return len(self.voltages)
+
+    def __iter__(self):
+        """ (step index, slope index, voltage) of each point """
+        for step,(slope,voltage) in enumerate(zip(self.slopes,self.voltages)):
+            yield step,slope,voltage
+
+def linear(start:float,stop:float,step:float) -> Profile:
+    """ One slope from start to stop (included), up or down """
+    return Profile([cv/100 for cv in _ramp(_cv(start),_cv(stop),_cv(step))])
+
+def staircase(start:float,stop:float,step:float,hold:int=1) -> Profile:
+    """ One slope from start to stop, each level kept for `hold` points """
+    return Profile([cv/100 for cv in _ramp(_cv(start),_cv(stop),_cv(step)) for _ in range(hold)])
+
+def back_and_forth(start:float,stop:float,step:float,slopes:int=2,origin:float=None) -> Profile:
+    """ `slopes` ramps between start and stop, beginning with start -> stop
+    Every ramp is on the same grid of setpoints, but never repeats the turnaround point the previous
+    one ended on (a setpoint that does not change is not sent again) : the slopes after the first
+    one miss their first point, Analysis.hysteresis aligns them on their setpoints.
+    origin : lead-in point set before the first one, not measured (e.g. the 1.80 of a supply set up there)
+    """
+    up = _ramp(_cv(start),_cv(stop),_cv(step))
+    voltages = []
+    indexes = []
+    for slope in range(slopes):
+        ramp = up if slope % 2 == 0 else up[::-1]
+        if slope:
+            ramp = ramp[1:]
+        voltages += [cv/100 for cv in ramp]
+        indexes += [slope]*len(ramp)
+    return Profile(voltages,indexes,lead=origin)
+
+def points(voltages:list,slopes:list=None) -> Profile:
+    """ Arbitrary list of voltages, in one slope unless slope indexes are given """
+    return Profile(voltages,slopes)
+
+class Sweep:
+    """ Drive the power supply through a profile and sample the devices at each point
+    Every row logged in the store during a point is tagged with its 'step' and 'slope'
+    """
+    def __init__(self,ps,profile:Profile,current:float,measure=None,settler=None,source=None,
+                 marks:list=(),store:Store=None,dwell:float=0.1,on_step=None):
+        self.ps = ps
+        self.profile = profile
+        self.current = current       # current limit of the power supply, in A
+        self.measure = measure       # called to sample the devices at each point (e.g. Sampler.sample)
+        self.settler = settler       # Settler waiting for the source after each setpoint...
+        self.source = source
+        self.dwell = dwell           # ... or fixed wait, in s
+        self.marks = [ppk for ppk in marks if ppk is not None]   # PPK to mark at each setpoint
+        self.store = store if store is not None else ps.store
+        self.on_step = on_step       # called with (step, slope, voltage) after each point
+        self.abort = False           # set it (from any thread) to stop after the current point
+        self.log = self.store.table('Sweep')   # t (s, monotonic), Vset (V), settled, settle (s)
+
+    def run(self):
+        """ Go through the whole profile, return the number of points done """
+        self.abort = False
+        done = 0
+        try:
+            if self.profile.lead is not None:
+                self.lead(self.profile.lead)
+            for step,slope,voltage in self.profile:
+                if self.abort:
+                    break
+                self.point(step,slope,voltage)
+                done += 1
+        finally:
+            self.store.tag()
+        return done
+
+    def lead(self,voltage:float):
+        """ Lead-in setpoint, waited for as a point but neither logged nor measured """
+        self.store.tag()
+        self.ps.setOperatingPoint(voltage,self.current)
+        if self.settler is not None:
+            self.settler.wait(self.source)
+        else:
+            Clock.clock.sleep(self.dwell)
+
+    def point(self,step:int,slope:int,voltage:float):
+        """ Set one point, wait for it and sample the devices """
+        self.store.tag()
+        t = time.monotonic()
+        self.ps.setOperatingPoint(voltage,self.current)
+        for ppk in self.marks:
+            ppk.mark()       # PPK averages start from the new setpoint
+        settled = True
+        if self.settler is not None:
+            settled = self.settler.wait(self.source)
+        else:
+            Clock.clock.sleep(self.dwell)     # skipped in a replay
+        self.store.tag(step=step,slope=slope)
+        self.log.append(t=t,Vset=voltage,settled=settled,settle=time.monotonic()-t)
+        if self.measure is not None:
+            self.measure()
+        if self.on_step is not None:
+            self.on_step(step,slope,voltage)
@@ -0,0 +1,211 @@
+#! /.venv/bin/python3
+# -*- coding: UTF-8 -*-
+
+import math
+import time
+import threading
+
+# Latency histogram : 4 bins per decade from 1 us to 100 s, plus under/overflow
+BINS_PER_DECADE = 4
+FIRST_DECADE = -6
+NBINS = 8*BINS_PER_DECADE + 2
+
+def bin_edge(index:int) -> float:
+    """ Upper bound (s) of a histogram bin """
+    return 10**(FIRST_DECADE + index/BINS_PER_DECADE)
+
+class CommandStats:
+    """ Counters of one command of one device, allocated once at its first call
+    Updated under its lock : a device may be driven from several threads (Sampler pool, PS I/O thread)
+    """
+    __slots__ = ('calls','timed','errors','bytes','total','max','histogram','lock')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.timed = 0          # calls with a latency measured (see Tracer sampling)
+        self.errors = 0
+        self.bytes = 0
+        self.total = 0.0        # sum of the measured latencies, in s
+        self.max = 0.0
+        self.histogram = [0]*NBINS
+
+    def add(self,duration:float):
+        self.timed += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        if duration <= 0:
+            index = 0
+        else:
+            index = min(max(int(math.ceil((math.log10(duration)-FIRST_DECADE)*BINS_PER_DECADE)),0),NBINS-1)
+        self.histogram[index] += 1
+
+    def percentile(self,p:float) -> float:
+        """ Upper bound of the bin holding the p-th percentile (0-100) of the latencies """
+        if self.timed == 0:
+            return 0.0
+        rank = p/100*self.timed
+        count = 0
+        for index,n in enumerate(self.histogram):
+            count += n
+            if count >= rank:
+                return bin_edge(index)
+        return self.max
+
+    def summary(self) -> dict:
+        with self.lock:
+            return self._summary()
+
+    def _summary(self) -> dict:
+        return {"calls":self.calls,"errors":self.errors,"bytes":self.bytes,
+                "mean":self.total/self.timed if self.timed else 0.0,
+                "p50":self.percentile(50),"p99":self.percentile(99),"max":self.max}
+
+def _header(part:str) -> str:
+    header = part.strip().split(' ',1)[0]
+    if header[:1] != ':' and ':' in header:   # TENMA commands carry their value : 'VSET1:1.85'
+        header = header.split(':',1)[0]
+    return header
+
+def command_name(message) -> str:
+    """ Headers of a SCPI message, the key of its counters (':MEASure:VMAX?', 'VSET1', ...)
+    A compound message is keyed by all its headers (':WAVeform:SOURce;:WAVeform:DATA?') : one round trip, one counter
+    """
+    if isinstance(message,bytes):
+        message = message.decode(errors='replace')
+    return ';'.join(_header(part) for part in message.strip().split(';') if part.strip())
+
+def _label(command:str) -> str:
+    """ Short label of a compound message in a report : first and last headers, and their number """
+    parts = command.split(';')
+    return command if len(parts) <= 2 else f"{parts[0]};..{len(parts)}..;{parts[-1]}"
+
+class Tracer:
+    """ Latency histograms, byte and error counts of the I/O of the devices
+    sampling = N measures the latency of one call out of N (calls, bytes and errors are always counted)
+    """
+    def __init__(self,sampling:int=1,enabled:bool=True):
+        self.sampling = max(1,sampling)
+        self.enabled = enabled
+        self.stats = {}        # (device, command) -> CommandStats
+        self.session = None    # Session.SessionRecorder receiving the raw I/O, if set
+        self.lock = threading.Lock()   # creation of the counters
+
+    def get(self,device:str,command:str) -> CommandStats:
+        key = (device,command)
+        stats = self.stats.get(key)
+        if stats is None:
+            with self.lock:
+                stats = self.stats.get(key)
+                if stats is None:
+                    stats = self.stats[key] = CommandStats()
+        return stats
+
+    def wrap(self,com,device:str):
+        """ Traced proxy of a VISA resource or a PPK2_API object """
+        if com is None or isinstance(com,TracedResource):
+            return com
+        return TracedResource(com,self,device)
+
+    def summary(self,device:str=None) -> dict:
+        """ {device: {command: counters}} """
+        result = {}
+        for (dev,command),stats in list(self.stats.items()):
+            if device is None or dev == device:
+                result.setdefault(dev,{})[command] = stats.summary()
+        return result
+
+    def report(self,device:str=None) -> str:
+        lines = []
+        for dev,commands in self.summary(device).items():
+            for command,s in sorted(commands.items()):
+                lines.append(f"{dev:5} {_label(command):28} calls={s['calls']:<7} errors={s['errors']:<4} bytes={s['bytes']:<9} "
+                             f"mean={s['mean']*1e3:.3f}ms p50<{s['p50']*1e3:.3f}ms p99<{s['p99']*1e3:.3f}ms max={s['max']*1e3:.3f}ms")
+        return '\n'.join(lines)
+
+    def reset(self,device:str=None):
+        with self.lock:
+            self._reset(device)
+
+    def _reset(self,device:str=None):
+        for key in [key for key in self.stats if device is None or key[0] == device]:
+            del self.stats[key]
+
+tracer = Tracer()    # process wide tracer used by the emulators
+
+class TracedResource:
+    """ Proxy timing write/query/query_binary_values/read/get_data, everything else goes through
+    With a session set on the tracer, the requests and the answers are also recorded
+    """
+    def __init__(self,com,tracer:Tracer,device:str):
+        self._com = com
+        self._tracer = tracer
+        self._device = device
+
+    def __getattr__(self,name):
+        return getattr(self._com,name)
+
+    def _call(self,command:str,method,args,kwargs,size):
+        tracer = self._tracer
+        if not tracer.enabled:
+            return method(*args,**kwargs)
+        stats = tracer.get(self._device,command)
+        with stats.lock:
+            stats.calls += 1
+            timed = stats.calls % tracer.sampling == 0
+        start = time.perf_counter() if timed else 0.0
+        try:
+            result = method(*args,**kwargs)
+        except Exception:
+            with stats.lock:
+                stats.errors += 1
+            raise
+        duration = time.perf_counter()-start
+        nbytes = size(result)
+        with stats.lock:
+            if timed:
+                stats.add(duration)
+            stats.bytes += nbytes
+        return result
+
+    def _tap(self,operation:str,message,result):
+        session = self._tracer.session
+        if session is not None:
+            session.record(self._device,operation,message,result,self._com)
+        return result
+
+    def write(self,message,*args,**kwargs):
+        result = self._call(command_name(message),self._com.write,(message,)+args,kwargs,lambda result:len(message))
+        return self._tap('write',message,result)
+
+    def query(self,message,*args,**kwargs):
+        result = self._call(command_name(message),self._com.query,(message,)+args,kwargs,
+                            lambda result:len(message)+len(result or ''))
+        return self._tap('query',message,result)
+
+    def query_binary_values(self,message,*args,**kwargs):
+        def size(result):
+            itemsize = getattr(result,'itemsize',None) or getattr(getattr(result,'dtype',None),'itemsize',1)
+            return len(message) + len(result)*itemsize
+        result = self._call(command_name(message),self._com.query_binary_values,(message,)+args,kwargs,size)
+        return self._tap('query_binary_values',message,result)
+
+    def read(self,*args,**kwargs):
+        return self._tap('read',b'',self._call('read',self._com.read,args,kwargs,lambda result:len(result or '')))
+
+    def get_data(self,*args,**kwargs):
+        return self._tap('get_data',b'',self._call('get_data',self._com.get_data,args,kwargs,len))
+
+    def event(self,operation:str,position):
+        """ Step boundary of the device (PPK 'mark' or 'measure'), played by a replay, then recorded in the session
+        position : callable giving where the boundary is in the stream (indexes of samples), returned
+        unless the replay gives the recorded one back
+        """
+        value = None
+        if hasattr(type(self._com),'event'):     # a method, not a setting forwarded by __getattr__
+            value = self._com.event(operation)
+        if value is None:
+            value = position()
+        self._tap(operation,' '.join(str(index) for index in (value if isinstance(value,tuple) else (value,))),None)
+        return value
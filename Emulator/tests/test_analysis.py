@@ -0,0 +1,53 @@
+import numpy as np
+from Emulator import Analysis,Sweep
+
+def sweep(start=1.8,stop=2.1,step=0.1,slopes=4,origin=None):
+    """ Setpoint, slope and step of every point of a back_and_forth profile """
+    profile = Sweep.back_and_forth(start,stop,step,slopes,origin)
+    steps = np.arange(len(profile))
+    return profile,np.array(profile.voltages),np.array(profile.slopes),steps
+
+def test_no_hysteresis_when_current_follows_voltage():
+    for slopes in (2,3,4,5):
+        profile,voltage,slope,steps = sweep(slopes=slopes,origin=1.7)
+        h = Analysis.hysteresis(voltage,voltage,slope,setpoint=profile.setpoints(steps))
+        assert abs(h.area_current) < 1e-12 and abs(h.area_power) < 1e-12    # only the rounding of the means
+        for row in h.current:
+            np.testing.assert_array_equal(row,h.voltage)
+
+def test_slopes_aligned_on_setpoints():
+    profile,voltage,slope,steps = sweep()
+    current = np.where(slope % 2 == 0,voltage,voltage+1)     # falling slopes 1 above
+    h = Analysis.hysteresis(voltage,current,slope,setpoint=profile.setpoints(steps))
+    np.testing.assert_allclose(h.voltage,[1.9,2.0])      # the only setpoints all four slopes met
+    np.testing.assert_array_equal(h.rising,[True,False,True,False])
+    np.testing.assert_allclose(h.current_down-h.current_up,1)
+    assert np.isclose(h.area_current,0.1)
+
+def test_measured_voltage_kept_for_the_power():
+    profile,voltage,slope,steps = sweep(slopes=2)
+    measured = voltage+0.01
+    h = Analysis.hysteresis(measured,np.ones_like(voltage),slope,setpoint=profile.setpoints(steps))
+    np.testing.assert_allclose(h.voltage,[1.8,1.9,2.0])
+    np.testing.assert_allclose(h.power,[[1.81,1.91,2.01]]*2)
+
+def test_slope_totals_cover_every_step():
+    profile,voltage,slope,steps = sweep(slopes=2)
+    charge = np.full(len(voltage),1e-3)
+    h = Analysis.hysteresis(voltage,voltage,slope,charge=charge,setpoint=profile.setpoints(steps))
+    np.testing.assert_allclose(h.slope_charge,[4e-3,3e-3])     # 1.8..2.1 then 2.0..1.8
+    assert h.charge.shape == (2,3)
+
+def test_without_setpoints_points_are_paired_by_rank():
+    voltage = np.array([1.0,2.0,3.0,3.0,2.0,1.0])
+    h = Analysis.hysteresis(voltage,voltage*2,nslopes=2)
+    np.testing.assert_array_equal(h.voltage,[1.0,2.0,3.0])
+    np.testing.assert_array_equal(h.current_up,h.current_down)
+    assert h.area_current == 0
+
+def test_empty_logs():
+    assert Analysis.hysteresis([],[],[]) is None
+
+def test_trapezoid():
+    x = np.linspace(0,1,101)
+    assert np.isclose(Analysis.trapezoid(x,x),0.5)
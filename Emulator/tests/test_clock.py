@@ -0,0 +1,24 @@
+import threading
+import time
+from Emulator.Clock import Clock
+
+def test_waits_skipped_for_the_waiting_thread_only():
+    clock = Clock()
+    clock.skip = True
+    start,real = clock.monotonic(),time.monotonic()
+    for _ in range(100):
+        clock.sleep(0.01)
+    assert time.monotonic()-real < 0.5
+    assert clock.monotonic()-start >= 1.0
+    other = []
+    thread = threading.Thread(target=lambda:other.append(clock.monotonic()-time.monotonic()))
+    thread.start()
+    thread.join()
+    assert abs(other[0]) < 0.1      # the skipped waits of another thread are not its own
+
+def test_real_waits():
+    clock = Clock()
+    start = time.monotonic()
+    clock.sleep(0.02)
+    assert time.monotonic()-start >= 0.02
+    assert abs(clock.monotonic()-time.monotonic()) < 0.01
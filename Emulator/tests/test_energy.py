@@ -0,0 +1,43 @@
+import numpy as np
+from Emulator.Energy import Integrator
+from Emulator.Analysis import trapezoid
+
+def chunks(values,times,sizes):
+    start = 0
+    for size in sizes:
+        yield start,values[start:start+size],times[start:start+size]
+        start += size
+
+def test_running_total_is_the_trapezoid_of_the_stream():
+    rng = np.random.default_rng(0)
+    times = np.cumsum(rng.uniform(5e-6,15e-6,1000))
+    values = rng.normal(1000,50,1000)
+    integrator = Integrator()
+    ends = {}
+    for start,v,t in chunks(values,times,[100,1,299,600]):
+        integrator.push(v,t)
+        ends[start+len(v)] = trapezoid(values[:start+len(v)],times[:start+len(v)])*1e-6
+    for end,charge in ends.items():
+        assert np.isclose(integrator.at(end),charge,rtol=1e-12)
+    assert np.isclose(integrator.total,trapezoid(values,times)*1e-6,rtol=1e-12)
+    assert np.isnan(integrator.at(150))      # not the end of a chunk
+    assert integrator.at(0) == 0.0
+
+def test_windows_add_up():
+    times = np.arange(100)*1e-5
+    values = np.linspace(0,99,100)
+    integrator = Integrator(period=1e-5)
+    for _,v,t in chunks(values,times,[40,60]):
+        integrator.push(v,t)
+    # the segment before a sample belongs to it : [0,40) + [40,100) is the whole stream
+    first = integrator.at(40)
+    second = integrator.at(100)-first
+    assert np.isclose(second,integrator.span(values[39:],times[39:]),rtol=1e-12)
+    assert np.isclose(first+second,trapezoid(values,times)*1e-6,rtol=1e-12)
+
+def test_clear_from_an_origin():
+    integrator = Integrator()
+    integrator.clear(origin=500)
+    integrator.push(np.ones(10),np.arange(10)*1e-5)
+    assert integrator.at(500) == 0.0
+    assert np.isclose(integrator.at(510),9e-5*1e-6)
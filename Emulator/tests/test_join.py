@@ -0,0 +1,61 @@
+import numpy as np
+from Emulator import Join
+from Emulator.Store import Table
+
+TIMES = np.array([0.0,1.0,2.0,4.0,8.0])
+VALUES = np.array([10.0,20.0,30.0,50.0,90.0])
+T = np.array([-1.0,0.0,0.4,0.6,1.5,3.0,3.5,7.9,8.0,9.0])
+
+def reference(t,pick,tolerance=None):
+    result = []
+    for x in t:
+        index = pick(x)
+        if index is None or (tolerance is not None and abs(TIMES[index]-x) > tolerance):
+            result.append(np.nan)
+        else:
+            result.append(VALUES[index])
+    return np.array(result)
+
+def test_asof():
+    before = lambda x: max((i for i in range(len(TIMES)) if TIMES[i] <= x),default=None)
+    after = lambda x: min((i for i in range(len(TIMES)) if TIMES[i] >= x),default=None)
+    np.testing.assert_array_equal(Join.asof(T,TIMES,VALUES),reference(T,before))
+    np.testing.assert_array_equal(Join.asof(T,TIMES,VALUES,forward=True),reference(T,after))
+    np.testing.assert_array_equal(Join.asof(T,TIMES,VALUES,tolerance=0.5),reference(T,before,0.5))
+
+def test_nearest():
+    closest = lambda x: int(np.argmin(np.abs(TIMES-x)))      # the earlier one on a tie
+    np.testing.assert_array_equal(Join.nearest(T,TIMES,VALUES),reference(T,closest))
+    np.testing.assert_array_equal(Join.nearest(T,TIMES,VALUES,tolerance=0.5),reference(T,closest,0.5))
+
+def test_interpolated():
+    expected = np.interp(T,TIMES,VALUES)
+    expected[(T < TIMES[0]) | (T > TIMES[-1])] = np.nan
+    np.testing.assert_allclose(Join.interpolated(T,TIMES,VALUES),expected)
+    gaps = Join.interpolated(T,TIMES,VALUES,tolerance=0.5)
+    assert np.isnan(gaps[T == 3.0][0]) and gaps[T == 3.5][0] == 45.0
+
+def test_groups_join_within_a_step():
+    t = np.array([0.9,1.1,2.9,3.1])
+    mine = np.array([0,1,1,2])
+    theirs = np.array([0,0,1,1,2])
+    groups = (mine,theirs)
+    np.testing.assert_array_equal(Join.nearest(t,TIMES,VALUES,groups=groups),[20.0,30.0,30.0,90.0])
+    np.testing.assert_array_equal(Join.asof(t,TIMES,VALUES,groups=groups),[10.0,np.nan,30.0,np.nan])
+    np.testing.assert_array_equal(Join.asof(t,TIMES,VALUES,forward=True,groups=groups),[20.0,30.0,50.0,90.0])
+    missing = (mine,np.array([0,0,2,2,2]))     # no reading in step 1
+    assert np.isnan(Join.nearest(t,TIMES,VALUES,groups=missing)[1:3]).all()
+
+def test_merge():
+    voltage = Table('OSCI')
+    voltage.extend(t=[0.1,1.1,2.1],albert=[1.0,2.0,3.0],step=[0,1,2])
+    current = Table('PPK')
+    current.extend(t=[0.5,1.5,2.5],Iout=[100.0,200.0,300.0],Q=[1e-6,2e-6,3e-6],step=[0,1,2])
+    current.columns['Iout'].unit = 'uA'
+    merged = Join.merge(voltage,'albert',current)
+    assert merged.keys() >= {'t','V','I','P','Q','E','step'}
+    np.testing.assert_array_equal(merged['I'],[100.0,200.0,300.0])
+    np.testing.assert_allclose(merged['P'],[1e-4,4e-4,9e-4])
+    np.testing.assert_allclose(merged['E'],[1e-6,4e-6,9e-6])
+    np.testing.assert_array_equal(merged['step'],[0,1,2])
+    assert merged.columns['I'].unit == 'uA' and merged.columns['E'].unit == 'J'
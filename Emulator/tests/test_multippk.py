@@ -0,0 +1,61 @@
+import time
+import pytest
+from Emulator.MultiPPK import PPKProcess,SimulatedPPK2
+from Emulator.SIMemu import Bench
+
+class Unplugged(SimulatedPPK2):
+    """ Simulated PPK2 whose port fails after a few reads, in the acquisition process """
+    def __call__(self):
+        ppk2 = super().__call__()
+        get_data,reads = ppk2.get_data,[0]
+        def failing():
+            reads[0] += 1
+            if reads[0] > 5:
+                raise OSError("device disconnected")
+            return get_data()
+        ppk2.get_data = failing
+        return ppk2
+
+def process(opener):
+    ppk = PPKProcess('SIM0',buffer_duration=1)
+    ppk.connect_to_simulator(Bench())
+    ppk.opener = opener
+    return ppk
+
+def wait_death(ppk,timeout=10):
+    deadline = time.monotonic()+timeout
+    while ppk.process.is_alive() and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+def test_error_of_the_process_raised_by_measure():
+    ppk = process(Unplugged())
+    try:
+        ppk.setup()
+        wait_death(ppk)
+        ppk.mark()
+        with pytest.raises(RuntimeError,match="device disconnected"):
+            ppk.measure()
+        ppk.stop()     # reported once
+    finally:
+        ppk.release()
+
+def test_error_of_the_process_raised_by_stop():
+    ppk = process(Unplugged())
+    try:
+        ppk.setup()
+        wait_death(ppk)
+        with pytest.raises(RuntimeError,match="device disconnected"):
+            ppk.stop()
+    finally:
+        ppk.release()
+
+def test_running_process_measures():
+    ppk = process(SimulatedPPK2())
+    try:
+        ppk.setup()
+        ppk.mark()
+        time.sleep(0.2)
+        ppk.measure()
+        assert len(ppk.log['Iout']) == 1
+    finally:
+        ppk.release()
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('ppk2_api')
+from Benchmark.bench_ppk_decoder import synthetic_dump,reference_api,chunks
+from Emulator.PPKdecoder import PPKDecoder
+
+DATA = synthetic_dump(0.2)     # 20000 frames, range changes and spikes
+
+def decode(data,size):
+    decoder = PPKDecoder.from_api(reference_api())
+    parts = [decoder.decode(piece) for piece in chunks(data,size)]
+    return np.concatenate([p[0] for p in parts]),np.concatenate([p[1] for p in parts]),decoder
+
+def test_same_samples_as_get_samples():
+    api = reference_api()
+    reference = []
+    for piece in chunks(DATA,2000):
+        reference.extend(api.get_samples(piece)[0])
+    current,digital,_ = decode(DATA,2000)
+    reference = np.asarray(reference)
+    assert len(current) == len(reference)
+    error = np.abs(current-reference)/np.maximum(np.abs(reference),1e-3)
+    assert error.max() < 1e-6
+    np.testing.assert_array_equal(digital,np.frombuffer(DATA,dtype='<u4') >> 24)
+
+def test_independent_of_the_chunks():
+    current,digital,_ = decode(DATA,len(DATA))
+    for size in (1,7,4094):       # frames cut anywhere, the spike filter carried over
+        other,others,decoder = decode(DATA[:40000],size)
+        np.testing.assert_array_equal(other,current[:10000])
+        np.testing.assert_array_equal(others,digital[:10000])
+
+def test_partial_frame_kept():
+    decoder = PPKDecoder.from_api(reference_api())
+    current,_ = decoder.decode(DATA[:6])
+    assert len(current) == 1 and decoder.remainder == DATA[4:6]
+    current,_ = decoder.decode(DATA[6:7])
+    assert len(current) == 0
+    current,_ = decoder.decode(DATA[7:8])
+    assert len(current) == 1 and decoder.remainder == b''
@@ -0,0 +1,52 @@
+import numpy as np
+from Emulator.Pyramid import Pyramid
+from Emulator.RingBuffer import RingBuffer
+
+RATE = 1000
+
+def feed(pyramid,raw,n,chunk=137,seed=0):
+    values = np.random.default_rng(seed).normal(100,10,n).astype(np.float32)    # the dtype of a PPK stream
+    times = np.arange(n)/RATE
+    for start in range(0,n,chunk):
+        if raw is not None:
+            raw.push(values[start:start+chunk],times[start:start+chunk])
+        pyramid.push(values[start:start+chunk],times[start:start+chunk])
+    return values
+
+def check(stats,samples):
+    samples = samples.astype(np.float64)
+    assert stats.n == len(samples)
+    assert np.isclose(stats.mean,samples.mean(),rtol=1e-12)
+    assert stats.min == samples.min() and stats.max == samples.max()
+    assert np.isclose(stats.std,samples.std(),rtol=1e-6)
+
+def test_stats_with_the_raw_samples():
+    raw = RingBuffer(10000)
+    pyramid = Pyramid(RATE,(10,10,10),raw=raw,keep=(None,None,None))
+    values = feed(pyramid,raw,5000)
+    for start,stop in ((0,5000),(3,4997),(1234,1240),(999,2001),(4990,5000)):
+        check(pyramid.stats(start,stop),values[start:stop])
+    check(pyramid.stats(2500),values[2500:])
+
+def test_stats_rounded_to_the_blocks_without_raw():
+    pyramid = Pyramid(RATE,(10,10,10),keep=(None,None,None))
+    values = feed(pyramid,None,5000)
+    check(pyramid.stats(100,4900),values[100:4900])
+    check(pyramid.stats(105,4895),values[100:4900])    # edges rounded out to the blocks of 10
+
+def test_index_and_window():
+    raw = RingBuffer(10000)
+    pyramid = Pyramid(RATE,(10,10,10),raw=raw,keep=(None,None,None))
+    values = feed(pyramid,raw,5000)
+    for t,index in ((0.0,0),(0.0005,1),(1.0,1000),(2.3455,2346),(4.9995,5000)):
+        assert pyramid.index(t) == index
+    check(pyramid.window(1.0,2.0),values[1000:2000])
+
+def test_rings_keep_the_recent_blocks():
+    pyramid = Pyramid(RATE,(10,10,10),keep=(1,2,None))     # 100 blocks of 10, 20 blocks of 100
+    values = feed(pyramid,None,10000)
+    assert pyramid.levels[0].oldest == 900 and pyramid.levels[1].oldest == 80
+    check(pyramid.stats(9500,10000),values[9500:10000])     # still in level 0
+    check(pyramid.stats(8010,8990),values[8000:9000])       # level 1 only : rounded to blocks of 100
+    check(pyramid.stats(10,990),values[0:1000])             # level 2 only : rounded to blocks of 1000
+    check(pyramid.stats(0),values)
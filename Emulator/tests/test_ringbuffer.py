@@ -0,0 +1,32 @@
+import numpy as np
+from Emulator.RingBuffer import RingBuffer
+
+def stream(n,start=0):
+    values = np.arange(start,start+n,dtype=np.float64)
+    return values,values/100
+
+def test_window_across_the_wrap():
+    buffer = RingBuffer(10)
+    for start in range(0,25,5):
+        buffer.push(*stream(5,start))
+    assert buffer.head == 25 and buffer.oldest() == 15
+    values,times,stop = buffer.window(12)
+    np.testing.assert_array_equal(values,np.arange(15,25))     # 12..14 are overwritten
+    np.testing.assert_array_equal(times,np.arange(15,25)/100)
+    assert stop == 25
+    values,_,stop = buffer.window(18,22)
+    np.testing.assert_array_equal(values,[18,19,20,21])
+    assert stop == 22
+
+def test_chunk_larger_than_the_buffer():
+    buffer = RingBuffer(4)
+    buffer.push(*stream(10))
+    assert buffer.head == 10
+    np.testing.assert_array_equal(buffer.window(0)[0],[6,7,8,9])
+
+def test_empty_window_and_mean():
+    buffer = RingBuffer(8)
+    assert buffer.mean(0) is None
+    buffer.push(*stream(6))
+    assert len(buffer.window(6)[0]) == 0
+    assert buffer.mean(2,4) == 2.5
@@ -0,0 +1,42 @@
+import numpy as np
+from Emulator.Store import Store,Column
+
+def test_column_grows_and_keeps_its_values():
+    column = Column('Iout',capacity=2)
+    for value in range(5):
+        column.append(value)
+    column.extend([5,6])
+    np.testing.assert_array_equal(column.view(),np.arange(7))
+
+def test_rows_stay_aligned():
+    store = Store()
+    table = store.table('OSCI')
+    table.add_column('t')
+    table.add_column('albert')
+    store.tag(step=0)
+    table.append(t=0.0,albert=1.02)
+    table.append(t=1.0)                      # a channel that failed
+    table.append(t=2.0,albert=3.02,extra=5.0)     # a column created late
+    store.tag()
+    table.extend(t=[3.0,4.0])
+    assert all(len(table[name]) == 5 for name in table.keys())
+    np.testing.assert_array_equal(table['albert'],[1.02,np.nan,3.02,np.nan,np.nan])
+    np.testing.assert_array_equal(table['extra'],[np.nan,np.nan,5.0,np.nan,np.nan])
+    np.testing.assert_array_equal(table['step'],[0,0,0,-1,-1])
+
+class Recorder:
+    def __init__(self):
+        self.rows = {}
+    def write(self,stream,**columns):
+        for name,values in columns.items():
+            self.rows.setdefault(name,[]).extend(np.atleast_1d(values))
+
+def test_recorded_columns_stay_aligned():
+    store = Store()
+    store.recorder = Recorder()
+    table = store.table('PPK')
+    table.append(t=0.0,Iout=1.0)
+    table.append(t=1.0,Iout=2.0,Q=3.0)
+    rows = store.recorder.rows
+    assert len(rows['t']) == len(rows['Iout']) == len(rows['Q']) == 2
+    assert np.isnan(rows['Q'][0]) and rows['Q'][1] == 3.0
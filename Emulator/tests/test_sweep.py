@@ -0,0 +1,39 @@
+import numpy as np
+from Emulator import Sweep
+
+def test_back_and_forth_on_one_grid():
+    profile = Sweep.back_and_forth(1.8,2.1,0.1,slopes=4,origin=1.7)
+    voltages,slopes = np.array(profile.voltages),np.array(profile.slopes)
+    grid = [1.8,1.9,2.0,2.1]
+    np.testing.assert_allclose(voltages[slopes == 0],grid)
+    np.testing.assert_allclose(voltages[slopes == 1],grid[::-1][1:])
+    np.testing.assert_allclose(voltages[slopes == 2],grid[1:])
+    np.testing.assert_allclose(voltages[slopes == 3],grid[::-1][1:])
+    assert (np.diff(voltages) != 0).all()      # no setpoint repeated at a turnaround
+    assert profile.lead == 1.7 and 1.7 not in profile.voltages
+
+def test_ramps_in_centivolts():
+    profile = Sweep.linear(1.85,5.00,0.05)
+    assert len(profile) == 64 and profile.voltages[-1] == 5.0
+    assert Sweep.linear(2.0,1.0,0.3).voltages == [2.0,1.7,1.4,1.1,1.0]
+
+def test_setpoints_of_steps():
+    profile = Sweep.back_and_forth(1.0,1.2,0.1)
+    np.testing.assert_allclose(profile.setpoints([0,2,3,4]),[1.0,1.2,1.1,1.0])
+
+class Supply:
+    def __init__(self):
+        self.store = Sweep.Store()
+        self.setpoints = []
+    def setOperatingPoint(self,voltage,current):
+        self.setpoints.append(voltage)
+
+def test_lead_in_neither_logged_nor_measured():
+    ps = Supply()
+    measured = []
+    profile = Sweep.back_and_forth(1.0,1.1,0.1,origin=0.9)
+    done = Sweep.Sweep(ps,profile,1,measure=lambda:measured.append(ps.setpoints[-1]),dwell=0).run()
+    assert done == 3 and ps.setpoints == [0.9,1.0,1.1,1.0]
+    assert measured == [1.0,1.1,1.0]
+    np.testing.assert_allclose(ps.store['Sweep']['Vset'],[1.0,1.1,1.0])
+    np.testing.assert_array_equal(ps.store['Sweep']['step'],[0,1,2])
@@ -4,55 +4,53 @@ in optic of the EARLYBIRD research project : https://hal.science/hal-04663862v1
 """
 
 from Emulator import PSemu,PPKemu,OSCIemu
+from Emulator.Store import Store
+from Emulator.Sampler import Sampler
+from Emulator.Settle import Settler,PPKSource
+from Emulator import Sweep,Analysis,Join
+from Emulator.Decimate import DecimatedLine,DecimatedFill
+from Emulator.Recorder import Recorder
+from Emulator import Trace,Clock
+from Emulator.Session import SessionRecorder,Replay
+import os
 import time
-import matplotlib.pyplot as plt
-import threading
+import sys
 
 #_________plotting function_________#
 
-def preparation(nbpente:int=2):        # nb of back and forward for the voltage
-    tension = osci.waveforms['albert']
-    coup = len(tension)//nbpente
-    tensionref = tension[:coup]
-    courant = [el/1000 for el in ppk.log['Iout']] # Conversion from uA to mA
-    courant1=[]    # 1 for the incrementation phase
-    courant2=[]    # 2 for the decrementation phase
-    P = [eli*elu for eli,elu in zip(tension,courant)]
-    P1 = []
-    P2 = []
-    
-    diffc = []   # Differences of power consumption between increment and decrement voltage 
-    diffp = []
-    for i in range(coup):
-        courant1.append(courant[i])
-        courant2.append(courant[-1-i])
-        P1.append(P[i])
-        P2.append(P[-1-i])        
-        calc = (courant1[i]+courant2[i])/2
-        diffc.append(calc)
-        calc = (P1[i]+P2[i])/2
-        diffp.append(calc)
-    
-    return tensionref,courant1,courant2,P1,P2,diffc,diffp  # data treated, ready for plot
+def preparation(nbpente:int=2):        # nb of back and forward for the voltage, if the logs have no slope tag
+    # current of the PPK at the time of each voltage reading, whatever the number of readings of each device
+    merged = Join.merge(osci.waveforms,'albert',ppk.log)
+    slope = merged['slope'] if 'slope' in merged else None
+    setpoint = profile.setpoints(merged['step']) if 'step' in merged else None   # the slopes compared setpoint by setpoint
+    return Analysis.hysteresis(merged['V'],merged['I'],slope,nbpente,scale=1e-3,charge=merged['Q'],setpoint=setpoint)  # Conversion from uA to mA
 
 def showLogs():
-    tension,courant1,courant2,P1,P2,diffc,diffp = preparation()
+    import matplotlib.pyplot as plt    # loaded once the measures are done
+    h = preparation()
+    if h is None:    # nothing measured (aborted or failed run)
+        print("No measure to show")
+        return
     fig,ax1 = plt.subplots()
     ax1.set_xlabel('Tension in V')
-    ax1.plot(tension,courant1,ls='-',color='blue')
-    ax1.plot(tension,courant2,ls=':',color='blue')
-    ax1.plot(tension,diffc,ls='-',color='black')
-    ax1.fill_between(tension,courant1,courant2,color='cyan',alpha=0.2)
+    # long logs are drawn decimated (min/max of blocks), again at each zoom
+    for courant,rising in zip(h.current,h.rising):    # solid when going up, dotted when going down
+        DecimatedLine(ax1,h.voltage,courant,ls='-' if rising else ':',color='blue')
+    DecimatedLine(ax1,h.voltage,h.mean_current,ls='-',color='black')
+    DecimatedFill(ax1,h.voltage,h.current_up,h.current_down,color='cyan',alpha=0.2)
     ax1.set_ylabel('Current in mA',color='blue',fontsize=15)
     ax1.axvline(x=1.8,ls=':',color='green')
     ax1.axvline(x=3.3,ls=':',color='green')
 
     ax2=ax1.twinx()
-    ax2.plot(tension,P1,ls='-',color='red')
-    ax2.plot(tension,P2,ls=':',color='red')
-    ax2.plot(tension,diffp,ls='-',color='black')
-    ax2.fill_between(tension,P1,P2,color='magenta',alpha=0.2)
+    for P,rising in zip(h.power,h.rising):
+        DecimatedLine(ax2,h.voltage,P,ls='-' if rising else ':',color='red')
+    DecimatedLine(ax2,h.voltage,h.mean_power,ls='-',color='black')
+    DecimatedFill(ax2,h.voltage,h.power_up,h.power_down,color='magenta',alpha=0.2)
     ax2.set_ylabel('Power in W',color='red',fontsize=15)
+    if h.slope_energy is not None:    # energy and charge of each slope, integrated from the full rate stream
+        ax1.set_title('  '.join(f"{'up' if rising else 'down'} {E*1e3:.3g} mJ {Q*1e3:.3g} mC"
+                                for E,Q,rising in zip(h.slope_energy,h.slope_charge,h.rising)),fontsize=9)
 
     plt.show()
     
@@ -61,43 +59,64 @@ def setlogs(n):
     osci.set_log_interval(n)
     ppk.set_log_interval(n)
 
-def get_data():     # Call measurement methods in Emulator classes
-    osci.measure()
-    ps.measure()
-    ppk.measure()
+def get_data():     # Call measurement methods in Emulator classes, all at the same time
+    sampler.sample()
     
 res = input("Waiting ... ")
 
-# Creation of objects to communicate
-ps=PSemu.PS()        
-ppk = PPKemu.PPK()
-osci = OSCIemu.OSCI()
-# Connection with the differant devices
-ps.connect_to_device()
-ppk.connect_to_device()
-osci.connect_to_device()
-# Setting up for measures
-osci.set_channel(1,{"number":'1',"name":"albert","probe_ratio":'1',"vertical_scale":'2',"vertical_unit_name":"V","offset":'0',"offset_unit_name":"V","display":"ON"})
-ps.setup(1.8,1)
-ppk.setup()
-osci.setup()
-time.sleep(0.5) # to be sure everyone is ready
-U=180   # work with int, to avoid weird python approximation when incrementing in float (+0.05)
-
-while U<500:
-    U += 5
-    ps.setOperatingPoint(U/100,1)   # convert in V (180 = 1.80 V)
-    time.sleep(0.2)
-    get_data()
-        
-while U>180:
-    U -= 5
-    ps.setOperatingPoint(U/100,1)
-    time.sleep(0.2)
-    get_data()
-
-# Close communication
-ps.release()
-ppk.release()
-osci.release()
+# Creation of objects to communicate, all logging in the same store
+store = Store()
+ps=PSemu.PS(store=store)        
+ppk = PPKemu.PPK(store=store)
+osci = OSCIemu.OSCI(store=store)
+# Everything measured is also streamed to disk, read it back with Emulator.Recorder.Capture
+recorder = Recorder(time.strftime('captures/%Y%m%d-%H%M%S'))
+store.recorder = recorder
+ppk.recorder = recorder    # full rate PPK stream
+# Connection with the differant devices, or with simulated ones (python Main.py --sim),
+# or with the raw I/O recorded by a previous run (python Main.py --replay captures/.../session [--realtime])
+# --segmented : the scope records a segment per step, see OSCI.set_segmented_mode
+if '--replay' in sys.argv:
+    bench = Replay(sys.argv[sys.argv.index('--replay')+1],realtime='--realtime' in sys.argv)
+    Clock.clock.skip = not bench.realtime     # no dwell, settling or polling wait : as fast as the replay goes
+else:   # the raw I/O of this run, to play it back later
+    Trace.tracer.session = SessionRecorder(os.path.join(recorder.path,'session'))
+if '--sim' in sys.argv or '--replay' in sys.argv:
+    if '--sim' in sys.argv:
+        from Emulator.SIMemu import Bench
+        bench = Bench()
+    ps.connect_to_simulator(bench)
+    ppk.connect_to_simulator(bench)
+    osci.connect_to_simulator(bench)
+else:
+    ps.connect_to_device()
+    ppk.connect_to_device()
+    osci.connect_to_device()
+sampler = None
+try:
+    # Setting up for measures
+    osci.set_channel(1,{"number":'1',"name":"albert","probe_ratio":'1',"vertical_scale":'2',"vertical_unit_name":"V","offset":'0',"offset_unit_name":"V","display":"ON"})
+    if '--segmented' in sys.argv:   # a segment per step, triggered by a GPIO of the DUT on EXT TRIG, pulled by blocks
+        osci.set_segmented_mode()
+    ps.setup(1.8,1)
+    ppk.setup()
+    osci.setup()
+    sampler = Sampler(osci,ps,ppk)
+    settler = Settler(window=0.02,timeout=0.5)   # move on once the PPK current is stable
+    source = PPKSource(ppk)
+    Clock.clock.sleep(0.5) # to be sure everyone is ready
+    # 1.85 V to 5 V and back, by 0.05 V, from the 1.80 V of the setup
+    profile = Sweep.back_and_forth(1.85,5.00,0.05,slopes=2,origin=1.80)
+    sweep = Sweep.Sweep(ps,profile,1,measure=get_data,settler=settler,source=source,marks=[ppk])
+    sweep.run()
+finally:
+    # Close communication, the capture is complete whatever stopped the run
+    if sampler is not None:
+        sampler.close()
+    ps.release()
+    ppk.release()
+    osci.release()
+    recorder.close()
+    if Trace.tracer.session is not None:
+        Trace.tracer.session.close()
 showLogs() 
\ No newline at end of file
@@ -4,8 +4,14 @@ of the EARLYBIRD research project : https://hal.science/hal-04663862v1
 Include an user interface, if you don't want it, check the main.py file
 """
 from Emulator import PSemu,OSCIemu,PPKemu
-import time 
+from Emulator.Store import Store
+from Emulator.Sampler import Sampler
+from Emulator.Settle import Settler,PPKSource,PSSource
+from Emulator import Sweep,Analysis,Join
+from Emulator.Decimate import DecimatedLine,DecimatedFill
+import queue
 from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg as FCTA 
 import webbrowser
 import threading
@@ -14,59 +20,45 @@ from tkinter import ttk
 from tkinter import messagebox
 
 #____________functions use to control devices______________#   
-def preparation(nbpente:int=2):        # nb of back and forward for the tension
+def preparation(nbpente:int=2):        # nb of back and forward for the tension, if the logs have no slope tag
     global ps,ppk,osci,El_osci_3
-    try:
-        tension = osci.waveforms[El_osci_3.get()]
-    except NameError:  # If no test have been run, osci doesn't exist
+    if osci is None:  # If no test have been run, osci doesn't exist
         messagebox.showerror(title='No logs registered',message="You should run at least one test before that")
         return
-    coup = len(tension)//nbpente
-    tensionref = tension[:coup]
-    if amp_source == 'PPK':
-        courant = [el/1000 for el in ppk.log['Iout']]
+    if amp_source.get() == 'PPK':
+        log,toAmpere,scale = ppk.log,1e-6,1e-3   # Conversion from uA to mA
     else:
-        courant = [el*1000 for el in ps.log['Iout']] # Conversion from uA to mA
-    courant1=[]    # 1 for the incrementation phase
-    courant2=[]    # 2 for the decrementation phase
-    P = [eli*elu for eli,elu in zip(tension,courant)]
-    P1 = []
-    P2 = []
-    
-    diffc = []   # Differences of power consumption between increment and decrement voltage 
-    diffp = []
-    for i in range(coup):
-        courant1.append(courant[i])
-        courant2.append(courant[-1-i])
-        P1.append(P[i])
-        P2.append(P[-1-i])        
-        calc = (courant1[i]+courant2[i])/2
-        diffc.append(calc)
-        calc = (P1[i]+P2[i])/2
-        diffp.append(calc)
-    
-    return tensionref,courant1,courant2,P1,P2,diffc,diffp  # data treated, ready for plot
+        log,toAmpere,scale = ps.log,1,1e3        # Conversion from A to mA
+    # current at the time of each voltage reading, aligned on the timestamps of the devices
+    merged = Join.merge(osci.waveforms,El_osci_3.get(),log,scale=toAmpere)
+    slope = merged['slope'] if 'slope' in merged else None
+    charge = merged['Q'] if 'Q' in merged else None   # integrated by the PPK only
+    setpoint = sweep.profile.setpoints(merged['step']) if 'step' in merged else None   # the slopes compared setpoint by setpoint
+    return Analysis.hysteresis(merged['V'],merged['I'],slope,nbpente,scale,charge,setpoint)  # data treated, ready for plot
 
 def showLogs():
     # If logs are empty, preparation will return None
-    try:
-        tension,courant1,courant2,P1,P2,diffc,diffp = preparation()
-    except TypeError: # And then we abort the show function
+    h = preparation()
+    if h is None: # And then we abort the show function
         return
     fig,ax1 = plt.subplots()
     ax1.set_xlabel('Tension in V')
-    ax1.plot(tension,courant1,ls='-',color='blue')
-    ax1.plot(tension,courant2,ls=':',color='blue')
-    ax1.plot(tension,diffc,ls='-',color='black')
-    ax1.fill_between(tension,courant1,courant2,color='cyan',alpha=0.2)
+    # long logs are drawn decimated (min/max of blocks), again at each zoom
+    for courant,rising in zip(h.current,h.rising):    # solid when going up, dotted when going down
+        DecimatedLine(ax1,h.voltage,courant,ls='-' if rising else ':',color='blue')
+    DecimatedLine(ax1,h.voltage,h.mean_current,ls='-',color='black')
+    DecimatedFill(ax1,h.voltage,h.current_up,h.current_down,color='cyan',alpha=0.2)
     ax1.set_ylabel('Current in mA',color='blue',fontsize=15)
 
     ax2=ax1.twinx()
-    ax2.plot(tension,P1,ls='-',color='red')
-    ax2.plot(tension,P2,ls=':',color='red')
-    ax2.plot(tension,diffp,ls='-',color='black')
-    ax2.fill_between(tension,P1,P2,color='magenta',alpha=0.2)
+    for P,rising in zip(h.power,h.rising):
+        DecimatedLine(ax2,h.voltage,P,ls='-' if rising else ':',color='red')
+    DecimatedLine(ax2,h.voltage,h.mean_power,ls='-',color='black')
+    DecimatedFill(ax2,h.voltage,h.power_up,h.power_down,color='magenta',alpha=0.2)
     ax2.set_ylabel('Power in W',color='red',fontsize=15)
+    if h.slope_energy is not None:    # energy and charge of each slope, integrated from the full rate stream
+        ax1.set_title('  '.join(f"{'up' if rising else 'down'} {E*1e3:.3g} mJ {Q*1e3:.3g} mC"
+                                for E,Q,rising in zip(h.slope_energy,h.slope_charge,h.rising)),fontsize=9)
 
     plt.show()
 
@@ -75,53 +67,199 @@ def set_logs(n):
     ppkemu.setLogInterval(n)
 
 def get_data():
-    global ps,ppk,osci
-    if amp_source=='PPK':
-        ppk.measure()
-    osci.measure()
-    ps.measure()
+    global sampler
+    sampler.sample()   # every device measure at the same time
        
 def go_test():
-    global pvemu,ppkemu,loader,amp_source,ps,ppk,osci
-    ps = PSemu.PS(UI=True)        # Creation of object to communicate (Look PSemu.py)
-    ps.connect_to_device()
+    global pvemu,ppkemu,loader,amp_source,ps,ppk,osci,store,sampler,sweep,worker
+    if worker is not None and worker.is_alive():   # a test is already running
+        return
+    # devices are created and connected at the first test only, the next ones reuse them
+    if store is None:
+        store = Store()               # Every device log in the same store
+    for table in store.tables.values():
+        table.clear()                 # each test starts with empty logs
+    if ps is None:
+        ps = PSemu.PS(UI=True,store=store)        # Creation of object to communicate (Look PSemu.py)
+        ps.connect_to_device()
     
-    if amp_source=='PPK':
-        ppk = PPKemu.PPK(UI=True)
-        ppk.connect_to_device()
+    if amp_source.get()=='PPK':
+        if ppk is None:
+            ppk = PPKemu.PPK(UI=True,store=store)
+            ppk.connect_to_device()
         ppk.setup()
         
-    osci = OSCIemu.OSCI(UI=True)
-    osci.connect_to_device()
+    if osci is None:
+        osci = OSCIemu.OSCI(UI=True,store=store)
+        osci.connect_to_device()
     osci.set_channel(1,{"number":'1',"name":El_osci_3.get(),"probe_ratio":'1',"vertical_scale":El_osci_5.get(),"vertical_unit_name":El_osci_6.get(),"offset":El_osci_8.get(),"offset_unit_name":El_osci_9.get(),"display":"ON"})
-    osci.setup()
-
-    ps.setup(float(V_min.get()),1)    
-
-    U=float(V_min.get())*100
-    # A way to avoid weird approximations when increment with float, is to convert in integers
-    # here for exemple, i multiply U by 100 (precision of power supply to cV) : 1.8 => 180
-    # Then i add integer associated with the step (1 => +100, 0.1 => +10) (180 => 280, 180 => 190)
-    # and divide by 100 for the Power supply command (280=>2.80, 190+>1.90)
-
-    I = float(A_set.get())
-    while U<float(V_max.get())*100:
-        ps.setOperatingPoint(U/100,I) 
-        time.sleep(0.1)
-        get_data()
-        U += 100*float(step.get())
-        
-    while U>float(V_min.get())*100:
-        U -= 100*float(step.get())
-        ps.setOperatingPoint(U/100,I)
-        time.sleep(0.1)
-        get_data()
+    if segmented.get():
+        osci.set_segmented_mode()
+        # one step below V_min : the first point is a new setpoint too, signaled by the DUT
+        ps.setup(float(V_min.get())-float(step.get()),1)
+    else:
+        osci.set_measure_mode()
+        ps.setup(float(V_min.get()),1)
+    osci.setup()    # after the supply : armed in segmented mode
+    sampler = Sampler(osci,ps,ppk if amp_source.get()=='PPK' else None)
+    # after each setpoint, wait for the current to be stable instead of a fixed time
+    if amp_source.get()=='PPK':
+        settler,source = Settler(window=0.02,timeout=0.3),PPKSource(ppk)
+    else:
+        # a readback per poll : never longer than the fixed dwell it replaces
+        settler,source = Settler(window=0.05,min_samples=3,timeout=0.1),PSSource(ps)
+
+    profile = Sweep.back_and_forth(float(V_min.get()),float(V_max.get()),float(step.get()),int(slopes.get()))
+    # the last point measured goes to the live plot, the widgets are read here as they belong to the UI thread
+    # (in segmented mode the scope is only read at the end, the setpoint stands for it)
+    name,segmentedMode = El_osci_3.get(),segmented.get()
+    def latest(table,column,step):
+        """ Value logged in a column for this step, None if the step logged nothing there """
+        if 'step' not in table or len(table['step']) == 0 or table['step'][-1] != step:
+            return None
+        return float(table[column][-1])
+    def measured(step,voltage):
+        return voltage if segmentedMode else latest(osci.waveforms,name,step)
+    def push(slope,tension,current):
+        try:
+            updates.put_nowait(('point',slope,tension,current))
+        except queue.Full:   # the UI is late, the acquisition never waits for it
+            pass
+    if amp_source.get()=='PPK':
+        def on_step(step,slope,voltage):   # called by the worker after each point
+            V,I = measured(step,voltage),latest(ppk.log,'Iout',step)
+            if V is not None and I is not None:   # the PPK logs nothing for a step without samples
+                push(slope,V,I*1e-3)   # uA to mA
+    else:
+        def on_step(step,slope,voltage):
+            # the readback of the supply is still on its way : the point goes once it is logged,
+            # from the I/O thread of the supply, the sweep goes on meanwhile
+            V = measured(step,voltage)
+            def done(readback):
+                if readback.exception() is None and V is not None:    # else raised by the next measure() or flush()
+                    push(slope,V,readback.result()[1]*1e3)   # A to mA
+            ps.lastReadback.add_done_callback(done)
+    sweep = Sweep.Sweep(ps,profile,float(A_set.get()),measure=get_data,settler=settler,source=source,
+                        marks=[ppk] if amp_source.get()=='PPK' else [],on_step=on_step)
+
+    live.reset(float(V_min.get()),float(V_max.get()))
+    go_button.config(state=DISABLED)
+    abort_button.config(state=NORMAL)
+    worker = threading.Thread(target=run_test,args=(sweep,ppk if amp_source.get()=='PPK' else None),daemon=True)
+    worker.start()
+    root.after(REFRESH,refresh)
+
+def run_test(sweep,ppk=None):
+    """ Body of the worker thread, the UI only hears from it through the updates queue """
+    try:
+        done = sweep.run()
+        sweep.ps.flush()    # last readbacks of the supply in the log
+        osci.collect()      # segments of the scope in the log, in segmented mode
+        updates.put(('done',done))
+    except Exception as e:
+        updates.put(('error',str(e)))
+    finally:
+        sampler.close()
+        if ppk is not None:
+            ppk.stop()    # no stream between two tests, the next setup() starts it again
+
+def abort_test():
+    if sweep is not None:
+        sweep.abort = True   # the sweep stops after the current point
+
+def refresh():
+    """ Move the points of the worker to the live plot, every REFRESH ms until the end of the test """
+    points = []
+    finished = None
+    while True:
+        try:
+            message = updates.get_nowait()
+        except queue.Empty:
+            break
+        if message[0] == 'point':
+            points.append(message[1:])
+        else:
+            finished = message
+    if points:
+        live.add(points)
+    if finished is None:
+        root.after(REFRESH,refresh)
+        return
+    go_button.config(state=NORMAL)
+    abort_button.config(state=DISABLED)
+    if finished[0] == 'error':
+        messagebox.showerror(title='Test failed',message=finished[1])
+
+class LivePlot:
+    """ I-V curve of the running test embedded in the window
+    Only the curves are redrawn (blitting), over a saved background of the axes,
+    the whole figure is drawn again only when the current goes out of the y axis.
+    """
+    def __init__(self,master):
+        self.figure = Figure(figsize=(5,4),dpi=100)
+        self.ax = self.figure.add_subplot()
+        self.canvas = FCTA(self.figure,master=master)
+        self.canvas.mpl_connect('draw_event',self._on_draw)
+        self.background = None
+        self.lines = {}    # slope -> Line2D
+        self.data = {}     # slope -> ([V], [mA])
+        self.reset(0,1)
+
+    def widget(self):
+        return self.canvas.get_tk_widget()
+
+    def reset(self,vmin:float,vmax:float):
+        self.ax.clear()
+        self.ax.set_xlabel('Tension in V')
+        self.ax.set_ylabel('Current in mA',color='blue')
+        margin = abs(vmax-vmin)*0.05 or 0.1
+        self.ax.set_xlim(min(vmin,vmax)-margin,max(vmin,vmax)+margin)
+        self.ax.set_ylim(0,1)
+        self.lines = {}
+        self.data = {}
+        self.canvas.draw()
+
+    def _on_draw(self,event):
+        # a full draw (reset, rescale, resize of the window) gives a new background
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for line in self.lines.values():
+            self.ax.draw_artist(line)
+
+    def add(self,points:list):
+        """ Append (slope, V, mA) points and redraw the curves """
+        low,high = self.ax.get_ylim()
+        rescale = False
+        for slope,voltage,current in points:
+            if slope not in self.lines:   # solid when going up, dotted when going down
+                self.lines[slope], = self.ax.plot([],[],ls='-' if slope % 2 == 0 else ':',color='blue',marker='.',animated=True)
+                self.data[slope] = ([],[])
+            self.data[slope][0].append(voltage)
+            self.data[slope][1].append(current)
+            rescale |= not low <= current <= high
+        for slope,line in self.lines.items():
+            line.set_data(*self.data[slope])
+        if rescale or self.background is None:
+            currents = [current for _,ys in self.data.values() for current in ys]
+            margin = (max(currents)-min(currents))*0.25 or abs(max(currents))*0.1 or 1
+            self.ax.set_ylim(min(currents)-margin,max(currents)+margin)
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            for line in self.lines.values():
+                self.ax.draw_artist(line)
+            self.canvas.blit(self.ax.bbox)
         
 #_______Other function for the UI_____________#
 def openlink():
     webbrowser.open('https://hal.science/hal-04663862v1')
         
 #______________________Creation of the tkinter UI___________________________#
+REFRESH = 100     # ms between two redraws of the live plot
+updates = queue.Queue(maxsize=256)    # points and end of the test, from the worker thread to the UI
+sweep = None
+worker = None
+store = ps = ppk = osci = None    # created by the first test
+
 root = Tk()  # Create a new window
 root.title("General control")
 root.configure(padx=10, pady=10)
@@ -158,6 +296,10 @@ Label(root,text='Step :',justify='right',**default_label_style).grid(column=3,co
 step = ttk.Combobox(root,values=['1','0.1','0.01'],width=5,state='readonly')
 step.current(1)
 step.grid(column=6,columnspan=3,row=4)
+Label(root,text='Slopes :',**default_label_style).grid(column=9,row=4)
+slopes = ttk.Spinbox(root,width=3,from_=1,to=20,increment=1)
+slopes.set(2) # default value, up then down
+slopes.grid(column=10,row=4)
 Label(root,text='Enter Current',**default_label_style).grid(column=3,columnspan=3,row=5)
 A_set = ttk.Spinbox(root,width=10,from_=0,to=2,increment=0.001)
 A_set.set(0.01) # default value
@@ -205,9 +347,17 @@ El_osci_7.grid(column=8,row=9,rowspan=3)
 El_osci_8.grid(column=9,row=9,rowspan=3)
 El_osci_9.grid(column=10,row=9,rowspan=3)
 menu_osci.grid(column=0,row=9,columnspan=2,rowspan=3)
+segmented = BooleanVar()
+Checkbutton(root,variable=segmented,text='Segmented (a step per EXT trigger)',**default_label_style).grid(column=2,columnspan=9,row=12)
+
+go_button = Button(root,text='Go testing',command=go_test,**default_button_style)
+go_button.grid(column=0,columnspan=6,row=13)
+abort_button = Button(root,text='Abort',command=abort_test,state=DISABLED,**default_button_style)
+abort_button.grid(column=6,columnspan=5,row=13)
+Button(root,text='showresults',image=imggraph,compound="right",bg='#A10000',fg='#FFE9E9',bd=5,activebackground="#FF0000",command=showLogs).grid(column=0,columnspan=11,row=14)
+Button(root,text='EARLYBIRD project page',bg='blue',fg='white',activebackground="#00FAFF",command=openlink,bd=5).grid(column=0,columnspan=11,row=15)
 
-Button(root,text='Go testing',command=go_test,**default_button_style).grid(column=0,columnspan=11,row=12)
-Button(root,text='showresults',image=imggraph,compound="right",bg='#A10000',fg='#FFE9E9',bd=5,activebackground="#FF0000",command=showLogs).grid(column=0,columnspan=11,row=13)
-Button(root,text='EARLYBIRD project page',bg='blue',fg='white',activebackground="#00FAFF",command=openlink,bd=5).grid(column=0,columnspan=11,row=14)
+live = LivePlot(root)
+live.widget().grid(column=11,row=1,rowspan=15,padx=10)
 
 root.mainloop()
\ No newline at end of file